@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Any, List
+from typing import Any, List, Optional
 import numpy as np
 import pickle
 
@@ -26,13 +26,109 @@ def normalize_point_cloud(data: np.ndarray) -> np.ndarray:
         np.ndarray: normalized point cloud
     """
     transformed_data = data.copy()
-    centroid = np.mean(transformed_data, axis=1)
+    centroid = np.mean(transformed_data, axis=1, keepdims=True)
     transformed_data = transformed_data - centroid
     max_vector = np.max(np.sqrt(np.sum(transformed_data ** 2, axis=2)), axis=1)
-    transformed_data = transformed_data / max_vector
+    transformed_data = transformed_data / max_vector[:, np.newaxis, np.newaxis]
     return transformed_data
 
 
+def farthest_point_sampling(data: np.ndarray, num_samples: int, rng: Optional[np.random.RandomState] = None) -> np.ndarray:
+    """farthest point sampling, vectorized over the batch
+    Args:
+        data (np.ndarray): shape(batch, num_points, dim)
+        num_samples (int): number of sampled points
+        rng (np.random.RandomState, optional): random start points if given, otherwise start from the first points
+
+    Returns:
+        np.ndarray: indices of sampled points, shape(batch, num_samples)
+    """
+    batch_size, num_points, _ = data.shape
+    indices = np.zeros((batch_size, num_samples), dtype=np.int64)
+    min_distances = np.full((batch_size, num_points), np.inf, dtype=data.dtype)
+    if rng is None:
+        farthest = np.zeros(batch_size, dtype=np.int64)
+    else:
+        farthest = rng.randint(num_points, size=batch_size)
+    batch_indices = np.arange(batch_size)
+    for i in range(num_samples):
+        indices[:, i] = farthest
+        selected = data[batch_indices, farthest][:, np.newaxis, :]
+        distances = np.sum((data - selected) ** 2, axis=2)
+        np.minimum(min_distances, distances, out=min_distances)
+        farthest = np.argmax(min_distances, axis=1)
+    return indices
+
+
+def rotate_point_cloud(data: np.ndarray, rng: np.random.RandomState) -> np.ndarray:
+    """rotate point clouds randomly around the up (y) axis
+    Args:
+        data (np.ndarray): shape(batch, num_points, 3)
+
+    Returns:
+        np.ndarray: rotated point cloud
+    """
+    angles = rng.uniform(0, 2 * np.pi, size=len(data))
+    cos, sin = np.cos(angles), np.sin(angles)
+    zeros, ones = np.zeros_like(angles), np.ones_like(angles)
+    rotation = np.stack([np.stack([cos, zeros, sin], axis=1),
+                         np.stack([zeros, ones, zeros], axis=1),
+                         np.stack([-sin, zeros, cos], axis=1)], axis=1)
+    return np.matmul(data, rotation.astype(data.dtype))
+
+
+def scale_point_cloud(data: np.ndarray, rng: np.random.RandomState, low: float = 0.8, high: float = 1.25) -> np.ndarray:
+    """scale point clouds randomly
+    Args:
+        data (np.ndarray): shape(batch, num_points, 3)
+
+    Returns:
+        np.ndarray: scaled point cloud
+    """
+    scales = rng.uniform(low, high, size=(len(data), 1, 1))
+    return data * scales.astype(data.dtype)
+
+
+def jitter_point_cloud(data: np.ndarray, rng: np.random.RandomState, sigma: float = 0.01, clip: float = 0.05) -> np.ndarray:
+    """add clipped gaussian noise to each point
+    Args:
+        data (np.ndarray): shape(batch, num_points, 3)
+
+    Returns:
+        np.ndarray: jittered point cloud
+    """
+    noise = np.clip(sigma * rng.randn(*data.shape), -clip, clip)
+    return data + noise.astype(data.dtype)
+
+
+def augment_point_cloud(data: np.ndarray, rng: np.random.RandomState) -> np.ndarray:
+    """apply random rotation, scaling and jitter to a batch of point clouds
+    Args:
+        data (np.ndarray): shape(batch, num_points, 3)
+
+    Returns:
+        np.ndarray: augmented point cloud
+    """
+    data = rotate_point_cloud(data, rng)
+    data = scale_point_cloud(data, rng)
+    return jitter_point_cloud(data, rng)
+
+
+def load_point_cloud_txt(file_path: str) -> np.ndarray:
+    """load a point cloud of a comma separated text file
+    Args:
+        file_path (str): path to a text file with a point per line
+
+    Returns:
+        np.ndarray: shape(num_points, dim)
+    """
+    with open(file_path) as f:
+        lines = f.read().split()
+    num_columns = lines[0].count(",") + 1
+    data = np.array(",".join(lines).split(","), dtype=np.float32)
+    return data.reshape(-1, num_columns)
+
+
 def load_txt_file(file_path: str) -> List[str]:
     with open(file_path) as f:
         file_lines = [line.rstrip() for line in f]
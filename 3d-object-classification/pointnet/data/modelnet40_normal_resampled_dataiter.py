@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+from multiprocessing import Pool
 from typing import Dict, List, Optional, Tuple, Iterable
 import numpy as np
 from tqdm import tqdm
@@ -22,9 +23,9 @@ from nnabla.utils.data_source import DataSource
 from nnabla.logger import logger
 
 from .data_utils import (
-    load_from_pickle,
+    farthest_point_sampling,
+    load_point_cloud_txt,
     normalize_point_cloud,
-    save_as_pickle,
     load_txt_file,
 )
 
@@ -38,24 +39,49 @@ def load_dataset_path_file(data_dir: str, txt_file_name: str) -> List[str]:
     return data_paths
 
 
-def load_txt_as_np_array(
-    data_paths: Iterable[Tuple[str, str]], num_points: int, classes_dict: Dict[str, int]
-) -> Tuple[np.ndarray, np.ndarray]:
-    point_cloud_data = []
-    label_data = []
+def load_point_cloud(args: Tuple[str, int, str]) -> np.ndarray:
+    point_cloud_data_path, num_points, sampling = args
+    point_cloud = load_point_cloud_txt(point_cloud_data_path)
+    if sampling == "fps":
+        indices = farthest_point_sampling(
+            point_cloud[np.newaxis, :, :3], num_points)[0]
+        return point_cloud[indices]
+    return point_cloud[:num_points, :]
 
-    for data_path in tqdm(data_paths, total=len(data_paths)):
-        class_name, point_cloud_data_path = data_path
-        # point cloud
-        point_cloud = np.loadtxt(
-            point_cloud_data_path, delimiter=",").astype(np.float32)
-        point_cloud = point_cloud[:num_points, :]
-        point_cloud_data.append(point_cloud)
-        # label
-        label = int(classes_dict[class_name])
-        label_data.append(label)
 
-    return np.array(point_cloud_data, dtype=np.float32), np.array(label_data, dtype=np.int32)
+def load_txt_as_np_array(
+    data_paths: Iterable[Tuple[str, str]],
+    num_points: int,
+    classes_dict: Dict[str, int],
+    sampling: str = "first",
+    num_workers: Optional[int] = None,
+    out_path: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """parse text files in a process pool
+
+    Point clouds are written into a memory-mapped npy file of
+    shape(num_data, num_points, dim) if out_path is given.
+    """
+    tasks = [(path, num_points, sampling) for _, path in data_paths]
+    label_data = np.array([int(classes_dict[class_name])
+                          for class_name, _ in data_paths], dtype=np.int32)
+    point_cloud_data = None
+
+    with Pool(num_workers) as pool:
+        point_clouds = pool.imap(load_point_cloud, tasks, chunksize=16)
+        for i, point_cloud in enumerate(tqdm(point_clouds, total=len(tasks))):
+            if point_cloud_data is None:
+                shape = (len(tasks), ) + point_cloud.shape
+                if out_path is None:
+                    point_cloud_data = np.empty(shape, dtype=np.float32)
+                else:
+                    point_cloud_data = np.lib.format.open_memmap(
+                        out_path, mode="w+", dtype=np.float32, shape=shape)
+            point_cloud_data[i] = point_cloud
+
+    if out_path is not None:
+        point_cloud_data.flush()
+    return point_cloud_data, label_data
 
 
 class ModelNet40NormalResampledDataset(DataSource):
@@ -68,6 +94,8 @@ class ModelNet40NormalResampledDataset(DataSource):
         num_points: int,
         normalize: bool,
         rng: Optional[int] = None,
+        sampling: str = "first",
+        num_workers: Optional[int] = None,
     ) -> None:
         super().__init__(shuffle=shuffle, rng=rng)
         self._shuffle = shuffle
@@ -75,12 +103,13 @@ class ModelNet40NormalResampledDataset(DataSource):
         self._batch_size = batch_size
         self._normalize = normalize
 
-        if self._train:
-            processed_data_path = os.path.join(
-                data_dir, "train_modelnet40_normal_resampled.pkl")
-        else:
-            processed_data_path = os.path.join(
-                data_dir, "test_modelnet40_normal_resampled.pkl")
+        if sampling not in ("first", "fps"):
+            raise ValueError(f"Unknown sampling: {sampling}")
+        split = "train" if self._train else "test"
+        processed_data_path = os.path.join(
+            data_dir, f"{split}_modelnet40_normal_resampled_{sampling}{num_points}.npy")
+        processed_label_path = os.path.join(
+            data_dir, f"{split}_modelnet40_normal_resampled_label.npy")
 
         self._shape_names = load_txt_file(
             os.path.join(data_dir, "modelnet40_shape_names.txt"))
@@ -91,15 +120,18 @@ class ModelNet40NormalResampledDataset(DataSource):
             logger.info("Load from original datasets ...")
             txt_file_name = "modelnet40_train.txt" if train else "modelnet40_test.txt"
             data_paths = load_dataset_path_file(data_dir, txt_file_name)
-            self._point_clouds, self._labels = load_txt_as_np_array(
-                data_paths, num_points, self._classes_dict)
-            logger.info(f"Saving data as pkl ... to {processed_data_path}")
-            save_as_pickle((self._point_clouds, self._labels),
-                           processed_data_path)
-        else:
-            logger.info("Load from processed datasets ...")
-            processed_data = load_from_pickle(processed_data_path)
-            self._point_clouds, self._labels = processed_data
+            logger.info(f"Saving data as npy ... to {processed_data_path}")
+            # write to a temporary file so that an interrupted run is not
+            # taken as a processed dataset
+            tmp_path = processed_data_path + ".tmp.npy"
+            _, labels = load_txt_as_np_array(
+                data_paths, num_points, self._classes_dict, sampling, num_workers, tmp_path)
+            np.save(processed_label_path, labels)
+            os.replace(tmp_path, processed_data_path)
+
+        logger.info("Load from processed datasets ...")
+        self._point_clouds = np.load(processed_data_path, mmap_mode="r")
+        self._labels = np.load(processed_label_path)
 
         self._size = len(self._point_clouds)
         self._variables = ("point_cloud", "label")
@@ -138,6 +170,8 @@ def data_iterator_modelnet40_normal_resampled(
     with_memory_cache: bool = True,
     with_file_cache: bool = False,
     rng: Optional[int] = None,
+    sampling: str = "first",
+    num_workers: Optional[int] = None,
 ) -> DataIterator:
     dataset = ModelNet40NormalResampledDataset(
         data_dir,
@@ -146,6 +180,8 @@ def data_iterator_modelnet40_normal_resampled(
         shuffle,
         num_points,
         normalize,
+        sampling=sampling,
+        num_workers=num_workers,
     )
     return data_iterator(
         dataset,
@@ -84,7 +84,8 @@ def evaluate(args):
 
     # Data Iterator
     valid_data_iter = data_iterator_modelnet40_normal_resampled(
-        args.data_dir, valid_batch_size, False, False, args.num_points, normalize=True, stop_exhausted=True
+        args.data_dir, valid_batch_size, False, False, args.num_points, normalize=True, stop_exhausted=True,
+        sampling=args.sampling, num_workers=args.num_workers,
     )
 
     # Training-loop
@@ -107,6 +108,10 @@ def main():
     parser.add_argument("--context", type=str, default="cudnn")
     parser.add_argument("--snapshot_dir", type=str,
                         default="./pointnet_classification_result/seed_100/best")
+    parser.add_argument("--sampling", type=str, default="first", choices=["first", "fps"],
+                        help="How to sample num_points points of each shape, the first points or farthest point sampling")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="Number of processes parsing the dataset in preprocessing")
 
     args = parser.parse_args()
     evaluate(args)
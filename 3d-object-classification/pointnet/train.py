@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import Dict
+from typing import Dict, Optional
 import argparse
 import os
 
+import numpy as np
+
 import nnabla as nn
 from nnabla.ext_utils import get_extension_context
 from nnabla.utils.data_iterator import DataIterator
@@ -26,6 +28,7 @@ from nnabla.monitor import Monitor, MonitorSeries
 from model import pointnet_classification
 from loss import classification_loss_with_orthogonal_loss
 from data.modelnet40_normal_resampled_dataiter import data_iterator_modelnet40_normal_resampled
+from data.data_utils import augment_point_cloud
 from running_utils import categorical_accuracy, save_snapshot, set_global_seed, get_decayed_learning_rate
 
 
@@ -38,12 +41,15 @@ def train_one_epoch(
     learning_rate: float,
     train_monitors: Dict[str, Monitor],
     global_steps: int,
+    augmentation_rng: Optional[np.random.RandomState] = None,
 ) -> int:
     total_steps = global_steps
     train_data_iter._reset()
 
     for batch_data in train_data_iter:
         point_cloud, label = batch_data
+        if augmentation_rng is not None:
+            point_cloud = augment_point_cloud(point_cloud, augmentation_rng)
 
         train_vars["point_cloud"].d = point_cloud
         train_vars["label"].d = label
@@ -174,11 +180,15 @@ def train(args):
 
     # Data Iterator
     train_data_iter = data_iterator_modelnet40_normal_resampled(
-        args.data_dir, args.batch_size, True, True, args.num_points, normalize=True, stop_exhausted=True
+        args.data_dir, args.batch_size, True, True, args.num_points, normalize=True, stop_exhausted=True,
+        sampling=args.sampling, num_workers=args.num_workers,
     )
     valid_data_iter = data_iterator_modelnet40_normal_resampled(
-        args.data_dir, valid_batch_size, False, False, args.num_points, normalize=True, stop_exhausted=True
+        args.data_dir, valid_batch_size, False, False, args.num_points, normalize=True, stop_exhausted=True,
+        sampling=args.sampling, num_workers=args.num_workers,
     )
+    augmentation_rng = np.random.RandomState(
+        args.seed) if args.augment else None
 
     # Training-loop
     global_steps = 0
@@ -199,6 +209,7 @@ def train(args):
             decayed_learning_rate,
             train_monitors,
             global_steps,
+            augmentation_rng,
         )
 
         if i % args.eval_interval == 0:
@@ -236,6 +247,13 @@ def main():
 
     parser.add_argument("--eval_interval", type=int, default=2)
 
+    parser.add_argument("--sampling", type=str, default="first", choices=["first", "fps"],
+                        help="How to sample num_points points of each shape, the first points or farthest point sampling")
+    parser.add_argument("--num_workers", type=int, default=None,
+                        help="Number of processes parsing the dataset in preprocessing")
+    parser.add_argument("--augment", action="store_true",
+                        help="Apply random rotation, scaling and jitter to training batches")
+
     args = parser.parse_args()
     train(args)
 
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import nnabla as nn
 import cv2
 import models
@@ -21,29 +22,140 @@ from nnabla.ext_utils import get_extension_context
 import numpy as np
 import argparse
 
-parser = argparse.ArgumentParser(description='esrgan inference')
-parser.add_argument('--loadmodel', default='./ESRGAN_NNabla_model.h5',
-                    help='load model')
-parser.add_argument('--input_image', default='./baboon.png',
-                    help='input image')
-args = parser.parse_args()
-
-ctx = get_extension_context('cudnn', device_id=0)
-nn.set_default_context(ctx)
-nn.load_parameters(args.loadmodel)
-
-img = cv2.imread(args.input_image, cv2.IMREAD_COLOR)
-img = np.transpose(img, (2, 0, 1))[::-1]
-img = img * 1.0/255
-c, h, w = img.shape[0], img.shape[1], img.shape[2]
-x = nn.Variable((1, c, h, w))
-x.d = img
-
-y = models.rrdb_net(x, 64, 23)
-y.forward(clear_buffer=True)
-
-out = y.d.squeeze(0)
-output = out[::-1].transpose(1, 2, 0)
-output = (output * 255.0).round()
-cv2.imwrite('result.png', output)
-print("done")
+
+class TiledSuperResolution(object):
+    '''
+    Super-resolution of images of any size by tiles, with one graph of
+    `batch_size` tiles of `tile_size` x `tile_size` pixels reused for all the
+    tiles. Neighboring tiles overlap by `overlap` pixels and are blended
+    with weights decreasing linearly towards the tile borders, so that the
+    seams are not visible.
+    '''
+
+    def __init__(self, tile_size=128, overlap=16, batch_size=4):
+        if overlap >= tile_size:
+            raise ValueError('overlap ({}) must be smaller than tile_size ({})'.format(
+                overlap, tile_size))
+        self.tile_size = tile_size
+        self.overlap = overlap
+        with nn.auto_forward(False):
+            self.x = nn.Variable((batch_size, 3, tile_size, tile_size))
+            self.y = models.rrdb_net(self.x, 64, 23)
+        self.scale = self.y.shape[2] // tile_size
+        self.weight = self._feather_weight()
+
+    def _feather_weight(self):
+        size = self.tile_size * self.scale
+        ramp = max(self.overlap * self.scale, 1)
+        i = np.arange(size, dtype=np.float32)
+        w = np.minimum(np.minimum(i + 0.5, size - i - 0.5) / ramp, 1.0)
+        return np.outer(w, w)
+
+    def _tile_starts(self, length):
+        stride = self.tile_size - self.overlap
+        starts = list(range(0, length - self.tile_size + 1, stride))
+        if starts[-1] + self.tile_size < length:
+            starts.append(length - self.tile_size)
+        return starts
+
+    def __call__(self, img):
+        '''
+        Args:
+            img: numpy image of shape (3, H, W) in [0, 1]
+        Returns:
+            numpy image of shape (3, H * scale, W * scale)
+        '''
+        _, h, w = img.shape
+        # pad the images smaller than a tile
+        pad_h, pad_w = max(self.tile_size - h, 0), max(self.tile_size - w, 0)
+        if pad_h or pad_w:
+            img = np.pad(img, ((0, 0), (0, pad_h), (0, pad_w)), mode='edge')
+        tiles = [(i, j) for i in self._tile_starts(img.shape[1])
+                 for j in self._tile_starts(img.shape[2])]
+
+        s, t = self.scale, self.tile_size
+        out = np.zeros((3, img.shape[1] * s, img.shape[2] * s), np.float32)
+        weight = np.zeros(out.shape[1:], np.float32)
+        batch_size = self.x.shape[0]
+        for b in range(0, len(tiles), batch_size):
+            batch = tiles[b:b + batch_size]
+            x = np.zeros(self.x.shape, np.float32)
+            for k, (i, j) in enumerate(batch):
+                x[k] = img[:, i:i + t, j:j + t]
+            self.x.d = x
+            self.y.forward(clear_buffer=True)
+            for k, (i, j) in enumerate(batch):
+                out[:, i * s:(i + t) * s, j * s:(j + t) * s] += \
+                    self.y.d[k] * self.weight
+                weight[i * s:(i + t) * s, j * s:(j + t) * s] += self.weight
+        out /= weight
+        return out[:, :h * s, :w * s]
+
+
+def super_resolve(img):
+    '''
+    Super-resolution of the whole image in one graph.
+    '''
+    c, h, w = img.shape[0], img.shape[1], img.shape[2]
+    x = nn.Variable((1, c, h, w))
+    x.d = img
+
+    y = models.rrdb_net(x, 64, 23)
+    y.forward(clear_buffer=True)
+    return y.d.squeeze(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='esrgan inference')
+    parser.add_argument('--loadmodel', default='./ESRGAN_NNabla_model.h5',
+                        help='load model')
+    parser.add_argument('--input_image', default='./baboon.png',
+                        help='input image, or a directory of input images')
+    parser.add_argument('--output_dir', default='./',
+                        help='directory to save the results')
+    parser.add_argument('--tile_size', type=int, default=128,
+                        help='size of the tiles of the input image (0 to process the whole image at once)')
+    parser.add_argument('--tile_overlap', type=int, default=16,
+                        help='overlap of the neighboring tiles in the input image')
+    parser.add_argument('--tile_batch_size', type=int, default=4,
+                        help='number of tiles in a forward')
+    args = parser.parse_args()
+
+    ctx = get_extension_context('cudnn', device_id=0)
+    nn.set_default_context(ctx)
+    nn.load_parameters(args.loadmodel)
+
+    if os.path.isdir(args.input_image):
+        input_images = sorted(os.path.join(args.input_image, f)
+                              for f in os.listdir(args.input_image))
+        output_images = [os.path.join(args.output_dir, os.path.splitext(
+            os.path.basename(f))[0] + '.png') for f in input_images]
+    else:
+        input_images = [args.input_image]
+        output_images = [os.path.join(args.output_dir, 'result.png')]
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    if args.tile_size > 0:
+        super_resolve_tiled = TiledSuperResolution(
+            args.tile_size, args.tile_overlap, args.tile_batch_size)
+    for input_image, output_image in zip(input_images, output_images):
+        img = cv2.imread(input_image, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        img = np.transpose(img, (2, 0, 1))[::-1]
+        img = img * 1.0/255
+        if args.tile_size > 0:
+            out = super_resolve_tiled(img)
+        else:
+            out = super_resolve(img)
+
+        output = out[::-1].transpose(1, 2, 0)
+        output = (output.clip(0, 1) * 255.0).round()
+        cv2.imwrite(output_image, output)
+        print("saved", output_image)
+    print("done")
+
+
+if __name__ == '__main__':
+    main()
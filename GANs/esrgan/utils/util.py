@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import numpy as np
+from neu.metrics import image_quality
 
 
 def array_to_image(array):
@@ -34,9 +35,4 @@ def array_to_image(array):
 
 def calculate_psnr(img1, img2):
     # img1 and img2 have range [0, 255]
-    img1 = img1.astype(np.float64)
-    img2 = img2.astype(np.float64)
-    mse = np.mean((img1 - img2)**2)
-    if mse == 0:
-        return float('inf')
-    return 20 * np.log10(255.0 / np.sqrt(mse))
+    return float(image_quality.psnr(img1[np.newaxis], img2[np.newaxis])[0])
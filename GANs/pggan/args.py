@@ -85,6 +85,8 @@ def get_args(batch_size=16):
     parser.add_argument("--validation-metric", type=str, default="swd",
                         choices=["swd", "ms-ssim"],
                         help="Validation metric for PGGAN.")
+    parser.add_argument("--num-processes", type=int, default=1,
+                        help="Number of processes to compute the SWD of the levels in parallel.")
 
     args = parser.parse_args()
 
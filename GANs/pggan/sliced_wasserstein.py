@@ -58,27 +58,35 @@ def finalize_descriptors(desc):
 # ----------------------------------------------------------------------------
 
 
-def _sliced_wasserstein(A, B, dirs_per_repeat):
+def random_directions(num_components, dir_repeats, dirs_per_repeat):
+    # (descriptor_component, direction) of all the repeats
+    dirs = []
+    for repeat in range(dir_repeats):
+        d = np.random.randn(num_components, dirs_per_repeat)
+        # normalize descriptor components for each direction
+        d /= np.sqrt(np.sum(np.square(d), axis=0, keepdims=True))
+        dirs.append(d.astype(np.float32))
+    return np.concatenate(dirs, axis=1)
+
+
+def _sliced_wasserstein(A, B, dirs, max_elements=2 ** 28):
     # (neighborhood, descriptor_component)
     assert A.ndim == 2 and A.shape == B.shape
-    results = []
-    # (descriptor_component, direction)
-    dirs = np.random.randn(A.shape[1], dirs_per_repeat)
-    # normalize descriptor components for each direction
-    dirs /= np.sqrt(np.sum(np.square(dirs), axis=0, keepdims=True))
-    dirs = dirs.astype(np.float32)
-    # (neighborhood, direction)
-    projA = np.matmul(A, dirs)
-    projB = np.matmul(B, dirs)
-    # sort neighborhood projections for each direction
-    projA = np.sort(projA, axis=0)
-    projB = np.sort(projB, axis=0)
-    # pointwise wasserstein distances
-    dists = np.abs(projA - projB)
+    # project to as many directions at once as the memory allows
+    chunk = int(np.clip(max_elements // A.shape[0], 1, dirs.shape[1]))
+    dists_sum = 0.0
+    for start in range(0, dirs.shape[1], chunk):
+        # (neighborhood, direction)
+        projA = np.matmul(A, dirs[:, start:start + chunk])
+        projB = np.matmul(B, dirs[:, start:start + chunk])
+        # sort neighborhood projections for each direction
+        projA.sort(axis=0)
+        projB.sort(axis=0)
+        # pointwise wasserstein distances
+        projA -= projB
+        dists_sum += np.sum(np.abs(projA), dtype=np.float64)
     # average over neighborhoods and directions
-    results.append(np.mean(dists))
-    # average over repeats
-    return results
+    return dists_sum / (A.shape[0] * dirs.shape[1])
 
 # ----------------------------------------------------------------------------
 
@@ -136,31 +144,30 @@ def reconstruct_laplacian_pyramid(pyramid):
 def sliced_wasserstein(A, B, dir_repeats, dirs_per_repeat):
     # (neighborhood, descriptor_component)
     assert A.ndim == 2 and A.shape == B.shape
-    results = []
+    dirs = random_directions(A.shape[1], dir_repeats, dirs_per_repeat)
+    # average over repeats, which have the same number of directions
+    return _sliced_wasserstein(A, B, dirs)
 
-    import multiprocessing as mp
-    from multiprocessing.pool import ThreadPool
-    pool = ThreadPool(processes=mp.cpu_count())
-    results = []
-    score = []
-    for repeat in range(dir_repeats):
-        ret = pool.apply_async(_sliced_wasserstein, (A, B, dirs_per_repeat))
-        results.append(ret)
-    pool.close()
-    pool.join()
-    for repeat in range(dir_repeats):
-        dists_mean = results[repeat].get()
-        score.append(dists_mean)
-    return np.mean(score)
+
+# descriptors shared with the forked processes
+_descriptors = []
+
+
+def _sliced_wasserstein_level(args):
+    i, dirs = args
+    real, fake = _descriptors[i]
+    return _sliced_wasserstein(finalize_descriptors(real),
+                               finalize_descriptors(fake), dirs)
 
 
 def compute_metric(di, gen, latent, num_minibatch, nhoods_per_image,
                    nhood_size, level_list, dir_repeats,
-                   dirs_per_repeat, hyper_sphere=True):
+                   dirs_per_repeat, hyper_sphere=True, num_processes=1):
     logger.info("Generate images")
     st = time.time()
-    real_descriptor = [[] for _ in level_list]
-    fake_descriptor = [[] for _ in level_list]
+    real_descriptor = [None for _ in level_list]
+    fake_descriptor = [None for _ in level_list]
+    num_desc = 0
     for k in range(num_minibatch):
         logger.info("iter={} / {}".format(k, num_minibatch))
         real, _ = di.next()
@@ -171,27 +178,43 @@ def compute_metric(di, gen, latent, num_minibatch, nhoods_per_image,
         z = nn.Variable.from_numpy_array(z_data)
         z = pixel_wise_feature_vector_normalization(z) if hyper_sphere else z
         y = gen(z)
-        fake = y.d
         fake = np.uint8((y.d + 1.) / 2. * 255)
 
-        for i, desc in enumerate(generate_laplacian_pyramid(real, len(level_list))):
-            real_descriptor[i].append(get_descriptors_for_minibatch(
-                desc, nhood_size, nhoods_per_image))
-        for i, desc in enumerate(generate_laplacian_pyramid(fake, len(level_list))):
-            fake_descriptor[i].append(get_descriptors_for_minibatch(
-                desc, nhood_size, nhoods_per_image))
+        # accumulate the descriptors into the arrays of all the minibatches
+        n = B * nhoods_per_image
+        for descriptor, minibatch in [(real_descriptor, real), (fake_descriptor, fake)]:
+            for i, desc in enumerate(generate_laplacian_pyramid(minibatch, len(level_list))):
+                desc = get_descriptors_for_minibatch(
+                    desc, nhood_size, nhoods_per_image)
+                if descriptor[i] is None:
+                    descriptor[i] = np.empty(
+                        (num_minibatch * n, ) + desc.shape[1:], desc.dtype)
+                descriptor[i][num_desc:num_desc + n] = desc
+        num_desc += n
     logger.info(
         "Elapsed time for generating images: {} [s]".format(time.time() - st))
 
     logger.info("Compute Sliced Wasserstein Distance")
-    scores = []
-    for i, level in enumerate(level_list):
-        st = time.time()
-        real = finalize_descriptors(real_descriptor[i])
-        fake = finalize_descriptors(fake_descriptor[i])
-        scores.append(sliced_wasserstein(
-            real, fake, dir_repeats, dirs_per_repeat))
-        logger.info("Level: {}, dist: {}".format(level, scores[-1]))
-        logger.info(
-            "Elapsed time: {} [s] at {}-th level".format(time.time() - st, i))
+    st = time.time()
+    num_components = 3 * nhood_size * nhood_size
+    # draw the directions of all the levels in order, for the same numbers
+    # regardless of the number of processes
+    dirs = [random_directions(num_components, dir_repeats, dirs_per_repeat)
+            for _ in level_list]
+    global _descriptors
+    _descriptors = [(real[:num_desc], fake[:num_desc])
+                    for real, fake in zip(real_descriptor, fake_descriptor)]
+    if num_processes > 1:
+        import multiprocessing as mp
+        with mp.get_context('fork').Pool(min(num_processes, len(level_list))) as pool:
+            scores = pool.map(_sliced_wasserstein_level,
+                              list(enumerate(dirs)))
+    else:
+        scores = [_sliced_wasserstein_level(args)
+                  for args in enumerate(dirs)]
+    _descriptors = []
+    for level, score in zip(level_list, scores):
+        logger.info("Level: {}, dist: {}".format(level, score))
+    logger.info(
+        "Elapsed time for SWD: {} [s]".format(time.time() - st))
     return scores
@@ -86,7 +86,8 @@ def main():
         dirs_per_repeat = 128
         from sliced_wasserstein import compute_metric
         score = compute_metric(di, gen, args.latent, num_batches, nhoods_per_image, nhood_size,
-                               level_list, dir_repeats, dirs_per_repeat, args.hyper_sphere)
+                               level_list, dir_repeats, dirs_per_repeat, args.hyper_sphere,
+                               num_processes=args.num_processes)
         monitor_time.add(0)
         monitor_metric.add(0, score)  # averaged in the log
     else:
@@ -165,6 +165,7 @@ class Evaluate(BaseExecution):
         from .projection import LatentSpaceProjection
 
         lsp = LatentSpaceProjection(self.generator, args)
+        lsp.project(args)
 
     def ppl(self, test_config, args):
 
@@ -172,3 +173,20 @@ class Evaluate(BaseExecution):
 
         metric = Metrics(self.generator, 'ppl', 5000, args.batch_size)
         metric.get_ppl()
+
+    def fid(self, test_config, args):
+
+        from .metrics import Metrics
+
+        metric = Metrics(self.generator, 'fid', 50000, args.batch_size,
+                         real_stats_path=self.config['eval_real_path'],
+                         real_stats_cache=os.path.join(self.results_dir, 'real_stats.npz'))
+        metric.get_fid()
+
+    def inception_score(self, test_config, args):
+
+        from .metrics import Metrics
+
+        metric = Metrics(self.generator, 'inception_score', 50000, args.batch_size,
+                         splits=10)
+        metric.get_inception_score()
@@ -22,6 +22,7 @@ metrics_path = os.path.abspath(
 sys.path.append(metrics_path)
 
 import nnabla as nn
+import nnabla.parametric_functions as PF
 
 from .ops import *
 from models import *
@@ -29,10 +30,12 @@ from models import *
 
 class Metrics(object):
 
-    def __init__(self, generator, metric_name, n_samples, batch_size):
+    def __init__(self, generator, metric_name, n_samples, batch_size,
+                 real_stats_path=None, real_stats_cache=None, splits=1):
 
         self.generator = generator
         self.n_samples = n_samples
+        self.batch_size = batch_size
 
         num_batches = n_samples // batch_size
         resid = n_samples - (num_batches * batch_size)
@@ -43,6 +46,13 @@ class Metrics(object):
             from metrics.lpips.lpips import LPIPS
             self.lpips_distance = LPIPS(model='vgg')
             self.eps = 1e-4
+        elif metric_name in ['fid', 'inception_score']:
+            # Graph of generation and Inception v3 is built at first use
+            self.real_stats_path = real_stats_path
+            self.real_stats_cache = real_stats_cache
+            self.splits = splits
+            self.inception_graph = None
+            self.real_stats = None
         else:
             raise NotImplementedError
 
@@ -58,11 +68,129 @@ class Metrics(object):
 
         return [latent_t_e, latent_t_e]
 
+    def build_inception_graph(self):
+        """Static graph from latents to Inception v3 features and class
+        probabilities of the generated images, of the fixed batch size.
+        """
+        from metrics.gan_eval.fid import load_parameters
+        from metrics.gan_eval.inceptionv3 import construct_inceptionv3
+
+        with nn.parameter_scope('InceptionV3'):
+            load_parameters(os.path.join(
+                metrics_path, 'metrics', 'gan_eval', 'original_inception_v3.h5'))
+            # Inception v3 is not trained, and not taken by the solvers
+            for v in nn.get_parameters(grad_only=False).values():
+                v.need_grad = False
+
+        bs = self.batch_size
+        generator = self.generator
+        with nn.auto_forward(False):
+            z = nn.Variable((bs, self.latent_dim))
+            with nn.parameter_scope(generator.global_scope):
+                # Mapping and synthesis without style mixing, truncation and
+                # the update of dlatent_avg
+                z_n = z / F.pow_scalar(F.mean(z ** 2., axis=1,
+                                              keepdims=True) + 1e-8, 0.5)
+                w = mapping_network(z_n, outmaps=generator.mapping_network_dim,
+                                    num_layers=generator.mapping_network_num_layers)
+                w = F.broadcast(F.reshape(w, (bs, 1, w.shape[1])),
+                                (bs, generator.num_conv_layers, w.shape[1]))
+                constant_bc = nn.parameter.get_parameter_or_create(
+                                name="G_synthesis/4x4/Const/const",
+                                shape=(1, 512, 4, 4))
+                constant_bc = F.broadcast(
+                    constant_bc, (bs,) + constant_bc.shape[1:])
+                rgb_output = generator.synthesis(w, constant_bc)
+
+            # Inception v3 takes images in [-1, 1] of 299 x 299
+            x = F.clip_by_value(rgb_output, -1, 1)
+            x = F.interpolate(x, output_size=(299, 299), mode='linear',
+                              align_corners=False)
+            with nn.parameter_scope('InceptionV3'):
+                feature = construct_inceptionv3(x)
+                # strangely, 1008 is correct, and no bias.
+                prob = F.softmax(PF.affine(feature, 1008,
+                                           name="Affine", with_bias=False))
+        feature.persistent = True
+        prob.persistent = True
+        self.inception_graph = (z, feature, prob, F.sink(feature, prob))
+
+    def get_real_statistics(self):
+        """Mean and covariance of Inception v3 features of real images, from
+        an .npz file, or computed from a directory or a file list of images
+        and cached in `real_stats_cache`.
+        """
+        from metrics.gan_eval.fid import get_statistics_from_given_path
+
+        path = self.real_stats_path
+        if self.real_stats_cache is not None and os.path.isfile(self.real_stats_cache):
+            path = self.real_stats_cache
+        print(f'Real statistics: {path}')
+        with nn.parameter_scope('InceptionV3'):
+            mu, sigma = get_statistics_from_given_path(path, self.batch_size)
+        if path != self.real_stats_cache and self.real_stats_cache is not None:
+            np.savez_compressed(self.real_stats_cache, mu=mu, sigma=sigma)
+            print(f'Saved {self.real_stats_cache}')
+        return mu, sigma
+
+    def get_inception_outputs(self, seed=0):
+        """Inception v3 features and class probabilities of `n_samples`
+        generated images, which are never written to disk.
+        """
+        if self.inception_graph is None:
+            self.build_inception_graph()
+        z, feature, prob, outputs = self.inception_graph
+
+        rnd = np.random.RandomState(seed)
+        features, probs = [], []
+        num_batches = (self.n_samples + self.batch_size - 1) // self.batch_size
+        for _ in tqdm(range(num_batches)):
+            z.d = rnd.randn(*z.shape)
+            outputs.forward(clear_buffer=True)
+            features.append(feature.d.copy())
+            probs.append(prob.d.copy())
+        features = np.concatenate(features)[:self.n_samples]
+        probs = np.concatenate(probs)[:self.n_samples]
+        return features, probs
+
+    def compute_fid(self, features):
+        from metrics.gan_eval.fid import calculate_fid, get_stats
+
+        if self.real_stats is None:
+            self.real_stats = self.get_real_statistics()
+        mu, sigma = get_stats(features)
+        return calculate_fid(mu, self.real_stats[0], sigma, self.real_stats[1])
+
+    def compute_inception_score(self, probs):
+        from metrics.gan_eval.inception_score import kl_divergence, marginal_dist
+
+        interval = probs.shape[0] // self.splits
+        scores = []
+        for i in range(self.splits):
+            part = probs[(i * interval):((i + 1) * interval), :]
+            kl = kl_divergence(part, marginal_dist(part))
+            scores.append(np.exp(np.mean(kl, axis=0)))
+        return np.mean(scores), np.std(scores)
+
+    def get_fid_and_inception_score(self, seed=0):
+        """FID and Inception Score of the same generated samples
+        """
+        features, probs = self.get_inception_outputs(seed)
+        fid = self.compute_fid(features)
+        inception_score, _ = self.compute_inception_score(probs)
+        return fid, inception_score
+
     def get_fid(self):
-        pass
+        features, _ = self.get_inception_outputs()
+        fid = self.compute_fid(features)
+        print("FID:", fid)
+        return fid
 
     def get_inception_score(self):
-        pass
+        _, probs = self.get_inception_outputs()
+        score, std = self.compute_inception_score(probs)
+        print(f"Inception Score: {score:.3f}, std: {std:.3f}")
+        return score
 
     def get_ppl(self):
 
@@ -21,6 +21,7 @@ import nnabla.solvers as S
 import numpy as np
 import os
 import sys
+import time
 from PIL import Image
 import subprocess as sp
 from tqdm import tqdm
@@ -34,7 +35,38 @@ sys.path.append(metrics_path)
 from metrics.lpips.lpips import LPIPS
 
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(path):
+    """
+    List image files of a directory, or return a single image path as a list
+    """
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, f) for f in os.listdir(path)
+                      if f.lower().endswith(IMAGE_EXTENSIONS))
+    return [path]
+
+
+def load_image(path, size=256):
+    image = Image.open(path).convert(
+        "RGB").resize((size, size), resample=Image.BILINEAR)
+    image = np.array(image)/255.0
+    image = np.transpose(image.astype(np.float32), (2, 0, 1))
+    return (image - 0.5)/(0.5)
+
+
 class LatentSpaceProjection(object):
+    """
+    Projection of a batch of images into the W+ space of the generator.
+
+    The synthesis network, LPIPS and the losses are built once as a static
+    graph of the batch size, where the latents and the noises of each image
+    are persistent Variables optimized by the solver. The losses are summed
+    over images, so that each image is optimized independently of the others
+    in a batch. The W+ latents of each batch are saved as soon as they are
+    projected.
+    """
 
     def __init__(self, generator, args):
 
@@ -43,17 +75,17 @@ class LatentSpaceProjection(object):
         self.solver = S.Adam()
         self.base_lr = 0.1
 
-        self.img_size = 1024
+        self.img_size = 256
         self.n_latent = 10000
-        self.num_iters = 500
+        self.num_iters = args.projection_iters
+        self.batch_size = args.batch_size
         self.latent_dim = self.generator.mapping_network_dim
+        self.num_layers = self.generator.num_conv_layers
         self.mse_c = 0.0
         self.n_c = 1e5
 
         self.lpips_distance = LPIPS(model='vgg')
 
-        self.project(args)
-
     def set_lr(self, t, rampdown=0.25, rampup=0.05):
         lr_ramp = min(1, (1 - t) / rampdown)
         lr_ramp = 0.5 - 0.5 * np.cos(lr_ramp * np.pi)
@@ -62,18 +94,19 @@ class LatentSpaceProjection(object):
         self.solver.set_learning_rate(self.base_lr * lr_ramp)
 
     def latent_noise(self, latent, strength):
-        noise = F.randn(shape=latent.shape)*strength.data
+        noise = F.randn(shape=latent.shape)*strength
         return noise + latent
 
     def regularize_noise(self, noises):
+        # Sum of the regularization of each image
         loss = 0
         for noise in noises:
             size = noise.shape[2]
             while True:
                 loss = (loss
-                        + F.pow_scalar(F.mean(noise * F.shift(noise,
-                                                              shifts=(0, 0, 0, 1), border_mode='reflect')), 2)
-                        + F.pow_scalar(F.mean(noise * F.shift(noise, shifts=(0, 0, 1, 0), border_mode='reflect')), 2))
+                        + F.sum(F.pow_scalar(F.mean(noise * F.shift(noise,
+                                                                    shifts=(0, 0, 0, 1), border_mode='reflect'), axis=(1, 2, 3)), 2))
+                        + F.sum(F.pow_scalar(F.mean(noise * F.shift(noise, shifts=(0, 0, 1, 0), border_mode='reflect'), axis=(1, 2, 3)), 2)))
                 if size <= 8:
                     break
                 noise = F.reshape(noise, [-1, 1, size // 2, 2, size // 2, 2])
@@ -82,96 +115,132 @@ class LatentSpaceProjection(object):
         return loss
 
     def normalize_noises(self, noises):
-        for i in range(len(noises)):
-            mean = np.mean(noises[i].d, keepdims=True)
-            std = np.std(noises[i].d, keepdims=True)
-
-            noises[i].d = (noises[i].d-mean)/std
-        return noises
-
-    def project(self, args):
-        nn.set_auto_forward(True)
-
-        # Input Image Variable
-        image = Image.open(args.img_path).convert(
-            "RGB").resize((256, 256), resample=Image.BILINEAR)
-        image = np.array(image)/255.0
-        image = np.transpose(image.astype(np.float32), (2, 0, 1))
-        image = np.expand_dims(image, 0)
-        image = (image - 0.5)/(0.5)
-        image = nn.Variable.from_numpy_array(image)
-
-        # Get Latent Space Mean and Std. Dev.
-        # Get Noise for B network
-        z = F.randn(shape=(self.n_latent, self.latent_dim)).data
-        w = mapping_network(z)
+        # In-place normalization of the noise of each image
+        ops = []
+        for noise in noises:
+            mean = F.mean(noise, axis=(1, 2, 3), keepdims=True)
+            std = F.pow_scalar(
+                F.mean(F.pow_scalar(noise - mean, 2), axis=(1, 2, 3), keepdims=True), 0.5)
+            ops.append(F.assign(noise, (noise - mean)/std))
+        return F.sink(*ops)
+
+    def latent_statistics(self):
+        # Latent Space Mean and Std. Dev.
+        z = nn.Variable.from_numpy_array(
+            np.random.randn(self.n_latent, self.latent_dim).astype(np.float32))
+        with nn.parameter_scope(self.generator.global_scope):
+            w = mapping_network(z)
         latent_mean = F.mean(w, axis=0, keepdims=True)
         latent_std = F.pow_scalar(F.mean(F.pow_scalar(w-latent_mean, 2)), 0.5)
+        F.sink(latent_mean, latent_std).forward(clear_no_need_grad=True)
+        return latent_mean.d.copy(), float(latent_std.d)
 
-        # Get Noise
-        noises = [F.randn(shape=(1, 1, 4, 4)).data]
+    def downsample(self, gen_out):
+        N, C, H, W = gen_out.shape
+        factor = H//self.img_size
+        if factor == 1:
+            return gen_out
+        gen_out = F.reshape(
+            gen_out, (N, C, H//factor, factor, W//factor, factor))
+        return F.mean(gen_out, axis=(3, 5))
+
+    def build(self):
+        B = self.batch_size
 
+        # Persistent Variables optimized for each image
+        self.image = nn.Variable((B, 3, self.img_size, self.img_size))
+        self.latent_in = nn.Variable(
+            (B, self.num_layers, self.latent_dim), need_grad=True)
+        self.noises = [nn.Variable((B, 1, 4, 4), need_grad=True)]
         for res in self.generator.resolutions[1:]:
             for _ in range(2):
-                shape = (1, 1, res, res)
-                noises.append(F.randn(shape=shape).data)
-
-        # Prepare parameters to be optimized
-        latent_in = nn.Variable.from_numpy_array(
-            latent_mean.data).apply(need_grad=True)
-        noises = [nn.Variable.from_numpy_array(
-            n.data).apply(need_grad=True) for n in noises]
-
-        constant_bc = nn.parameter.get_parameter_or_create(
-                        name="G_synthesis/4x4/Const/const",
-                        shape=(1, 512, 4, 4))
-        constant_bc = F.broadcast(constant_bc, (1,) + constant_bc.shape[1:])
+                self.noises.append(nn.Variable(
+                    (B, 1, res, res), need_grad=True))
+        self.noise_strength = nn.Variable((1, 1, 1))
+
+        with nn.parameter_scope(self.generator.global_scope):
+            constant_bc = nn.parameter.get_parameter_or_create(
+                            name="G_synthesis/4x4/Const/const",
+                            shape=(1, 512, 4, 4))
+            constant_bc = F.broadcast(
+                constant_bc, (B,) + constant_bc.shape[1:])
+
+            latent_n = self.latent_noise(self.latent_in, self.noise_strength)
+            gen_out = self.generator.synthesis(
+                latent_n, constant_bc, noises_in=self.noises)
+            gen_out = self.downsample(gen_out)
+
+            # Projected images without the latent noise
+            self.projected = self.downsample(self.generator.synthesis(
+                self.latent_in, constant_bc, noises_in=self.noises))
+
+        self.p_loss = F.sum(self.lpips_distance(self.image, gen_out))
+        self.p_loss.persistent = True
+        n_loss = self.regularize_noise(self.noises)
+        mse_loss = F.sum(F.mean((gen_out-self.image)**2, axis=(1, 2, 3)))
+        self.loss = self.p_loss + self.n_c*n_loss + self.mse_c*mse_loss
+        self.normalize = self.normalize_noises(self.noises)
+
+        self.param_dict = {'latent': self.latent_in}
+        for i in range(len(self.noises)):
+            self.param_dict[f'noise_{i}'] = self.noises[i]
+
+    def project_batch(self, images, latent_mean, latent_std):
+        n = len(images)
+        if n < self.batch_size:
+            images = np.concatenate(
+                [images, np.repeat(images[-1:], self.batch_size - n, axis=0)])
+        self.image.d = images
+        self.latent_in.d = np.broadcast_to(
+            latent_mean[:, np.newaxis, :], self.latent_in.shape)
+        for noise in self.noises:
+            noise.d = np.random.randn(*noise.shape)
+        # Solver states are reset for each batch
+        self.solver.set_parameters(self.param_dict)
 
         pbar = tqdm(range(self.num_iters))
         for i in pbar:
 
             t = i/self.num_iters
             self.set_lr(t)
+            self.noise_strength.d = latent_std * \
+                0.05 * max(0, 1 - t / 0.75) ** 2
 
-            noise_strength = latent_std * 0.05 * max(0, 1 - t / 0.75) ** 2
-            latent_n = self.latent_noise(latent_in, noise_strength)
-
-            gen_out = self.generator.synthesis(
-                [latent_n, latent_n], constant_bc, noises_in=noises)
-            N, C, H, W = gen_out.shape
-            factor = H//256
-            gen_out = F.reshape(
-                gen_out, (N, C, H//factor, factor, W//factor, factor))
-            gen_out = F.mean(gen_out, axis=(3, 5))
-
-            p_loss = F.sum(self.lpips_distance(image, gen_out))
-            n_loss = self.regularize_noise(noises)
-            mse_loss = F.mean((gen_out-image)**2)
-            loss = p_loss + self.n_c*n_loss + self.mse_c*mse_loss
-
-            param_dict = {'latent': latent_in}
-            for i in range(len(noises)):
-                param_dict[f'noise_{i}'] = noises[i]
+            self.loss.forward(clear_no_need_grad=True)
             self.solver.zero_grad()
-            self.solver.set_parameters(
-                param_dict, reset=False, retain_state=True)
-
-            loss.backward()
+            self.loss.backward(clear_buffer=True)
             self.solver.update()
 
-            noises = self.normalize_noises(noises)
-
-            pbar.set_description(f'Loss: {loss.d} P Loss: {p_loss.d}')
+            self.normalize.forward()
 
-        save_generations(image, 'original.png')
+            pbar.set_description(
+                f'Loss: {self.loss.d / self.batch_size} P Loss: {self.p_loss.d / self.batch_size}')
 
-        gen_out = self.generator.synthesis(
-            [latent_n, latent_n], constant_bc, noises_in=noises)
-        N, C, H, W = gen_out.shape
-        factor = H//256
-        gen_out = F.reshape(
-            gen_out, (N, C, H//factor, factor, W//factor, factor), inplace=True)
-        gen_out = F.mean(gen_out, axis=(3, 5))
-        save_generations(gen_out, 'projected.png')
+        self.projected.forward(clear_buffer=True)
+        return self.latent_in.d[:n].copy(), self.projected.d[:n].copy()
 
-        nn.save_parameters('projection_params.h5', param_dict)
+    def project(self, args):
+        paths = list_images(args.img_path)
+        results_dir = args.results_dir
+        os.makedirs(results_dir, exist_ok=True)
+
+        with nn.auto_forward(False):
+            latent_mean, latent_std = self.latent_statistics()
+            self.build()
+
+        start = time.time()
+        for b in range(0, len(paths), self.batch_size):
+            batch_paths = paths[b:b + self.batch_size]
+            images = np.stack([load_image(p, self.img_size)
+                               for p in batch_paths])
+            latents, projected = self.project_batch(
+                images, latent_mean, latent_std)
+
+            # Save the results of the batch
+            for path, latent, image in zip(batch_paths, latents, projected):
+                name = os.path.splitext(os.path.basename(path))[0]
+                np.save(os.path.join(results_dir, f'{name}_latent.npy'), latent)
+                save_generations(nn.NdArray.from_numpy_array(image[np.newaxis]),
+                                 os.path.join(results_dir, f'{name}_projected'))
+            print(f'Projected {b + len(batch_paths)} / {len(paths)} images '
+                  f'({(time.time() - start) / (b + len(batch_paths)):.1f} s/image)')
@@ -21,6 +21,7 @@ from nnabla.utils.data_iterator import data_iterator_simple, data_iterator
 
 import os
 import subprocess as sp
+import time
 from tqdm import trange
 from collections import namedtuple
 
@@ -56,6 +57,10 @@ class Train(BaseExecution):
                         config['monitor']['train_loss'], monitor,
                         interval=self.config['logger_step_interval']
                         )
+                self.monitor_fid = MonitorSeries(
+                        config['monitor']['fid'], monitor, interval=1)
+                self.monitor_is = MonitorSeries(
+                        config['monitor']['inception_score'], monitor, interval=1)
 
         os.makedirs(self.config['saved_weights_dir'], exist_ok=True)
         self.results_dir = args.results_dir
@@ -82,6 +87,17 @@ class Train(BaseExecution):
 
         self.gen_mean_path_length = 0.0
 
+        # Periodic evaluation of FID and Inception Score of GeneratorEMA
+        self.metrics = None
+        if self.config['eval_epoch_interval'] > 0 and comm.rank == 0:
+            from .metrics import Metrics
+            self.metrics = Metrics(self.generator_ema, 'fid',
+                                   self.config['eval_num_samples'],
+                                   self.config['eval_batch_size'],
+                                   real_stats_path=self.config['eval_real_path'],
+                                   real_stats_cache=os.path.join(
+                                       self.config['saved_weights_dir'], 'real_stats.npz'))
+
         self.args = args
         # Initialize Dataloader
         if args.data == 'ffhq':
@@ -262,27 +278,46 @@ class Train(BaseExecution):
                 self.comm.all_reduce(params, division=False, inplace=True)
             self.gen_solver.update()
 
-    def ema_update(self):
+    def build_parameter_groups(self):
+        """Pack the parameters of Generator and GeneratorEMA into flat buffers
+
+        `dlatent_avg` is kept out of the groups, since the graph of
+        GeneratorEMA updates it by its own assign and `unpack()` would
+        overwrite the update. It is updated per parameter as before.
+        """
+        from neu.parameter_group import ParameterGroup
+
         with nn.parameter_scope('Generator'):
             g_params = nn.get_parameters(grad_only=False)
         with nn.parameter_scope('GeneratorEMA'):
             g_ema_params = nn.get_parameters(grad_only=False)
-        update_ema_list = []
-        for name in g_ema_params.keys():
-            params_ema_updated = self.gen_exp_weight * \
-                    g_ema_params[name] + \
-                        (1.0 - self.gen_exp_weight) * g_params[name]
-            update_ema_list.append(
-                F.assign(g_ema_params[name], params_ema_updated))
-        return F.sink(*update_ema_list)
-
-    def copy_params(self, scope_from, scope_to):
-        with nn.parameter_scope(scope_from):
-            params_from = nn.get_parameters(grad_only=False)
-        with nn.parameter_scope(scope_to):
-            params_to = nn.get_parameters(grad_only=False)
-        for name in params_to.keys():
-            params_to[name].d = params_from[name].d
+        names = [name for name in g_ema_params.keys()
+                 if not name.endswith('dlatent_avg')]
+        self.gen_params = ParameterGroup(
+            [(name, g_params[name]) for name in names])
+        self.gen_ema_params = ParameterGroup(
+            [(name, g_ema_params[name]) for name in names])
+        self.gen_unpacked_params = [(g_params[name], g_ema_params[name])
+                                    for name in g_ema_params.keys() if name not in names]
+
+    def ema_update(self):
+        # A single update of the flat buffer of GeneratorEMA. The parameters
+        # of Generator are concatenated into a flat array on each update, and
+        # the parameters of GeneratorEMA are updated by
+        # `self.gen_ema_params.unpack()`.
+        update_ema_list = [self.gen_ema_params.ema_update(
+            self.gen_params, self.gen_exp_weight)]
+        with nn.auto_forward(False):
+            for param, param_ema in self.gen_unpacked_params:
+                params_ema_updated = self.gen_exp_weight * param_ema + \
+                    (1.0 - self.gen_exp_weight) * param
+                update_ema_list.append(F.assign(param_ema, params_ema_updated))
+            return F.sink(*update_ema_list)
+
+    def copy_params(self):
+        self.gen_ema_params.copy_from(self.gen_params)
+        for param, param_ema in self.gen_unpacked_params:
+            param_ema.d = param.d
 
     def train(self):
         """
@@ -306,9 +341,11 @@ class Train(BaseExecution):
                 self.disc_solver.load_states(os.path.join(
                     self.args.weights_path, 'disc_solver.h5'))
 
-            self.copy_params('Generator', 'GeneratorEMA')
+            self.build_parameter_groups()
+            self.copy_params()
 
             ema_updater = self.ema_update()
+            ema_time = 0.0
 
         for epoch in range(self.config['num_epochs']):
             pbar = trange(iterations_per_epoch, desc='Epoch ' +
@@ -348,7 +385,9 @@ class Train(BaseExecution):
                     real_disc_out = self.parameters.real_disc_out
                     fake_disc_out = self.parameters.fake_disc_out
 
-                    ema_updater.forward()
+                    ema_start = time.time()
+                    ema_updater.forward(clear_buffer=True)
+                    ema_time += time.time() - ema_start
 
                 epoch_gen_loss += gen_loss.d
                 epoch_disc_loss += disc_loss.d
@@ -362,6 +401,8 @@ class Train(BaseExecution):
                             print(k)
 
                 if self.comm.rank == 0 and (i == iterations_per_epoch-1 and (epoch % self.config['save_param_step_interval'] == 0 or epoch == self.config['num_epochs']-1)):
+                    if not self.auto_forward:
+                        self.gen_ema_params.unpack()
                     self.save_weights(
                             self.save_weights_dir, epoch)
                     if not self.auto_forward:
@@ -382,3 +423,15 @@ class Train(BaseExecution):
                 if self.comm.rank == 0:
                     self.monitor_train_gen_loss.add(epoch, epoch_gen_loss)
                     self.monitor_train_gen_loss.add(epoch, epoch_disc_loss)
+
+            if not self.auto_forward:
+                print(
+                    f'EMA update: {ema_time / iterations_per_epoch * 1000:.3f} ms/step ({len(self.gen_ema_params)} parameters)')
+                ema_time = 0.0
+
+            if self.metrics is not None and (epoch + 1) % self.config['eval_epoch_interval'] == 0:
+                if not self.auto_forward:
+                    self.gen_ema_params.unpack()
+                fid, inception_score = self.metrics.get_fid_and_inception_score()
+                self.monitor_fid.add(epoch, fid)
+                self.monitor_is.add(epoch, inception_score)
@@ -68,7 +68,7 @@ def make_parser():
                         help='Seed values 1')
     parser.add_argument('--seed_2', type=list, default=[102, 103],
                         help='Seed values 2')
-    parser.add_argument('--test', type=str, choices=['generate', 'latent_space_interpolation', 'style_mixing', 'latent_space_projection', 'ppl'], nargs='*',
+    parser.add_argument('--test', type=str, choices=['generate', 'latent_space_interpolation', 'style_mixing', 'latent_space_projection', 'ppl', 'fid', 'inception_score'], nargs='*',
                         help='Set this flag for testing')
     parser.add_argument('--batch_size_A', type=int, default=3,
                         help='Only for style mixing: Batch size for style A')
@@ -79,7 +79,9 @@ def make_parser():
 
     parser.add_argument('--img_path', type=str,
                         default='/FFHQ/images1024x1024/00000/00399.png',
-                        help='Image path for latent space projection')
+                        help='Image path or directory of images for latent space projection')
+    parser.add_argument('--projection_iters', type=int, default=500,
+                        help='Number of optimization iterations of latent space projection')
 
     return parser
 
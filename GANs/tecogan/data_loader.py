@@ -23,11 +23,12 @@ import nnabla.functions as F
 from nnabla.utils.data_iterator import data_iterator_simple
 
 
-def inference_data_loader(filedir):
+def list_inference_frames(filedir):
     """
-    Read and prepare the inference data from specified directory
+    List the LR frames of the specified directory, with the hard-coded
+    symmetric padding of the first 5 frames
     filedir: inference data directory name
-    return: list of inference image names and images to be enhanced
+    return: list of inference image names
     """
 
     image_list_lr_temp = os.listdir(filedir)
@@ -38,17 +39,28 @@ def inference_data_loader(filedir):
         ''.join(list(filter(str.isdigit, f))) or -1))
     image_list_lr = [os.path.join(filedir, _) for _ in image_list_lr_temp]
 
-    # Read in and preprocess the images
-    def preprocess_test(name):
-        ip_img = cv.imread(name, 3).astype(np.float32)[:, :, ::-1]
-        max_divided_img = ip_img / 255.0  # equivalent to np.max(ip_img)
-        return max_divided_img
+    # a hard-coded symmetric padding
+    return image_list_lr[5:0:-1] + image_list_lr
+
 
-    image_lr = [preprocess_test(_) for _ in image_list_lr]
+def read_inference_frame(name):
+    """
+    Read and preprocess an inference image
+    """
+    ip_img = cv.imread(name, 3).astype(np.float32)[:, :, ::-1]
+    max_divided_img = ip_img / 255.0  # equivalent to np.max(ip_img)
+    return max_divided_img
 
-    # a hard-coded symmetric padding
-    image_list_lr = image_list_lr[5:0:-1] + image_list_lr
-    image_lr = image_lr[5:0:-1] + image_lr
+
+def inference_data_loader(filedir):
+    """
+    Read and prepare the inference data from specified directory
+    filedir: inference data directory name
+    return: list of inference image names and images to be enhanced
+    """
+
+    image_list_lr = list_inference_frames(filedir)
+    image_lr = [read_inference_frame(_) for _ in image_list_lr]
 
     Data = collections.namedtuple('Data', 'paths_lr, inputs')
     return Data(
@@ -15,12 +15,14 @@
 
 import os
 import argparse
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import nnabla as nn
 import nnabla.functions as F
 from nnabla.ext_utils import get_extension_context
 from utils.utils import save_img, space_to_depth, upscale_four, warp_by_flow
-from data_loader import inference_data_loader
+from data_loader import list_inference_frames, read_inference_frame
 from models import generator, flow_estimator
 
 parser = argparse.ArgumentParser(description='TecoGAN')
@@ -36,69 +38,178 @@ parser.add_argument('--output-ext', default='png',
                     help='The format of the output')
 parser.add_argument('--num_resblock', default=16, type=int,
                     help='No of residual blocks in generator. (16 for TecoGAN and 10 FRVSR)')
+parser.add_argument('--batch-size', default=1, type=int,
+                    help='Number of clips processed at once, when the input directory has a sub-directory per clip')
+parser.add_argument('--num-workers', default=4, type=int,
+                    help='Number of threads to read and save the frames')
 args = parser.parse_args()
 
 ctx = get_extension_context('cudnn')
 nn.set_default_context(ctx)
 
 
+class ClipReader(object):
+    """
+        Read the frames of a clip lazily, prefetching the next frames in
+        background threads.
+    """
+
+    def __init__(self, input_dir, output_dir, executor, prefetch=2):
+        self.paths_lr = list_inference_frames(input_dir)
+        self.output_dir = output_dir
+        self.executor = executor
+        self.prefetch = prefetch
+        self.index = 0
+        self.futures = {}
+
+    def __len__(self):
+        return len(self.paths_lr)
+
+    def finished(self):
+        return self.index >= len(self)
+
+    def next(self):
+        for i in range(self.index, min(self.index + self.prefetch + 1, len(self))):
+            if i not in self.futures:
+                self.futures[i] = self.executor.submit(
+                    read_inference_frame, self.paths_lr[i])
+        frame = self.futures.pop(self.index).result()
+        self.index += 1
+        return frame
+
+
+class TecoGANGenerator(object):
+    """
+        Graph to super-resolve a frame of each of `batch_size` clips at once.
+        The previous output of each clip is warped in the graph unless the clip
+        starts at the frame, which is given by `reset_mask`.
+    """
+
+    def __init__(self, batch_size, height, width):
+        input_shape = [batch_size, height, width, 3]
+        output_shape = [batch_size, height*4, width*4, 3]
+        oh = height - height//8 * 8
+        ow = width - width//8 * 8
+
+        # Build the computation graph
+        self.inputs_raw = nn.Variable(input_shape)
+        self.pre_inputs = nn.Variable(input_shape)
+        self.pre_gen = nn.Variable(output_shape)
+        self.pre_warp = nn.Variable(output_shape)
+        self.reset_mask = nn.Variable([batch_size, 1, 1, 1])
+
+        transposed_pre_warp = space_to_depth(self.pre_warp)
+        inputs_all = F.concatenate(self.inputs_raw, transposed_pre_warp)
+        with nn.parameter_scope("generator"):
+            gen_output = generator(inputs_all, 3, args.num_resblock)
+        self.outputs = (gen_output + 1) / 2
+        inputs_frames = F.concatenate(self.pre_inputs, self.inputs_raw)
+        with nn.parameter_scope("fnet"):
+            flow_lr = flow_estimator(inputs_frames)
+        flow_lr = F.pad(flow_lr, (0, 0, 0, oh, 0, ow, 0, 0), "reflect")
+        flow_hr = upscale_four(flow_lr*4.0)
+        self.pre_gen_warp = warp_by_flow(
+            self.pre_gen, flow_hr) * self.reset_mask
+
+        self.pre_inputs.d, self.pre_gen.d, self.pre_warp.d = 0, 0, 0
+
+    def __call__(self, inputs, reset_mask):
+        self.inputs_raw.d = inputs
+        self.reset_mask.d = reset_mask
+        if reset_mask.any():
+            self.pre_gen_warp.forward(clear_buffer=True)
+            self.pre_warp.data.copy_from(self.pre_gen_warp.data)
+        else:
+            self.pre_warp.data.zero()
+        self.outputs.forward(clear_buffer=True)
+        output_frames = self.outputs.d
+        self.pre_inputs.data.copy_from(self.inputs_raw.data)
+        self.pre_gen.data.copy_from(self.outputs.data)
+        return output_frames
+
+
+def generate(clips, height, width, executor):
+    """
+        Generate SR frames of the clips of the same frame size, advancing
+        `args.batch_size` clips by a frame at once. A clip that has ended is
+        replaced by the next clip.
+    """
+    with nn.auto_forward(False):
+        model = TecoGANGenerator(args.batch_size, height, width)
+    clips = collections.deque(clips)
+    slots = [None] * args.batch_size
+    saving = collections.deque()
+    max_saving = max(args.num_workers, 1) * args.batch_size
+    while True:
+        for k in range(len(slots)):
+            if (slots[k] is None or slots[k].finished()) and clips:
+                slots[k] = clips.popleft()
+            elif slots[k] is not None and slots[k].finished():
+                slots[k] = None
+        if all(clip is None for clip in slots):
+            break
+
+        inputs = np.zeros(model.inputs_raw.shape, np.float32)
+        reset_mask = np.zeros(model.reset_mask.shape, np.float32)
+        indices = [None] * len(slots)
+        for k, clip in enumerate(slots):
+            if clip is None:
+                continue
+            indices[k] = clip.index
+            inputs[k] = clip.next()
+            reset_mask[k] = indices[k] != 0
+        output_frames = model(inputs, reset_mask)
+
+        for k, (clip, i) in enumerate(zip(slots, indices)):
+            if clip is None:
+                continue
+            if i >= 5:
+                name, _ = os.path.splitext(
+                    os.path.basename(str(clip.paths_lr[i])))
+                filename = args.output_name+'_'+name
+                print('saving image %s' % filename)
+                out_path = os.path.join(clip.output_dir, "%s.%s" %
+                                        (filename, args.output_ext))
+                saving.append(executor.submit(
+                    save_img, out_path, output_frames[k].copy()))
+            else:  # First 5 is a hard-coded symmetric frame padding, ignored but time added!
+                print("Warming up %d" % (5-i))
+        # Bound the frames waiting to be saved
+        while len(saving) > max_saving:
+            saving.popleft().result()
+    for f in saving:
+        f.result()
+
+
 def main():
     """
         Inference function to generate SR images.
     """
     nn.load_parameters(args.model)
-    # Inference data loader
-    inference_data = inference_data_loader(args.input_dir_lr)
-    input_shape = [1, ] + list(inference_data.inputs[0].shape)
-    output_shape = [1, input_shape[1]*4, input_shape[2]*4, 3]
-    oh = input_shape[1] - input_shape[1]//8 * 8
-    ow = input_shape[2] - input_shape[2]//8 * 8
-
-    # Build the computation graph
-    inputs_raw = nn.Variable(input_shape)
-    pre_inputs = nn.Variable(input_shape)
-    pre_gen = nn.Variable(output_shape)
-    pre_warp = nn.Variable(output_shape)
-
-    transposed_pre_warp = space_to_depth(pre_warp)
-    inputs_all = F.concatenate(inputs_raw, transposed_pre_warp)
-    with nn.parameter_scope("generator"):
-        gen_output = generator(inputs_all, 3, args.num_resblock)
-    outputs = (gen_output + 1) / 2
-    inputs_frames = F.concatenate(pre_inputs, inputs_raw)
-    with nn.parameter_scope("fnet"):
-        flow_lr = flow_estimator(inputs_frames)
-    flow_lr = F.pad(flow_lr, (0, 0, 0, oh, 0, ow, 0, 0), "reflect")
-    flow_hr = upscale_four(flow_lr*4.0)
-    pre_gen_warp = warp_by_flow(pre_gen, flow_hr)
-
-    if not os.path.exists(args.output_dir):
-        os.makedirs(args.output_dir)
-
-    max_iter = len(inference_data.inputs)
+    executor = ThreadPoolExecutor(max_workers=args.num_workers)
+
+    # A directory of frames, or a directory of sub-directories of frames
+    sub_dirs = sorted(d for d in os.listdir(args.input_dir_lr)
+                      if os.path.isdir(os.path.join(args.input_dir_lr, d)))
+    if sub_dirs:
+        clip_dirs = [(os.path.join(args.input_dir_lr, d),
+                      os.path.join(args.output_dir, d)) for d in sub_dirs]
+    else:
+        clip_dirs = [(args.input_dir_lr, args.output_dir)]
+
+    # Group the clips by the frame size
+    clip_groups = collections.OrderedDict()
+    for input_dir, output_dir in clip_dirs:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        clip = ClipReader(input_dir, output_dir, executor)
+        height, width, _ = read_inference_frame(clip.paths_lr[0]).shape
+        clip_groups.setdefault((height, width), []).append(clip)
+
     print('Frame evaluation starts!!')
-    pre_inputs.d, pre_gen.d, pre_warp.d = 0, 0, 0
-    for i in range(max_iter):
-        inputs_raw.d = np.array([inference_data.inputs[i]]).astype(np.float32)
-        if i != 0:
-            pre_gen_warp.forward(clear_buffer=True)
-            pre_warp.data.copy_from(pre_gen_warp.data)
-        outputs.forward(clear_buffer=True)
-        output_frame = outputs.d
-
-        if i >= 5:
-            name, _ = os.path.splitext(
-                os.path.basename(str(inference_data.paths_lr[i])))
-            filename = args.output_name+'_'+name
-            print('saving image %s' % filename)
-            out_path = os.path.join(args.output_dir, "%s.%s" %
-                                    (filename, args.output_ext))
-            save_img(out_path, output_frame[0])
-        else:  # First 5 is a hard-coded symmetric frame padding, ignored but time added!
-            print("Warming up %d" % (5-i))
-
-        pre_inputs.data.copy_from(inputs_raw.data)
-        pre_gen.data.copy_from(outputs.data)
+    for (height, width), clips in clip_groups.items():
+        generate(clips, height, width, executor)
+    executor.shutdown()
 
 
 if __name__ == '__main__':
@@ -40,6 +40,12 @@ def get_args():
                         help='Path to converted ResNetDepth weight file.')
     parser.add_argument('--test-image', type=str, default='./test-image.jpg',
                         help='Path to the image file.')
+    parser.add_argument('--test-video', type=str, default=None,
+                        help='Path to the video file. If it is given, the landmarks of each frame are saved as a video to --output.')
+    parser.add_argument('--detection-interval', type=int, default=10,
+                        help='Interval of the frames on which the faces are detected. The faces are tracked from their landmarks on the other frames.')
+    parser.add_argument('--batch-size', '-b', type=int, default=8,
+                        help='Number of faces in a forward of FAN.')
     parser.add_argument('--output', type=str, default='output.png',
                         help='Path to save the output image.')
     parser.add_argument("--landmarks-type-3D", help="To run 3D-FAN network. If it is True, you need to pass 3D-FAN pre-trained model path to --model", default=False,
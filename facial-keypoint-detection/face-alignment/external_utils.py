@@ -113,36 +113,31 @@ def get_preds_fromhm(hm, center=None, scale=None):
         hm {numpy.array} -- the predicted heatmaps, of shape [B, N, W, H]
 
     Keyword Arguments:
-        center {numpy.array} -- the center of the bounding box (default: {None})
-        scale {float} -- face scale (default: {None})
+        center {numpy.array} -- the center of the bounding box, or the centers of shape [B, 2] (default: {None})
+        scale {float} -- face scale, or the scales of shape [B] (default: {None})
     """
-    idx = F.max(F.reshape(
-        hm, (hm.shape[0], hm.shape[1], hm.shape[2] * hm.shape[3])), axis=2, only_index=True)
-    idx.d += 1
-    idx = F.reshape(idx, (1, 68, 1))
-    preds = F.concatenate(idx, idx, axis=2)
-    preds.d[..., 0] = preds[..., 0].apply(
-        d=(preds[..., 0].d - 1) % hm.shape[3] + 1).d
-    preds.d[..., 1] = preds[..., 1].apply(
-        d=(preds[..., 1].d + 1) // hm.shape[2] + 1).d
-
-    for i in range(preds.shape[0]):
-        for j in range(preds.shape[1]):
-            hm_ = hm[i, j, :]
-            pX, pY = int(preds[i, j, 0].d) - 1, int(preds[i, j, 1].d) - 1
-
-            if pX > 0 and pX < 63 and pY > 0 and pY < 63:
-                preds.d[i, j] += np.sign(hm_.d[pY, pX + 1] - hm_.d[pY, pX - 1]) * .25, np.sign(
-                    hm_.d[pY + 1, pX] - hm_.d[pY - 1, pX]) * .25
-
-    preds.d -= .5
-    preds_orig = F.constant(shape=preds.shape)
+    if isinstance(hm, nn.Variable):
+        hm = hm.d
+    B, N, H, W = hm.shape
+    idx = np.argmax(hm.reshape(B, N, H * W), axis=2) + 1
+    preds = np.stack([(idx - 1) % W + 1, (idx + 1) // H + 1],
+                     axis=2).astype(np.float32)
+
+    pX, pY = preds[..., 0].astype(int) - 1, preds[..., 1].astype(int) - 1
+    valid = (pX > 0) & (pX < 63) & (pY > 0) & (pY < 63)
+    pX, pY = np.where(valid, pX, 1), np.where(valid, pY, 1)
+    b, n = np.ogrid[:B, :N]
+    diff_x = np.sign(hm[b, n, pY, pX + 1] - hm[b, n, pY, pX - 1])
+    diff_y = np.sign(hm[b, n, pY + 1, pX] - hm[b, n, pY - 1, pX])
+    preds += np.stack([diff_x, diff_y], axis=2) * .25 * valid[..., None]
+
+    preds -= .5
+    preds_orig = np.zeros(preds.shape, dtype=np.float32)
     if center is not None and scale is not None:
-        for i in range(hm.shape[0]):
-            for j in range(hm.shape[1]):
-                d = transform(list(preds.d[i][j]),
-                              center, scale, hm.shape[2], True)
-                preds_orig.d[i, j] = d[0], d[1]
+        # inverse of transform() for all the points
+        center = np.reshape(np.asarray(center, dtype=np.float64), (-1, 1, 2))
+        h = 200.0 * np.reshape(np.asarray(scale, dtype=np.float64), (-1, 1, 1))
+        preds_orig[...] = np.trunc(preds * h / H + center - h / 2)
 
     return preds, preds_orig
 
@@ -192,3 +187,39 @@ def draw_gaussian(image, point, sigma):
           ] = image[img_y[0] - 1:img_y[1], img_x[0] - 1:img_x[1]] + g[g_y[0] - 1:g_y[1], g_x[0] - 1:g_x[1]]
     image[image > 1] = 1
     return image
+
+
+def draw_gaussians(points, resolution=256, sigma=2):
+    """Draw a gaussian of each point on its own heatmap at once,
+    as draw_gaussian() on a zero heatmap for each point with x > 0.
+
+    Arguments:
+        points {numpy.array} -- points of shape [N, 2]
+
+    Keyword Arguments:
+        resolution {int} -- the size of the heatmaps (default: {256})
+        sigma {int} -- the sigma of the gaussian (default: {2})
+
+    Returns:
+        numpy.array -- heatmaps of shape [N, resolution, resolution]
+    """
+    size = 6 * sigma + 1
+    # the gaussian of _gaussian(size) is separable
+    g = _gaussian(size=size, width=size, height=1)[0]
+    ul = np.floor(points - 3 * sigma).astype(int)
+    br = np.floor(points + 3 * sigma).astype(int)
+    inside = (ul[:, 0] <= resolution) & (ul[:, 1] <= resolution) & \
+        (br[:, 0] >= 1) & (br[:, 1] >= 1) & (points[:, 0] > 0)
+
+    def profile(axis):
+        # the values of the gaussian on the pixels along the axis
+        start = np.maximum(1, ul[:, axis]) - 1
+        stop = np.minimum(br[:, axis], resolution)
+        offset = np.maximum(1, -ul[:, axis]) - 1 - start
+        i = np.arange(resolution)[np.newaxis]
+        valid = (i >= start[:, None]) & (i < stop[:, None]) & inside[:, None]
+        gi = np.clip(i + offset[:, None], 0, size - 1)
+        return np.where(valid, g[gi], 0).astype(np.float32)
+
+    heatmaps = profile(1)[:, :, np.newaxis] * profile(0)[:, np.newaxis, :]
+    return np.minimum(heatmaps, 1)
@@ -28,22 +28,11 @@ from external_utils import *
 import numpy as np
 
 
-def main():
-    args = get_args()
-    # Get context
-    from nnabla.ext_utils import get_extension_context
-    logger.info("Running in %s" % args.context)
-    ctx = get_extension_context(
-        args.context, device_id=args.device_id, type_config=args.type_config)
-    nn.set_default_context(ctx)
-    nn.set_auto_forward(True)
-
-    image = io.imread(args.test_image)
-    if image.ndim == 2:
-        image = color.gray2rgb(image)
-    elif image.shape[-1] == 4:
-        image = image[..., :3]
-
+def get_face_detector(args):
+    """Returns a function detecting the faces of an rgb image as a list of
+    [left, top, right, bottom] boxes, with the CNN face detector of dlib on
+    cudnn and the HOG face detector otherwise.
+    """
     if args.context == 'cudnn':
         if not os.path.isfile(args.cnn_face_detction_model):
             # Block of bellow code will download the cnn based face-detection model file provided by dlib for face detection
@@ -58,20 +47,179 @@ def main():
             open(url.split('/')[-1][:-4], 'wb').write(data)
         face_detector = dlib.cnn_face_detection_model_v1(
             args.cnn_face_detction_model)
-        detected_faces = face_detector(cv2.cvtColor(
-            image[..., ::-1].copy(), cv2.COLOR_BGR2GRAY))
-        detected_faces = [[d.rect.left(), d.rect.top(
-        ), d.rect.right(), d.rect.bottom()] for d in detected_faces]
+
+        def detect(image):
+            detected_faces = face_detector(cv2.cvtColor(
+                image[..., ::-1].copy(), cv2.COLOR_BGR2GRAY))
+            return [[d.rect.left(), d.rect.top(), d.rect.right(), d.rect.bottom()]
+                    for d in detected_faces]
     else:
         face_detector = dlib.get_frontal_face_detector()
-        detected_faces = face_detector(cv2.cvtColor(
-            image[..., ::-1].copy(), cv2.COLOR_BGR2GRAY))
-        detected_faces = [[d.left(), d.top(), d.right(), d.bottom()]
-                          for d in detected_faces]
 
-    if len(detected_faces) == 0:
-        print("Warning: No faces were detected.")
-        return None
+        def detect(image):
+            detected_faces = face_detector(cv2.cvtColor(
+                image[..., ::-1].copy(), cv2.COLOR_BGR2GRAY))
+            return [[d.left(), d.top(), d.right(), d.bottom()]
+                    for d in detected_faces]
+    return detect
+
+
+class LandmarkEngine(object):
+    """Landmarks of all the faces of an image, cropped into batches of
+    `batch_size` faces forwarded through one static FAN graph (and
+    ResNetDepth graph for the 3D landmarks) built once for all the images.
+    """
+
+    def __init__(self, batch_size=8, network_size=4, reference_scale=195,
+                 landmarks_type_3D=False):
+        self.batch_size = batch_size
+        self.reference_scale = reference_scale
+        self.landmarks_type_3D = landmarks_type_3D
+        with nn.auto_forward(False):
+            self.x = nn.Variable((batch_size, 3, 256, 256))
+            with nn.parameter_scope("FAN"):
+                self.heatmaps = fan(self.x, network_size)[-1]
+            if landmarks_type_3D:
+                self.gaussians = nn.Variable((batch_size, 68, 256, 256))
+                with nn.parameter_scope("ResNetDepth"):
+                    self.depth = resnet_depth(
+                        F.concatenate(self.x, self.gaussians, axis=1))
+
+    def center_scale(self, d):
+        center = [d[2] - (d[2] - d[0]) / 2.0, d[3] - (d[3] - d[1]) / 2.0]
+        center[1] = center[1] - (d[3] - d[1]) * 0.12
+        scale = (d[2] - d[0] + d[3] - d[1]) / self.reference_scale
+        return center, scale
+
+    def __call__(self, image, detected_faces):
+        """Returns the list of the landmarks of shape (68, 2), or (68, 3) for
+        the 3D landmarks, of each face box of the rgb image.
+        """
+        landmarks = []
+        for b in range(0, len(detected_faces), self.batch_size):
+            faces = detected_faces[b:b + self.batch_size]
+            n = len(faces)
+            centers, scales = zip(*[self.center_scale(d) for d in faces])
+            inp = np.zeros(self.x.shape, dtype=np.float32)
+            for i, (center, scale) in enumerate(zip(centers, scales)):
+                inp[i] = crop(image, center, scale).transpose((2, 0, 1))
+            self.x.d = inp / 255.0
+            self.heatmaps.forward(clear_buffer=True)
+            pts, pts_img = get_preds_fromhm(
+                self.heatmaps.d[:n], centers, scales)
+            pts = pts * 4
+
+            if self.landmarks_type_3D:
+                gaussians = np.zeros(self.gaussians.shape, dtype=np.float32)
+                gaussians[:n] = draw_gaussians(
+                    pts.reshape(-1, 2), 256, 2).reshape((n, 68, 256, 256))
+                self.gaussians.d = gaussians
+                self.depth.forward(clear_buffer=True)
+                depth_pred = self.depth.d[:n].reshape((n, 68, 1))
+                depth_pred = depth_pred * \
+                    (1.0 / (256.0 / (200.0 * np.reshape(scales, (n, 1, 1)))))
+                pts_img = np.concatenate([pts_img, depth_pred], axis=2)
+
+            landmarks.extend(pts_img)
+        return landmarks
+
+
+def track_faces(landmarks, relative_boxes, width, height):
+    """Face boxes of the next video frame from the landmarks of the current
+    frame, placed relative to the bounding box of the landmarks as the
+    detected boxes were. The faces which left the frame are dropped.
+
+    Returns:
+        the list of the tracked boxes and their relative boxes.
+    """
+    boxes, relatives = [], []
+    for pts, rel in zip(landmarks, relative_boxes):
+        x0, y0 = pts[:, 0].min(), pts[:, 1].min()
+        x1, y1 = pts[:, 0].max(), pts[:, 1].max()
+        w, h = x1 - x0, y1 - y0
+        if w < 1 or h < 1 or x1 < 0 or y1 < 0 or x0 >= width or y0 >= height:
+            continue
+        boxes.append([x0 + rel[0] * w, y0 + rel[1] * h,
+                      x1 + rel[2] * w, y1 + rel[3] * h])
+        relatives.append(rel)
+    return boxes, relatives
+
+
+def relative_to_landmarks(boxes, landmarks):
+    """Boxes relative to the bounding box of the landmarks of each face."""
+    relatives = []
+    for d, pts in zip(boxes, landmarks):
+        x0, y0 = pts[:, 0].min(), pts[:, 1].min()
+        x1, y1 = pts[:, 0].max(), pts[:, 1].max()
+        w, h = max(x1 - x0, 1), max(y1 - y0, 1)
+        relatives.append([(d[0] - x0) / w, (d[1] - y0) / h,
+                          (d[2] - x1) / w, (d[3] - y1) / h])
+    return relatives
+
+
+def video_inference(args, detect, engine):
+    """Landmarks of the faces of each frame of a video, saved as a video with
+    the landmarks drawn. The faces are detected every `detection_interval`
+    frames, or when no face is tracked, and tracked from their landmarks in
+    the other frames.
+    """
+    import time
+    cap = cv2.VideoCapture(args.test_video)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    writer = None
+    boxes, relatives = [], []
+    num_frames, num_faces = 0, 0
+    start = time.time()
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        height, width = frame.shape[:2]
+        if writer is None:
+            writer = cv2.VideoWriter(args.output, cv2.VideoWriter_fourcc(*'mp4v'),
+                                     fps, (width, height))
+        image = frame[..., ::-1]
+        redetect = num_frames % args.detection_interval == 0 or not boxes
+        if redetect:
+            boxes = detect(image)
+        landmarks = engine(image, boxes)
+        if redetect:
+            relatives = relative_to_landmarks(boxes, landmarks)
+        boxes, relatives = track_faces(landmarks, relatives, width, height)
+        writer.write(draw_landmarks(frame, landmarks))
+        num_frames += 1
+        num_faces += len(landmarks)
+    cap.release()
+    if writer is not None:
+        writer.release()
+    elapsed = time.time() - start
+    print("{} frames, {} faces in {:.2f} sec ({:.2f} frames/sec)".format(
+        num_frames, num_faces, elapsed, num_frames / max(elapsed, 1e-8)))
+
+
+def main():
+    args = get_args()
+    # Get context
+    from nnabla.ext_utils import get_extension_context
+    logger.info("Running in %s" % args.context)
+    ctx = get_extension_context(
+        args.context, device_id=args.device_id, type_config=args.type_config)
+    nn.set_default_context(ctx)
+    nn.set_auto_forward(True)
+
+    detect = get_face_detector(args)
+
+    if args.test_video is None:
+        image = io.imread(args.test_image)
+        if image.ndim == 2:
+            image = color.gray2rgb(image)
+        elif image.shape[-1] == 4:
+            image = image[..., :3]
+
+        detected_faces = detect(image)
+        if len(detected_faces) == 0:
+            print("Warning: No faces were detected.")
+            return None
 
     # Load FAN weights
     with nn.parameter_scope("FAN"):
@@ -84,40 +232,19 @@ def main():
             print("Loading ResNetDepth weights...")
             nn.load_parameters(args.resnet_depth_model)
 
-    landmarks = []
-    for i, d in enumerate(detected_faces):
-        center = [d[2] - (d[2] - d[0]) / 2.0, d[3] - (d[3] - d[1]) / 2.0]
-        center[1] = center[1] - (d[3] - d[1]) * 0.12
-        scale = (d[2] - d[0] + d[3] - d[1]) / args.reference_scale
-        inp = crop(image, center, scale)
-        inp = nn.Variable.from_numpy_array(inp.transpose((2, 0, 1)))
-        inp = F.reshape(F.mul_scalar(inp, 1 / 255.0), (1,) + inp.shape)
-        with nn.parameter_scope("FAN"):
-            out = fan(inp, args.network_size)[-1]
-        pts, pts_img = get_preds_fromhm(out, center, scale)
-        pts, pts_img = F.reshape(pts, (68, 2)) * \
-            4, F.reshape(pts_img, (68, 2))
-
-        if args.landmarks_type_3D:
-            heatmaps = np.zeros((68, 256, 256), dtype=np.float32)
-            for i in range(68):
-                if pts.d[i, 0] > 0:
-                    heatmaps[i] = draw_gaussian(
-                        heatmaps[i], pts.d[i], 2)
-            heatmaps = nn.Variable.from_numpy_array(heatmaps)
-            heatmaps = F.reshape(heatmaps, (1,) + heatmaps.shape)
-            with nn.parameter_scope("ResNetDepth"):
-                depth_pred = F.reshape(resnet_depth(
-                    F.concatenate(inp, heatmaps, axis=1)), (68, 1))
-            pts_img = F.concatenate(
-                pts_img, depth_pred * (1.0 / (256.0 / (200.0 * scale))), axis=1)
-
-        landmarks.append(pts_img.d)
+    engine = LandmarkEngine(args.batch_size, args.network_size,
+                            args.reference_scale, args.landmarks_type_3D)
+    if args.test_video is not None:
+        video_inference(args, detect, engine)
+        return
+
+    landmarks = engine(image, detected_faces)
     visualize(landmarks, image, args.output)
 
 
 if __name__ == '__main__':
     '''
-    Usage : python model_inference.py --model=/path to pre-trained .h5 file --test-image=image file for inference 
+    Usage : python model_inference.py --model=/path to pre-trained .h5 file --test-image=image file for inference
+            python model_inference.py --model=/path to pre-trained .h5 file --test-video=video file --output=output.mp4
     '''
     main()
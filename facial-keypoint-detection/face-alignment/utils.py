@@ -41,3 +41,23 @@ def visualize(landmarks, image, output_path, plot=False):
     if plot:
         plt.show()
     plt.close(fig)
+
+
+def draw_landmarks(image, landmarks):
+    """Draw the detected landmarks on the image in place, with the same
+    lines as visualize(), e.g. for the frames of a video.
+
+    Arguments:
+        image {numpy.array} -- a bgr image.
+        landmarks {list} -- list of the detected landmarks.
+    """
+    import cv2
+    import numpy as np
+    ind = [0, 17, 22, 27, 31, 36, 42, 48, 60, 68]
+    for pts_img in landmarks:
+        pts = np.round(pts_img[:, :2]).astype(np.int32)
+        cv2.polylines(image, [pts[ind[i]:ind[i + 1]] for i in range(len(ind) - 1)],
+                      False, (255, 255, 255), 1)
+        for x, y in pts:
+            cv2.circle(image, (int(x), int(y)), 1, (255, 255, 255), -1)
+    return image
@@ -16,13 +16,16 @@
 import os.path as osp
 import argparse
 import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 import nnabla as nn
 import nnabla.functions as F
 from nnabla.ext_utils import get_extension_context
-from models import zooming_slo_mo_network
+from models import feature_extraction, reconstruction
 import utils.utils as util
+from neu.metrics import image_quality
 
 
 parser = argparse.ArgumentParser(
@@ -37,10 +40,84 @@ parser.add_argument('--metrics', action='store_true', default=False,
                     help='calculate metrics i.e. SSIM and PSNR')
 parser.add_argument('--only-slomo', action='store_true', default=False,
                     help='If True, Slo-Mo only Inference (No Zooming)')
+parser.add_argument('--num-workers', type=int, default=4,
+                    help='number of threads to read and write the frames')
 
 args = parser.parse_args()
 
 
+class FrameReader(object):
+    """
+    Read the frames of a sequence on demand, prefetching the frames to be
+    read next in background threads.
+    """
+
+    def __init__(self, img_path_l, order, executor, prefetch=4):
+        self.img_path_l = img_path_l
+        self.order = order
+        self.position = {idx: pos for pos, idx in enumerate(order)}
+        self.executor = executor
+        self.prefetch = prefetch
+        self.futures = {}
+
+    def __len__(self):
+        return len(self.img_path_l)
+
+    def _read(self, idx):
+        # CHW, RGB, [0,1]
+        img = util.read_image(self.img_path_l[idx])[:, :, [2, 1, 0]]
+        return np.ascontiguousarray(np.transpose(img, (2, 0, 1)))
+
+    def __getitem__(self, idx):
+        pos = self.position[idx]
+        for i in self.order[pos:pos + self.prefetch + 1]:
+            if i not in self.futures:
+                self.futures[i] = self.executor.submit(self._read, i)
+        return self.futures.pop(idx).result()
+
+
+class ZoomingSloMoInference(object):
+    """
+    Zooming SloMo with the graphs built once for a fixed window shape.
+    The LR features of each input frame are computed once and cached,
+    so that the frames shared by overlapping windows are not encoded again.
+    """
+
+    def __init__(self, height, width, n_in, only_slomo):
+        with nn.auto_forward(False):
+            self.frame = nn.Variable((1, 1, 3, height, width))
+            self.frame_features = feature_extraction(self.frame)
+            for f in self.frame_features:
+                f.persistent = True
+            self.features = [nn.Variable((1, n_in) + f.shape[2:])
+                             for f in self.frame_features]
+            self.outputs = reconstruction(self.features, only_slomo)
+        self.cache = {}
+        self.num_encoded = 0
+
+    def reset(self):
+        self.cache = {}
+
+    def encode(self, img):
+        self.frame.d = img[np.newaxis, np.newaxis]
+        nn.forward_all(self.frame_features, clear_buffer=True)
+        self.num_encoded += 1
+        return [F.identity(f.data) for f in self.frame_features]
+
+    def __call__(self, select_idx, frames):
+        # the windows move forward, drop the features of the past frames
+        for idx in [idx for idx in self.cache if idx < select_idx[0]]:
+            del self.cache[idx]
+        for idx in select_idx:
+            if idx not in self.cache:
+                self.cache[idx] = self.encode(frames[idx])
+        for level, v in enumerate(self.features):
+            v.data = F.concatenate(
+                *[self.cache[idx][level] for idx in select_idx], axis=1)
+        self.outputs.forward(clear_buffer=True)
+        return self.outputs.d[0]
+
+
 def test():
     """
     Test(Zooming SloMo) - inference on set of input data or Vid4 data
@@ -51,6 +128,7 @@ def test():
     nn.load_parameters(args.model)
     input_dir = args.input_dir
     n_ot = 7
+    n_in = 1 + n_ot // 2
 
     # list all input sequence folders containing input frames
     inp_dir_list = sorted(glob.glob(input_dir + '/*'))
@@ -60,6 +138,10 @@ def test():
     avg_ssim_y_l = []
     sub_folder_name_l = []
     save_folder = 'results'
+    # graphs for each frame size
+    engines = {}
+    total_frames, total_time = 0, 0
+    executor = ThreadPoolExecutor(max_workers=args.num_workers)
     # for each sub-folder
     for inp_dir in inp_dir_list:
         gt_tested_list = []
@@ -68,16 +150,15 @@ def test():
 
         inp_dir_name_list.append(inp_dir_name)
         save_inp_folder = osp.join(save_folder, inp_dir_name)
-        img_low_res_list = sorted(glob.glob(inp_dir + '/*'))
+        img_low_res_list = util.list_seq_imgs(inp_dir)
 
         util.mkdirs(save_inp_folder)
-        imgs = util.read_seq_imgs_(inp_dir)
 
-        img_gt_l = []
+        img_gt_path_l = []
         if args.metrics:
             replace_str = 'LR'
-            for img_gt_path in sorted(glob.glob(osp.join(inp_dir.replace(replace_str, 'HR'), '*'))):
-                img_gt_l.append(util.read_image(img_gt_path))
+            img_gt_path_l = sorted(
+                glob.glob(osp.join(inp_dir.replace(replace_str, 'HR'), '*')))
 
         avg_psnr, avg_psnr_sum, cal_n = 0, 0, 0
         avg_psnr_y, avg_psnr_sum_y = 0, 0
@@ -87,51 +168,78 @@ def test():
 
         select_idx_list = util.test_index_generation(
             skip, n_ot, len(img_low_res_list))
+        # read the frames in the order of the windows
+        order = []
+        for select_idxs in select_idx_list:
+            order += [idx for idx in select_idxs[0] if idx not in order]
+        frames = FrameReader(img_low_res_list, order, executor,
+                             prefetch=n_in)
 
+        start_time = time.time()
+        num_frames = 0
+        saving = []
+        # build the graphs once for each frame size
+        img = frames[0]
+        shape = img.shape[1:]
+        if shape not in engines:
+            engines[shape] = ZoomingSloMoInference(
+                *shape, n_in, args.only_slomo)
+        engine = engines[shape]
+        engine.reset()
+        engine.cache[0] = engine.encode(img)
         # process each image
         for select_idxs in select_idx_list:
             # get input images
-            select_idx = [select_idxs[0]]
+            select_idx = select_idxs[0]
             gt_idx = select_idxs[1]
-            imgs_in = F.gather_nd(
-                imgs, indices=nn.Variable.from_numpy_array(select_idx))
-            imgs_in = F.reshape(x=imgs_in, shape=(1,) + imgs_in.shape)
-            output = zooming_slo_mo_network(imgs_in, args.only_slomo)
-            outputs = output[0]
-            outputs.forward(clear_buffer=True)
+            outputs = engine(select_idx, frames)
 
+            output_l = []
+            ground_truth_l = []
             for idx, name_idx in enumerate(gt_idx):
                 if name_idx in gt_tested_list:
                     continue
                 gt_tested_list.append(name_idx)
-                output_f = outputs.d[idx, :, :, :]
+                output_f = outputs[idx, :, :, :]
                 output = util.tensor2img(output_f)
-                cv2.imwrite(osp.join(save_inp_folder,
-                                     '{:08d}.png'.format(name_idx + 1)), output)
-                print("Saving :", osp.join(save_inp_folder,
-                                           '{:08d}.png'.format(name_idx + 1)))
+                save_path = osp.join(save_inp_folder,
+                                     '{:08d}.png'.format(name_idx + 1))
+                saving.append(executor.submit(cv2.imwrite, save_path, output))
+                print("Saving :", save_path)
+                num_frames += 1
 
                 if args.metrics:
-                    # calculate PSNR
-                    output = output / 255.
-                    ground_truth = np.copy(img_gt_l[name_idx])
-                    cropped_output = output
-                    cropped_gt = ground_truth
-
-                    crt_psnr = util.calculate_psnr(
-                        cropped_output * 255, cropped_gt * 255)
-                    cropped_gt_y = util.bgr2ycbcr(cropped_gt, only_y=True)
-                    cropped_output_y = util.bgr2ycbcr(
-                        cropped_output, only_y=True)
-                    crt_psnr_y = util.calculate_psnr(
-                        cropped_output_y * 255, cropped_gt_y * 255)
-                    crt_ssim_y = util.calculate_ssim(
-                        cropped_output_y * 255, cropped_gt_y * 255)
-
-                    avg_psnr_sum += crt_psnr
-                    avg_psnr_sum_y += crt_psnr_y
-                    avg_ssim_sum_y += crt_ssim_y
-                    cal_n += 1
+                    output_l.append(output / 255.)
+                    ground_truth_l.append(
+                        util.read_image(img_gt_path_l[name_idx]))
+
+            if args.metrics and output_l:
+                # calculate PSNR and SSIM of the new frames of the window at once
+                cropped_output = np.stack(output_l)
+                cropped_gt = np.stack(ground_truth_l)
+
+                crt_psnr = image_quality.psnr(
+                    cropped_output * 255, cropped_gt * 255)
+                cropped_gt_y = image_quality.bgr2y(cropped_gt)
+                cropped_output_y = image_quality.bgr2y(cropped_output)
+                crt_psnr_y = image_quality.psnr(
+                    cropped_output_y * 255, cropped_gt_y * 255)
+                crt_ssim_y = image_quality.ssim(
+                    cropped_output_y * 255, cropped_gt_y * 255,
+                    num_threads=args.num_workers)
+
+                avg_psnr_sum += crt_psnr.sum()
+                avg_psnr_sum_y += crt_psnr_y.sum()
+                avg_ssim_sum_y += crt_ssim_y.sum()
+                cal_n += len(output_l)
+        for f in saving:
+            f.result()
+        engine.reset()
+        elapsed = time.time() - start_time
+        total_frames += num_frames
+        total_time += elapsed
+        print('Folder {} - {} output frames in {:.2f} s ({:.2f} frames/sec)'.format(
+            inp_dir_name, num_frames, elapsed, num_frames / elapsed))
 
         if args.metrics:
             avg_psnr = avg_psnr_sum / cal_n
@@ -141,7 +249,10 @@ def test():
             avg_psnr_l.append(avg_psnr)
             avg_psnr_y_l.append(avg_psnr_y)
             avg_ssim_y_l.append(avg_ssim_y)
+    executor.shutdown()
 
+    print('Throughput: {} output frames in {:.2f} s ({:.2f} frames/sec)'.format(
+        total_frames, total_time, total_frames / max(total_time, 1e-8)))
     if args.metrics:
         print('################ Tidy Outputs ################')
         for name, ssim, psnr_y in zip(sub_folder_name_l, avg_ssim_y_l, avg_psnr_y_l):
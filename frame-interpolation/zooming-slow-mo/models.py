@@ -306,22 +306,26 @@ def pixel_shuffle(ps_input):
     return output
 
 
-def zooming_slo_mo_network(input_imgs, only_slomo, n_filt=64,
-                           front_res_blocks=5, back_res_blocks=40):
-    # The residual blocks
-    def residual_block(res_blk_input, output_channels=64, scope='res_block'):
-        """
-        define a residual block here with conv + relu + conv
-        """
-        with nn.parameter_scope(scope):
-            feats = conv2d(res_blk_input, output_channels, 3, 1, 1,
-                           name='conv1', init_method='kaiming_normal', scale=0.1)
-            feats = F.relu(feats)
-            feats = conv2d(feats, output_channels, 3, 1, 1,
-                           name='conv2', init_method='kaiming_normal', scale=0.1)
-            feats = F.add2(feats, res_blk_input)
-        return feats
+def residual_block(res_blk_input, output_channels=64, scope='res_block'):
+    """
+    define a residual block here with conv + relu + conv
+    """
+    with nn.parameter_scope(scope):
+        feats = conv2d(res_blk_input, output_channels, 3, 1, 1,
+                       name='conv1', init_method='kaiming_normal', scale=0.1)
+        feats = F.relu(feats)
+        feats = conv2d(feats, output_channels, 3, 1, 1,
+                       name='conv2', init_method='kaiming_normal', scale=0.1)
+        feats = F.add2(feats, res_blk_input)
+    return feats
+
 
+def feature_extraction(input_imgs, n_filt=64, front_res_blocks=5):
+    """
+    Extract the 3 level pyramid of LR features of each input frame.
+    input : nn.Variable of shape (B, N, 3, H, W)
+    output : features [L1, L2, L3] of shape (B, N, C, H / 2^l, W / 2^l)
+    """
     batch, n_frames, channels, height, width = input_imgs.shape  # n_frames: input frames
 
     # extract LR features
@@ -353,6 +357,17 @@ def zooming_slo_mo_network(input_imgs, only_slomo, n_filt=64,
                                 height // 2, width // 2), inplace=False)
     l3_fea = F.reshape(l3_fea, (batch, n_frames, -1,
                                 height // 4, width // 4), inplace=False)
+    return [l1_fea, l2_fea, l3_fea]
+
+
+def reconstruction(features, only_slomo, n_filt=64, back_res_blocks=40):
+    """
+    Reconstruct the output frames from the LR features of the input frames.
+    input : features [L1, L2, L3] given by `feature_extraction`
+    output : nn.Variable of shape (B, 2N - 1, 3, H', W')
+    """
+    l1_fea, l2_fea, l3_fea = features
+    n_frames = l1_fea.shape[1]
 
     # align using pcd
     to_lstm_fea = []
@@ -398,3 +413,9 @@ def zooming_slo_mo_network(input_imgs, only_slomo, n_filt=64,
     _, _, hight, width = out.shape
     outs = out.reshape((batch_size, time_slices, -1, hight, width))
     return outs
+
+
+def zooming_slo_mo_network(input_imgs, only_slomo, n_filt=64,
+                           front_res_blocks=5, back_res_blocks=40):
+    features = feature_extraction(input_imgs, n_filt, front_res_blocks)
+    return reconstruction(features, only_slomo, n_filt, back_res_blocks)
@@ -14,12 +14,12 @@
 # limitations under the License.
 
 import os
-import math
 import glob
 import re
 import nnabla as nn
 import numpy as np
 import cv2
+from neu.metrics import image_quality
 
 
 def mkdir(path):
@@ -92,12 +92,18 @@ def read_image(img_path):
     return img
 
 
-def read_seq_imgs_(img_seq_path):
-    '''read a sequence of images'''
+def list_seq_imgs(img_seq_path):
+    '''list the images of a sequence in the order of the frame numbers'''
     img_path_l = glob.glob(img_seq_path + '/*')
     # img_path_l.sort(key=lambda x: int(os.path.basename(x)[:-4]))
     img_path_l.sort(key=lambda x: int(
         re.search(r'\d+', os.path.basename(x)).group()))
+    return img_path_l
+
+
+def read_seq_imgs_(img_seq_path):
+    '''read a sequence of images'''
+    img_path_l = list_seq_imgs(img_seq_path)
     img_l = [read_image(v) for v in img_path_l]
     # stack to TCHW, RGB, [0,1]
     imgs = np.stack(img_l, axis=0)
@@ -150,37 +156,18 @@ def bgr2ycbcr(img, only_y=True):
 # metric
 ####################
 
-def calculate_psnr(img1, img2):
-    # img1 and img2 have range [0, 255]
-    img1 = img1.astype(np.float64)
-    img2 = img2.astype(np.float64)
-    mse = np.mean((img1 - img2) ** 2)
-    if mse == 0:
-        return float('inf')
-    return 20 * math.log10(255.0 / math.sqrt(mse))
-
-
-def ssim(img1, img2):
-    c1 = (0.01 * 255) ** 2
-    c2 = (0.03 * 255) ** 2
-
-    img1 = img1.astype(np.float64)
-    img2 = img2.astype(np.float64)
-    kernel = cv2.getGaussianKernel(11, 1.5)
-    window = np.outer(kernel, kernel.transpose())
+def _to_batch(img):
+    # HW or HWC image to NHWC
+    if img.ndim == 2:
+        return img[np.newaxis, :, :, np.newaxis]
+    if img.ndim == 3:
+        return img[np.newaxis]
+    raise ValueError('Wrong input image dimensions.')
 
-    mu1 = cv2.filter2D(img1, -1, window)[5:-5, 5:-5]  # valid
-    mu2 = cv2.filter2D(img2, -1, window)[5:-5, 5:-5]
-    mu1_sq = mu1 ** 2
-    mu2_sq = mu2 ** 2
-    mu1_mu2 = mu1 * mu2
-    sigma1_sq = cv2.filter2D(img1 ** 2, -1, window)[5:-5, 5:-5] - mu1_sq
-    sigma2_sq = cv2.filter2D(img2 ** 2, -1, window)[5:-5, 5:-5] - mu2_sq
-    sigma12 = cv2.filter2D(img1 * img2, -1, window)[5:-5, 5:-5] - mu1_mu2
 
-    ssim_map = ((2 * mu1_mu2 + c1) * (2 * sigma12 + c2)) / ((mu1_sq + mu2_sq + c1) *
-                                                            (sigma1_sq + sigma2_sq + c2))
-    return ssim_map.mean()
+def calculate_psnr(img1, img2):
+    # img1 and img2 have range [0, 255]
+    return float(image_quality.psnr(_to_batch(img1), _to_batch(img2))[0])
 
 
 def calculate_ssim(img1, img2):
@@ -190,14 +177,4 @@ def calculate_ssim(img1, img2):
     '''
     if not img1.shape == img2.shape:
         raise ValueError('Input images must have the same dimensions.')
-
-    if img1.ndim == 2:
-        return ssim(img1, img2)
-
-    if img1.ndim == 3:
-        ssims = []
-        for ch_idx in img1.shape[2]:
-            ssims.append(ssim(img1[ch_idx], img2[ch_idx]))
-        return np.array(ssims).mean()
-
-    raise ValueError('Wrong input image dimensions.')
+    return float(image_quality.ssim(_to_batch(img1), _to_batch(img2))[0])
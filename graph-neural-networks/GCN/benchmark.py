@@ -0,0 +1,126 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import nnabla as nn
+import nnabla.functions as F
+import nnabla.solvers as S
+import numpy as np
+
+from gcn_model import gcn, sampled_gcn, SparseMatrix
+from utils import synthetic_graph, normalize_adj_sparse, NeighborSampler
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-nodes', type=int, nargs='+', default=[100000, 1000000],
+                        help='Numbers of nodes of the synthetic graphs.')
+    parser.add_argument('--avg-degree', type=int, default=10)
+    parser.add_argument('--num-features', type=int, default=64)
+    parser.add_argument('--batch-size', '-b', type=int, default=512)
+    parser.add_argument('--fanouts', type=int, nargs=2, default=[10, 10])
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='Number of timed iterations.')
+    parser.add_argument('--max-dense-nodes', type=int, default=20000,
+                        help='The dense path is measured only up to this number of nodes.')
+    parser.add_argument('--context', '-c', type=str, default='cpu')
+    parser.add_argument('--device-id', '-d', type=str, default='0')
+    return parser.parse_args()
+
+
+def timeit(func, iterations):
+    func()  # warm-up
+    start = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - start) / iterations
+
+
+def benchmark(num_nodes, args):
+    print('=== {} nodes ==='.format(num_nodes))
+    nn.clear_parameters()
+
+    start = time.time()
+    A, feature_matrix, labels = synthetic_graph(
+        num_nodes, args.avg_degree, args.num_features)
+    print('graph generation: {:.3f} sec, {} edges'.format(
+        time.time() - start, A.nnz))
+
+    start = time.time()
+    A_hat = normalize_adj_sparse(A)
+    print('sparse normalization: {:.3f} sec'.format(time.time() - start))
+    csr_bytes = A_hat.data.nbytes + A_hat.indices.nbytes + A_hat.indptr.nbytes
+    print('adjacency memory: sparse {:.1f} MB, dense {:.1f} MB'.format(
+        csr_bytes / 2 ** 20, num_nodes ** 2 * 4 / 2 ** 20))
+
+    num_classes = max(labels) + 1
+    X = nn.Variable.from_numpy_array(feature_matrix.astype(np.float32))
+
+    # full-graph forward with the sparse adjacency matrix
+    H = gcn(SparseMatrix.from_scipy(A_hat), X, num_classes, 0)
+    t = timeit(lambda: H.forward(clear_buffer=True), args.iterations)
+    print('full-graph forward (sparse): {:.4f} sec'.format(t))
+
+    if num_nodes <= args.max_dense_nodes:
+        H_dense = gcn(nn.Variable.from_numpy_array(A_hat.toarray()),
+                      X, num_classes, 0)
+        t = timeit(lambda: H_dense.forward(clear_buffer=True), args.iterations)
+        print('full-graph forward (dense): {:.4f} sec'.format(t))
+
+    # mini-batch training step with neighbour sampling
+    sampler = NeighborSampler(A, args.fanouts)
+    X_batch = nn.Variable(
+        (sampler.num_input_nodes(args.batch_size), args.num_features))
+    labels_batch = nn.Variable((args.batch_size, 1))
+    loss = F.mean(F.categorical_cross_entropy(
+        sampled_gcn(X_batch, args.fanouts, num_classes), labels_batch))
+    solver = S.Adam(alpha=0.01)
+    solver.set_parameters(nn.get_parameters())
+    rng = np.random.RandomState(0)
+
+    def sample():
+        targets = rng.randint(num_nodes, size=args.batch_size)
+        nodes = sampler.sample(targets)
+        X_batch.d = feature_matrix[nodes[0]]
+        labels_batch.d = labels[targets, None]
+
+    def step():
+        sample()
+        solver.zero_grad()
+        loss.forward(clear_no_need_grad=True)
+        loss.backward(clear_buffer=True)
+        solver.update()
+
+    t_sample = timeit(sample, args.iterations)
+    t_step = timeit(step, args.iterations)
+    print('neighbour sampling: {:.4f} sec/batch'.format(t_sample))
+    print('mini-batch training step: {:.4f} sec/batch, {:.1f} nodes/sec'.format(
+        t_step, args.batch_size / t_step))
+
+
+def main():
+    args = get_args()
+
+    from nnabla.ext_utils import get_extension_context
+    ctx = get_extension_context(args.context, device_id=args.device_id)
+    nn.set_default_context(ctx)
+
+    for num_nodes in args.num_nodes:
+        benchmark(num_nodes, args)
+
+
+if __name__ == '__main__':
+    main()
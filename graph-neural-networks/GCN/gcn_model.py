@@ -12,11 +12,61 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import numpy as np
 import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
 
 
+class SparseMatrix(object):
+    """
+    Sparse matrix in COO format holding its indices and values as nnabla Variables.
+    """
+
+    def __init__(self, row, col, val, shape):
+        self.row = row
+        self.col = col
+        self.val = val
+        self.shape = shape
+
+    @classmethod
+    def from_scipy(cls, A):
+        '''
+        Create from a scipy.sparse matrix.
+        '''
+        A = A.tocoo()
+        nnz = A.nnz
+        row = nn.Variable.from_numpy_array(A.row.reshape(1, nnz))
+        col = nn.Variable.from_numpy_array(A.col.reshape(1, nnz))
+        val = nn.Variable.from_numpy_array(
+            A.data.astype(np.float32).reshape(nnz, 1))
+        return cls(row, col, val, A.shape)
+
+
+def sparse_dot(A, H):
+    '''
+    Sparse-dense matrix product
+
+    Rows of H are gathered for every non-zero entry of A, scaled by the entry
+    and scatter-added into the output rows, so that memory is O(nnz * C)
+    instead of O(N^2).
+
+    Parameters
+    ----------
+    A: SparseMatrix
+      Sparse matrix of shape (N, M)
+    H: nnabla.Variable
+      Dense matrix of shape (M, C)
+
+    Returns
+    -------
+    nnabla.Variable
+      Product of shape (N, C)
+    '''
+    message = F.gather_nd(H, A.col) * A.val
+    return F.scatter_nd(message, A.row, shape=(A.shape[0], H.shape[1]), add=True)
+
+
 def gcn(A_hat, X, num_classes=7, dropout=0.5):
     """
     Two layer GCN model.
@@ -36,7 +86,7 @@ def gcn_layer(A_hat, X, out_features, name, dropout=0.5, activation=F.relu):
 
     Parameters
     ----------
-    A_hat: nnabla.Variable
+    A_hat: nnabla.Variable or SparseMatrix
       Normalized graph Laplacian
     X: nnabla.Variable
       Feature matrix
@@ -60,7 +110,68 @@ def gcn_layer(A_hat, X, out_features, name, dropout=0.5, activation=F.relu):
             X = F.dropout(X, dropout)
 
         H = PF.affine(X, (out_features, ), with_bias=False)
-        H = F.dot(A_hat, H)
+        if isinstance(A_hat, SparseMatrix):
+            H = sparse_dot(A_hat, H)
+        else:
+            H = F.dot(A_hat, H)
+
+        if activation is not None:
+            H = activation(H)
+
+    return H
+
+
+def sampled_gcn(X, fanouts, num_classes=7, dropout=0.5):
+    """
+    Two layer GCN model on a computation tree sampled by NeighborSampler.
+
+    Parameters are shared with `gcn`, so that a model trained with neighbour
+    sampling can be evaluated on the full graph with the row-normalized
+    adjacency matrix.
+    """
+
+    H = sampled_gcn_layer(X, fanouts[0], out_features=16,
+                          name='gcn_layer_0', dropout=dropout)
+    H = sampled_gcn_layer(H, fanouts[1], out_features=num_classes,
+                          name='gcn_layer_1', dropout=dropout, activation=F.softmax)
+
+    return H
+
+
+def sampled_gcn_layer(X, fanout, out_features, name, dropout=0.5, activation=F.relu):
+    '''
+    GCN layer on a sampled block
+
+    Parameters
+    ----------
+    X: nnabla.Variable
+      Feature matrix of shape (N * (1 + fanout), C), where each of N output
+      nodes is followed by its sampled neighbours
+    fanout: int
+      Number of sampled neighbours per node
+    out_features: int
+      Number of dimensions of output
+    name: str
+      Name of parameter scope
+    dropout: float
+      Parameter of dropout. If 0, not to use dropout
+    activaton: nnabla.functons
+      Activation function
+
+    Returns
+    -------
+    H: nnabla.Variable
+      Output of shape (N, out_features), the mean over each node and its
+      neighbours
+    '''
+
+    with nn.parameter_scope(name):
+        if dropout > 0:
+            X = F.dropout(X, dropout)
+
+        H = PF.affine(X, (out_features, ), with_bias=False)
+        H = F.reshape(H, (-1, 1 + fanout, out_features))
+        H = F.mean(H, axis=1)
 
         if activation is not None:
             H = activation(H)
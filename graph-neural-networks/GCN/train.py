@@ -18,10 +18,21 @@ import nnabla.functions as F
 import nnabla.solvers as S
 import numpy as np
 
-from gcn_model import gcn
-from utils import load_cora, get_mask, normalize_adj, get_accuracy
+from gcn_model import gcn, SparseMatrix
+from utils import load_cora, get_mask, normalize_adj, normalize_adj_sparse, get_accuracy
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sparse', action='store_true',
+                        help='Use the sparse adjacency matrix instead of the dense one.')
+    return parser.parse_args()
+
 
 if __name__ == '__main__':
+    args = get_args()
+
     try:
         from nnabla.ext_utils import get_extension_context
         ctx = get_extension_context('cudnn', device_id='0')
@@ -39,10 +50,16 @@ if __name__ == '__main__':
         20, 500, 500, num_nodes, num_classes, labels)
 
     print('Preprocessing data...')
-    A_hat = normalize_adj(G)
+    if args.sparse:
+        A_hat = normalize_adj_sparse(G)
+    else:
+        A_hat = normalize_adj(G)
 
     print('Building model...')
-    A_hat = nn.Variable.from_numpy_array(A_hat)
+    if args.sparse:
+        A_hat = SparseMatrix.from_scipy(A_hat)
+    else:
+        A_hat = nn.Variable.from_numpy_array(A_hat)
     X = nn.Variable.from_numpy_array(feature_matrix)
     labels = nn.Variable.from_numpy_array(np.expand_dims(labels, axis=1))
     train_mask = nn.Variable.from_numpy_array(
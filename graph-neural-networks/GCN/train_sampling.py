@@ -0,0 +1,141 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import networkx as nx
+import nnabla as nn
+import nnabla.functions as F
+import nnabla.solvers as S
+import numpy as np
+
+from gcn_model import gcn, sampled_gcn, SparseMatrix
+from utils import load_cora, synthetic_graph, get_mask, normalize_adj_sparse, get_accuracy, NeighborSampler
+
+
+def get_args():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dataset', default='cora', choices=['cora', 'synthetic'],
+                        help='Dataset to train on.')
+    parser.add_argument('--num-nodes', type=int, default=100000,
+                        help='Number of nodes of the synthetic graph.')
+    parser.add_argument('--avg-degree', type=int, default=10,
+                        help='Average degree of the synthetic graph.')
+    parser.add_argument('--batch-size', '-b', type=int, default=64,
+                        help='Number of target nodes per mini-batch.')
+    parser.add_argument('--fanouts', type=int, nargs=2, default=[10, 10],
+                        help='Number of sampled neighbours of each layer, from the input layer.')
+    parser.add_argument('--epochs', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = get_args()
+
+    try:
+        from nnabla.ext_utils import get_extension_context
+        ctx = get_extension_context('cudnn', device_id='0')
+        nn.set_default_context(ctx)
+    except:
+        pass
+
+    print('Loading dataset...')
+    if args.dataset == 'cora':
+        G, feature_matrix, labels = load_cora()
+        A = nx.adjacency_matrix(G)
+        num_train_per_class, num_valid, num_test = 20, 500, 500
+    else:
+        A, feature_matrix, labels = synthetic_graph(
+            args.num_nodes, args.avg_degree, seed=args.seed)
+        num_train_per_class = args.num_nodes // 100
+        num_valid = num_test = args.num_nodes // 10
+
+    num_nodes = A.shape[0]
+    num_classes = max(labels) + 1
+    feature_matrix = feature_matrix.astype(np.float32)
+
+    train_mask, valid_mask, test_mask = get_mask(
+        num_train_per_class, num_valid, num_test, num_nodes, num_classes, labels)
+
+    print('Preprocessing data...')
+    sampler = NeighborSampler(A, args.fanouts, seed=args.seed)
+    A_hat = normalize_adj_sparse(A, mode='rw')
+
+    print('Building model...')
+    # Mini-batch graph on sampled computation trees, built once and reused
+    batch_size = min(args.batch_size, len(train_mask))
+    X_batch = nn.Variable(
+        (sampler.num_input_nodes(batch_size), feature_matrix.shape[1]))
+    labels_batch = nn.Variable((batch_size, 1))
+    H_batch = sampled_gcn(X_batch, args.fanouts, num_classes, 0.5)
+
+    # Full graph for evaluation with the row-normalized adjacency matrix,
+    # which approximates the mean aggregation of the sampled layers (the
+    # self term is weighted by 1/(1+degree) instead of 1/(1+fanout))
+    A_hat = SparseMatrix.from_scipy(A_hat)
+    X = nn.Variable.from_numpy_array(feature_matrix)
+    H_valid = gcn(A_hat, X, num_classes, 0)
+
+    # Solver / Optimizer
+    solver = S.Adam(alpha=0.01)
+    solver.set_parameters(nn.get_parameters())
+
+    # Weight decay
+    loss_wd = 0.0
+    for v in nn.get_parameters().values():
+        loss_wd += 0.5*F.sum(F.pow_scalar(v, 2.0))
+
+    loss = F.mean(F.categorical_cross_entropy(
+        H_batch, labels_batch)) + 5e-4*loss_wd
+
+    print('Begin training loop...')
+    rng = np.random.RandomState(args.seed)
+    labels_all = np.expand_dims(labels, axis=1)
+    best_score = 0.
+    for epoch in range(args.epochs):
+        perm = rng.permutation(train_mask)
+        # wrap around so that every mini-batch has the same size
+        n_batch = -(-len(perm) // batch_size)
+        perm = np.resize(perm, n_batch * batch_size)
+
+        loss_sum, acc_sum = 0., 0.
+        for i in range(n_batch):
+            targets = perm[i * batch_size:(i + 1) * batch_size]
+            nodes = sampler.sample(targets)
+            X_batch.d = feature_matrix[nodes[0]]
+            labels_batch.d = labels_all[targets]
+
+            solver.zero_grad()
+            loss.forward(clear_no_need_grad=True)
+            loss.backward(clear_buffer=True)
+            solver.update()
+
+            loss_sum += loss.d
+            acc_sum += get_accuracy(H_batch.d, labels_batch.d,
+                                    np.arange(batch_size))
+
+        H_valid.forward(clear_buffer=True)
+        acc_val = get_accuracy(H_valid.d, labels_all, valid_mask)
+
+        if acc_val > best_score:
+            best_score = acc_val
+
+        print("epoch: {} loss: {:.3f} acc: {:.3f} acc_val: {:.3f}".format(
+            epoch, loss_sum / n_batch, acc_sum / n_batch, acc_val))
+
+    acc_test = get_accuracy(H_valid.d, labels_all, test_mask)
+    print('Training finished.')
+    print('Best validation acc: {:.3f}'.format(best_score))
+    print('Test acc: {:.3f}'.format(acc_test))
@@ -14,6 +14,7 @@
 
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
 import pandas as pd
 import os
 import tarfile
@@ -74,6 +75,43 @@ def load_cora(shuffle=True):
     return G, feature_matrix, labels
 
 
+def synthetic_graph(num_nodes, avg_degree=10, num_features=64, num_classes=7,
+                    homophily=0.8, seed=0):
+    """
+    Generate a random graph whose node labels correlate with the graph
+    structure and the features.
+    Return sparse adjacency matrix and feature matrix and numerical labels.
+    """
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(num_classes, size=num_nodes)
+
+    # an edge connects nodes of the same class with probability `homophily`
+    num_edges = num_nodes * avg_degree // 2
+    src = rng.randint(num_nodes, size=num_edges)
+    order = np.argsort(labels, kind='stable')
+    class_offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(labels, minlength=num_classes))])
+    class_size = np.diff(class_offsets)[labels[src]]
+    same_class = order[class_offsets[labels[src]] +
+                       (rng.random_sample(num_edges) * class_size).astype(np.int64)]
+    dst = np.where(rng.random_sample(num_edges) < homophily,
+                   same_class, rng.randint(num_nodes, size=num_edges))
+
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    A = sp.coo_matrix((np.ones(2 * len(src), dtype=np.float32),
+                       (np.hstack([src, dst]), np.hstack([dst, src]))),
+                      shape=(num_nodes, num_nodes)).tocsr()
+    A.data[:] = 1.0  # remove multi-edges
+
+    centers = rng.randn(num_classes, num_features).astype(np.float32)
+    feature_matrix = centers[labels] + \
+        2.0 * rng.randn(num_nodes, num_features).astype(np.float32)
+    feature_matrix = row_normalization(feature_matrix)
+
+    return A, feature_matrix, labels
+
+
 def row_normalization(matrix):
     '''
     Normalize feature matrix.
@@ -110,20 +148,124 @@ def get_mask(labels_per_class, num_valid, num_test, num_nodes, num_classes, labe
     return np.array(train_index), valid_index, test_index
 
 
+def normalize_adj_sparse(G, mode='sym'):
+    """
+    Normalize adjacency matrix in CSR format.
+
+    Parameters
+    ----------
+    G: networkx.Graph or scipy.sparse matrix
+      Graph or its adjacency matrix
+    mode: str
+      'sym' for D^(-0.5) * (A + I) * D^(-0.5),
+      'rw' for D^(-1) * (A + I), i.e. mean over the neighbours and self
+
+    Returns
+    -------
+    A_hat: scipy.sparse.csr_matrix
+      Normalized adjacency matrix
+    """
+    if isinstance(G, nx.Graph):
+        A = nx.adjacency_matrix(G)
+    else:
+        A = G
+    A = sp.csr_matrix(A, dtype=np.float32)
+    A_tilda = A + sp.eye(A.shape[0], dtype=np.float32, format='csr')  # A + I
+    degree = np.asarray(A_tilda.sum(axis=1)).ravel()
+
+    if mode == 'sym':
+        D_hat_inv_sqrt = sp.diags(np.power(degree, -0.5))
+        A_hat = D_hat_inv_sqrt @ A_tilda @ D_hat_inv_sqrt
+    elif mode == 'rw':
+        A_hat = sp.diags(1.0 / degree) @ A_tilda
+    else:
+        raise ValueError('Unknown normalization mode: {}'.format(mode))
+
+    return sp.csr_matrix(A_hat, dtype=np.float32)
+
+
 def normalize_adj(G):
     """
     Normalize adjacency matrix.
     """
-    A = nx.adjacency_matrix(G).todense().astype(np.float)
-    A_tilda = A + np.eye(A.shape[0]).astype(np.float)  # A + I
-    degree = np.array(np.sum(A_tilda, axis=0))[0]
-    D_hat_inv_sqrt = np.diag(np.power(degree, -0.5))
-    A_hat = np.matmul(D_hat_inv_sqrt, np.matmul(
-        A_tilda, D_hat_inv_sqrt))  # D^(-0.5) * A * D^(-0.5)
+    A_hat = normalize_adj_sparse(G).toarray()  # D^(-0.5) * A * D^(-0.5)
 
     return A_hat
 
 
+class NeighborSampler(object):
+    """
+    GraphSAGE-style neighbour sampler.
+
+    Neighbours are sampled with replacement so that each node always has
+    `fanout` neighbours. This keeps the shapes of sampled blocks fixed,
+    and one computation graph can be reused for every mini-batch.
+    Nodes without neighbours are padded with themselves.
+    """
+
+    def __init__(self, A, fanouts, seed=None):
+        '''
+        Parameters
+        ----------
+        A: scipy.sparse matrix
+          Adjacency matrix (without self loops)
+        fanouts: list of int
+          Number of sampled neighbours per node, from the input layer
+          to the output layer
+        seed: int
+          Random seed
+        '''
+        A = sp.csr_matrix(A)
+        self.indptr = A.indptr.astype(np.int64)
+        self.indices = A.indices.astype(np.int64)
+        self.degree = np.diff(self.indptr)
+        self.fanouts = list(fanouts)
+        self.rng = np.random.RandomState(seed)
+
+    def sample_neighbors(self, nodes, fanout):
+        '''
+        Sample `fanout` neighbours of each node.
+
+        Returns
+        -------
+        neighbors: numpy.ndarray
+          Array of shape (len(nodes), fanout)
+        '''
+        if len(self.indices) == 0:
+            return np.repeat(nodes[:, None], fanout, axis=1)
+        degree = self.degree[nodes]
+        r = self.rng.random_sample((len(nodes), fanout))
+        offset = (r * degree[:, None]).astype(np.int64)
+        pos = np.minimum(self.indptr[nodes][:, None] + offset,
+                         len(self.indices) - 1)
+        neighbors = self.indices[pos]
+        return np.where(degree[:, None] > 0, neighbors, nodes[:, None])
+
+    def sample(self, targets):
+        '''
+        Sample the computation tree of target nodes.
+
+        Returns
+        -------
+        nodes: list of numpy.ndarray
+          Node ids of each layer from the input layer to the targets.
+          Each node of nodes[l + 1] is followed by its fanouts[l] sampled
+          neighbours in nodes[l].
+        '''
+        nodes = [np.asarray(targets, dtype=np.int64)]
+        for fanout in reversed(self.fanouts):
+            dst = nodes[0]
+            src = np.hstack([dst[:, None], self.sample_neighbors(dst, fanout)])
+            nodes.insert(0, src.ravel())
+        return nodes
+
+    def num_input_nodes(self, batch_size):
+        '''
+        Number of input nodes of a mini-batch of `batch_size` targets.
+        '''
+        return batch_size * int(np.prod([1 + f for f in self.fanouts]))
+
+
 def get_accuracy(predict, label, mask):
     '''
     Calculate accuray.
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+
 
 def check_arch_or_die(arch):
     # See available archs
@@ -106,6 +108,13 @@ def add_dali_args(parser):
                         help="Memory padding value for nvJPEG (in MB)")
 
 
+def add_data_backend_args(parser):
+    parser.add_argument('--data-backend', type=str, default='dali', choices=['dali', 'cpu'],
+                        help="Data pipeline. 'cpu' decodes and augments images with a pool of worker processes, which does not require DALI or GPUs.")
+    parser.add_argument('--num-workers', type=int, default=os.cpu_count(),
+                        help="Number of worker processes of the 'cpu' data pipeline.")
+
+
 def post_process_spatial_size(args):
     if isinstance(args.spatial_size, int):
         args.spatial_size = (args.spatial_size, args.spatial_size)
@@ -140,6 +149,7 @@ def get_train_args():
     add_training_args(parser)
     add_dataset_args(parser)
     add_dali_args(parser)
+    add_data_backend_args(parser)
 
     args = parser.parse_args()
 
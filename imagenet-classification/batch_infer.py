@@ -0,0 +1,284 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Batch inference of one or more architectures over a directory or a list
+of images, writing top-k predictions to a CSV or JSONL file.
+'''
+
+import csv
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import nnabla as nn
+import nnabla.functions as F
+from nnabla import logger
+
+import numpy as np
+
+from infer import (
+    crop_center_image,
+    load_parameters_and_config,
+    normalize_uint8_image,
+    read_labels,
+)
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(path, image_root=None):
+    '''
+    List images in a directory recursively, or read image paths from the
+    first column of a file list (e.g. `val_label`).
+    '''
+    if os.path.isdir(path):
+        paths = []
+        for root, _, files in os.walk(path):
+            paths += [os.path.join(root, f) for f in files
+                      if f.lower().endswith(IMAGE_EXTENSIONS)]
+        return sorted(paths)
+    with open(path, 'r') as f:
+        paths = [line.split()[0] for line in f if line.strip()]
+    if image_root is not None:
+        paths = [os.path.join(image_root, p) for p in paths]
+    return paths
+
+
+def read_and_crop_image(path, spatial_size):
+    '''
+    Read an image resized by the imagenet ratio and center-cropped,
+    as a uint8 array of (h, w, 3).
+    '''
+    from nnabla.utils.image_utils import imread
+    import args as A
+    H = A.resize_by_ratio(spatial_size[0])
+    W = A.resize_by_ratio(spatial_size[1])
+    image = imread(path, num_channels=3, size=(W, H))
+    return crop_center_image(image, spatial_size)
+
+
+def iterate_batches(paths, batch_size, spatial_size, executor, prefetch=2):
+    '''
+    Yield (paths, uint8 images of (n, h, w, 3)) of batches, while the
+    images of the following `prefetch` batches are decoded by the executor.
+    '''
+    batches = [paths[i:i + batch_size]
+               for i in range(0, len(paths), batch_size)]
+    pending = deque()
+    for i, batch in enumerate(batches):
+        while len(pending) <= prefetch and i + len(pending) < len(batches):
+            batch_paths = batches[i + len(pending)]
+            pending.append([executor.submit(read_and_crop_image, p, spatial_size)
+                            for p in batch_paths])
+        futures = pending.popleft()
+        yield batch, np.stack([f.result() for f in futures])
+
+
+class Classifier(object):
+    '''
+    A network of an architecture built once with a fixed batch size.
+
+    Parameters are loaded under a parameter scope named by `name`, so that
+    several models can coexist in a process.
+    '''
+
+    def __init__(self, name, arch, weights, batch_size, num_classes,
+                 spatial_size, type_config, norm_config, channel_last=None):
+        from models import build_network
+        self.name = name
+        self.norm_config = norm_config
+        with nn.parameter_scope(name):
+            self.channel_last, self.channels = load_parameters_and_config(
+                weights, type_config)
+            if channel_last is not None and channel_last != self.channel_last:
+                raise ValueError(
+                    f'{weights} is a model with {"NHWC" if self.channel_last else "NCHW"} layout, '
+                    f'but channel_last={channel_last} is specified.')
+            if self.channel_last:
+                shape = (batch_size, ) + tuple(spatial_size) + \
+                    (self.channels, )
+            else:
+                shape = (batch_size, self.channels) + tuple(spatial_size)
+            self.image = nn.Variable(shape)
+            pred, _ = build_network(self.image, num_classes, arch,
+                                    test=True, channel_last=self.channel_last)
+        self.prob = F.softmax(pred)
+        self.prob.persistent = True
+        self.batch_size = batch_size
+
+    def preprocess(self, images):
+        '''
+        Convert uint8 images of (n, h, w, 3) into a padded network input.
+        '''
+        n = len(images)
+        x = normalize_uint8_image(images.astype(np.float32), self.norm_config)
+        if self.channels == 4:
+            x = np.pad(x, ((0, 0), (0, 0), (0, 0), (0, 1)),
+                       mode='constant', constant_values=0)
+        if not self.channel_last:
+            x = np.transpose(x, (0, 3, 1, 2))
+        if n < self.batch_size:
+            x = np.concatenate(
+                [x, np.zeros((self.batch_size - n, ) + x.shape[1:], dtype=x.dtype)])
+        return x
+
+    def predict(self, images):
+        '''
+        Returns class probabilities of (n, num_classes).
+        '''
+        self.image.d = self.preprocess(images)
+        self.prob.forward(clear_buffer=True)
+        return self.prob.d[:len(images)].copy()
+
+
+def topk(prob, k):
+    index = np.argpartition(-prob, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(prob, index, axis=1), axis=1)
+    index = np.take_along_axis(index, order, axis=1)
+    return index, np.take_along_axis(prob, index, axis=1)
+
+
+class ResultWriter(object):
+    '''
+    Write top-k predictions in CSV or JSONL, chosen by the file extension.
+    '''
+
+    def __init__(self, path, labels, k):
+        self.labels = labels
+        self.jsonl = path.endswith('.jsonl') or path.endswith('.json')
+        self.f = open(path, 'w', newline='')
+        if not self.jsonl:
+            self.writer = csv.writer(self.f)
+            header = ['path', 'model']
+            for i in range(1, k + 1):
+                header += [f'class_{i}', f'label_{i}', f'prob_{i}']
+            self.writer.writerow(header)
+
+    def write(self, paths, model, index, prob):
+        for path, idx, p in zip(paths, index, prob):
+            if self.jsonl:
+                topk = [dict(index=int(i), label=self.labels[i], prob=float(q))
+                        for i, q in zip(idx, p)]
+                self.f.write(json.dumps(
+                    dict(path=path, model=model, topk=topk)) + '\n')
+                continue
+            row = [path, model]
+            for i, q in zip(idx, p):
+                row += [int(i), self.labels[i], f'{q:.6f}']
+            self.writer.writerow(row)
+
+    def close(self):
+        self.f.close()
+
+
+def parse_model(value):
+    '''
+    Parse a model specification of "{arch}:{weights}".
+    '''
+    arch, weights = value.split(':', 1)
+    return arch.lower(), weights
+
+
+def get_args():
+    import argparse
+    import args as A
+    parser = argparse.ArgumentParser(
+        description='Batch inference of one or more models.')
+    A.add_runtime_args(parser)
+    parser.add_argument('--model', '-a', type=parse_model, action='append', required=True,
+                        help='Architecture and parameter file as "{arch}:{h5 file}". Specify multiple times to evaluate several models on the same inputs.')
+    parser.add_argument('--num-classes', type=int, default=1000,
+                        help='Number of categories of classification.')
+    parser.add_argument("input",
+                        help='A directory of images, or a file list whose first column is an image path.')
+    parser.add_argument('--image-root', default=None,
+                        help='Root directory of relative paths in a file list.')
+    parser.add_argument('--output', '-o', default='predictions.csv',
+                        help='Output file. The format is JSONL if it ends with `.jsonl`, otherwise CSV.')
+    parser.add_argument('--batch-size', '-b', type=int, default=64)
+    parser.add_argument('--top-k', '-k', type=int, default=5)
+    parser.add_argument('--num-workers', type=int, default=8,
+                        help='Number of threads decoding images.')
+    parser.add_argument(
+        '--labels', help='Path to a label name file which contain label names as csv compatible with `label_words.csv`.', default='./label_words.csv')
+    parser.add_argument(
+        '--norm-config', '-n', type=A.lower_str, default='default',
+        help='Specify how to normalize an image as preprocessing.')
+    parser.add_argument("--channel-last", action='store_true',
+                        help='Use models with NHWC layout. The layout is deduced from the parameters, and an error is raised if a model is NCHW.')
+    parser.add_argument("--spatial-size", type=int, default=224, nargs="+",
+                        help='Spatial size.')
+    args = parser.parse_args()
+
+    # Post process
+    A.post_process_spatial_size(args)
+
+    # See available archs
+    for arch, _ in args.model:
+        A.check_arch_or_die(arch)
+    return args
+
+
+def main():
+    args = get_args()
+
+    # Setup
+    from nnabla.ext_utils import get_extension_context
+    if args.context is None:
+        extension_module = "cudnn"
+    else:
+        extension_module = args.context
+    ctx = get_extension_context(
+        extension_module, device_id=args.device_id, type_config=args.type_config)
+    nn.set_default_context(ctx)
+
+    # Build every model once
+    models = []
+    for i, (arch, weights) in enumerate(args.model):
+        name = f'{arch}_{i}'
+        models.append(Classifier(name, arch, weights, args.batch_size,
+                                 args.num_classes, args.spatial_size,
+                                 args.type_config, args.norm_config,
+                                 channel_last=True if args.channel_last else None))
+        logger.info(
+            f'{name}: channel_last={models[-1].channel_last}, channels={models[-1].channels}')
+
+    paths = list_images(args.input, args.image_root)
+    labels = read_labels(args.labels)
+    writer = ResultWriter(args.output, labels, args.top_k)
+    logger.info(f'{len(paths)} images')
+
+    start = time.time()
+    num_done = 0
+    with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+        for batch_paths, images in iterate_batches(
+                paths, args.batch_size, args.spatial_size, executor):
+            # All models share the decoded images
+            for model in models:
+                index, prob = topk(model.predict(images), args.top_k)
+                writer.write(batch_paths, model.name, index, prob)
+            num_done += len(batch_paths)
+            logger.info(f'{num_done} / {len(paths)} images')
+    writer.close()
+    elapsed = time.time() - start
+    logger.info(
+        f'{num_done / elapsed:.1f} images/s ({len(models)} models, {elapsed:.1f} s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Measures the throughput (images/s) of the CPU data pipeline in `data_cpu.py`
+for several numbers of worker processes.
+'''
+
+import os
+import time
+
+from data_cpu import CpuDataIterator
+from normalize_config import get_normalize_config
+
+
+def get_args():
+    import argparse
+    import args as A
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the CPU data pipeline.')
+    A.add_train_dataset_args(parser)
+    A.add_val_dataset_args(parser)
+    parser.add_argument('--batch-size', '-b', type=int, default=128)
+    parser.add_argument('--num-workers', type=int, nargs='+',
+                        default=[1, os.cpu_count()],
+                        help='Numbers of worker processes to be measured.')
+    parser.add_argument('--num-batches', type=int, default=20,
+                        help='Number of timed batches.')
+    parser.add_argument("--spatial-size", type=int, default=224, nargs="+",
+                        help='Spatial size.')
+    parser.add_argument("--channel-last", action='store_true')
+    parser.add_argument("--type-config", "-t", type=str, default='float')
+    parser.add_argument('--mode', choices=['train', 'val'], nargs='+',
+                        default=['train', 'val'])
+    args = parser.parse_args()
+    A.post_process_spatial_size(args)
+    return args
+
+
+def benchmark(args, train, num_workers):
+    mean, std = get_normalize_config('default')
+    data = CpuDataIterator(args.batch_size, num_workers, 0,
+                           args.train_dir if train else args.val_dir,
+                           args.train_list if train else args.val_list,
+                           train=train,
+                           channel_last=args.channel_last,
+                           spatial_size=args.spatial_size,
+                           dtype=args.type_config,
+                           mean=mean, std=std)
+    data.next_batch()  # warm-up
+    start = time.time()
+    for _ in range(args.num_batches):
+        data.next_batch()
+    elapsed = time.time() - start
+    data.close()
+    return args.num_batches * args.batch_size / elapsed
+
+
+def main():
+    args = get_args()
+    for mode in args.mode:
+        for num_workers in args.num_workers:
+            ips = benchmark(args, mode == 'train', num_workers)
+            print('{:5s} workers={:3d}: {:8.1f} images/s'.format(
+                mode, num_workers, ips))
+
+
+if __name__ == '__main__':
+    main()
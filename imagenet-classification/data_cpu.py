@@ -0,0 +1,287 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+CPU data pipeline with the same interface as the DALI iterators in `data.py`.
+
+JPEG decoding, random-resized-crop / flip (training) or resize / center crop
+(validation), and normalization run in a pool of worker processes which write
+images directly into batch buffers in shared memory.
+'''
+
+import ctypes
+import math
+import multiprocessing as mp
+import os
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from normalize_config import get_normalize_config
+
+
+def int_div_ceil(a, b):
+    '''
+    returns int(ceil(a / b))
+    '''
+    return (a + b - 1) // b
+
+
+def get_pad_output_by_channels(channels):
+    if channels == 4:
+        return True
+    elif channels == 3:
+        return False
+    raise ValueError(f'channels must be 3 or 4. Given {channels}')
+
+
+def read_file_list(file_list):
+    '''
+    Read a file list of the DALI FileReader format, i.e. lines of
+    "{relative path} {label}".
+    '''
+    paths, labels = [], []
+    with open(file_list, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            path, label = line.rsplit(maxsplit=1)
+            paths.append(path)
+            labels.append(int(label))
+    return paths, np.asarray(labels, dtype=np.int32)
+
+
+def random_resized_crop_box(width, height, rng, scale=(0.08, 1.0), ratio=(3. / 4, 4. / 3)):
+    '''
+    Crop box (left, upper, right, lower) of the random resized crop.
+    Falls back to a center crop after 10 failed trials.
+    '''
+    area = width * height
+    log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+    for _ in range(10):
+        target_area = area * rng.uniform(*scale)
+        aspect = math.exp(rng.uniform(*log_ratio))
+        w = int(round(math.sqrt(target_area * aspect)))
+        h = int(round(math.sqrt(target_area / aspect)))
+        if 0 < w <= width and 0 < h <= height:
+            x = rng.randint(0, width - w + 1)
+            y = rng.randint(0, height - h + 1)
+            return (x, y, x + w, y + h)
+    in_ratio = width / height
+    if in_ratio < ratio[0]:
+        w, h = width, int(round(width / ratio[0]))
+    elif in_ratio > ratio[1]:
+        w, h = int(round(height * ratio[1])), height
+    else:
+        w, h = width, height
+    x, y = (width - w) // 2, (height - h) // 2
+    return (x, y, x + w, y + h)
+
+
+def load_train_image(path, spatial_size, seed):
+    rng = np.random.RandomState(seed)
+    image = Image.open(path)
+    image = image.convert('RGB')
+    box = random_resized_crop_box(image.width, image.height, rng)
+    image = image.resize(
+        (spatial_size[1], spatial_size[0]), Image.BILINEAR, box=box)
+    image = np.asarray(image)
+    if rng.rand() < 0.5:
+        image = image[:, ::-1]
+    return image
+
+
+def load_val_image(path, spatial_size):
+    import args as A
+    resize_shorter = A.resize_by_ratio(spatial_size[0])
+    image = Image.open(path)
+    # Let the JPEG decoder downscale by a power of two while the shorter
+    # side stays larger than the target size
+    image.draft('RGB', (resize_shorter, resize_shorter))
+    image = image.convert('RGB')
+    scale = resize_shorter / min(image.width, image.height)
+    width = max(int(round(image.width * scale)), spatial_size[1])
+    height = max(int(round(image.height * scale)), spatial_size[0])
+    image = image.resize((width, height), Image.BILINEAR)
+    x = (width - spatial_size[1]) // 2
+    y = (height - spatial_size[0]) // 2
+    return np.asarray(image)[y:y + spatial_size[0], x:x + spatial_size[1]]
+
+
+# Shared state of worker processes set by `_init_worker`
+_worker = {}
+
+
+def _init_worker(buffer, shape, dtype, train, spatial_size, mean, std):
+    _worker.update(buffer=np.frombuffer(buffer, dtype=dtype).reshape(shape),
+                   train=train, spatial_size=spatial_size, mean=mean, std=std)
+
+
+def _load_into(task):
+    slot, index, path, seed, channel_last = task
+    w = _worker
+    if w['train']:
+        image = load_train_image(path, w['spatial_size'], seed)
+    else:
+        image = load_val_image(path, w['spatial_size'])
+    image = (image.astype(np.float32) - w['mean']) / w['std']
+    out = w['buffer'][slot, index]
+    if not channel_last:
+        image = image.transpose(2, 0, 1)
+        out[:3] = image
+        out[3:] = 0
+    else:
+        out[..., :3] = image
+        out[..., 3:] = 0
+
+
+class CpuDataIterator(object):
+    '''
+    Data iterator running a pipeline on a pool of worker processes.
+
+    The file list is partitioned into contiguous shards by the comm rank as
+    the DALI FileReader does. Batches are processed in `prefetch` slots of a
+    shared memory buffer, so that the following batches are decoded while
+    the current one is consumed. `next()` returns a pair of an image and a
+    label NdArray, and `size` is the number of examples of the shard.
+    '''
+
+    def __init__(self, batch_size, num_workers, shard_id, image_dir, file_list,
+                 train=True, seed=1, num_shards=1, channel_last=True,
+                 spatial_size=(224, 224), dtype='half', mean=None, std=None,
+                 pad_output=True, prefetch=3):
+        self.pool = None
+        paths, labels = read_file_list(file_list)
+        start = len(paths) * shard_id // num_shards
+        end = len(paths) * (shard_id + 1) // num_shards
+        self.paths = [os.path.join(image_dir, p) for p in paths[start:end]]
+        self.labels = labels[start:end]
+        # the same number of examples per shard as the DALI iterators
+        self.size = int_div_ceil(len(paths), num_shards)
+        self.batch_size = batch_size
+        self.train = train
+        self.channel_last = channel_last
+        self.rng = np.random.RandomState(seed)
+
+        channels = 4 if pad_output else 3
+        spatial_size = tuple(spatial_size)
+        if channel_last:
+            image_shape = spatial_size + (channels, )
+        else:
+            image_shape = (channels, ) + spatial_size
+        self.dtype = np.float16 if dtype == 'half' else np.float32
+        shape = (prefetch, batch_size) + image_shape
+        ctype = ctypes.c_uint16 if self.dtype == np.float16 else ctypes.c_float
+        buffer = mp.RawArray(ctype, int(np.prod(shape)))
+        self.buffer = np.frombuffer(buffer, dtype=self.dtype).reshape(shape)
+        self.slot_labels = np.zeros((prefetch, batch_size, 1), dtype=np.int32)
+
+        mean = np.asarray(mean, dtype=np.float32)
+        std = np.asarray(std if std is not None else [1., 1., 1.],
+                         dtype=np.float32)
+        self.pool = mp.Pool(num_workers, initializer=_init_worker,
+                            initargs=(buffer, shape, self.dtype, train,
+                                      spatial_size, mean, std))
+        self.chunksize = max(batch_size // (num_workers * 4), 1)
+
+        self.indices = self._index_stream()
+        self.pending = deque()
+        for slot in range(prefetch):
+            self._submit(slot)
+
+    def _index_stream(self):
+        while True:
+            if self.train:
+                order = self.rng.permutation(len(self.paths))
+            else:
+                order = np.arange(len(self.paths))
+            for i in order:
+                yield i
+
+    def _submit(self, slot):
+        indices = [next(self.indices) for _ in range(self.batch_size)]
+        seeds = self.rng.randint(2 ** 31, size=self.batch_size)
+        tasks = [(slot, j, self.paths[i], seeds[j], self.channel_last)
+                 for j, i in enumerate(indices)]
+        self.slot_labels[slot, :, 0] = self.labels[indices]
+        result = self.pool.map_async(_load_into, tasks, self.chunksize)
+        self.pending.append((slot, result))
+
+    def next_batch(self):
+        '''
+        Returns the next batch as numpy arrays of images and labels.
+        '''
+        slot, result = self.pending.popleft()
+        result.get()
+        image = self.buffer[slot].copy()
+        label = self.slot_labels[slot].copy()
+        self._submit(slot)
+        return image, label
+
+    def next(self):
+        import nnabla as nn
+        image, label = self.next_batch()
+        return nn.NdArray.from_numpy_array(image), nn.NdArray.from_numpy_array(label)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def __del__(self):
+        self.close()
+
+
+def _create_iterator(args, comm, channels, spatial_size, norm_config, train):
+    mean, std = get_normalize_config(norm_config)
+    pad_output = get_pad_output_by_channels(channels)
+    return CpuDataIterator(args.batch_size, args.num_workers, comm.rank,
+                           args.train_dir if train else args.val_dir,
+                           args.train_list if train else args.val_list,
+                           train=train,
+                           seed=comm.rank + 1,
+                           num_shards=comm.n_procs,
+                           channel_last=args.channel_last,
+                           spatial_size=spatial_size,
+                           dtype=args.type_config,
+                           mean=mean, std=std,
+                           pad_output=pad_output)
+
+
+def get_train_data_iterator(args, comm, channels, spatial_size=(224, 224), norm_config='default'):
+    return _create_iterator(args, comm, channels,
+                            spatial_size, norm_config, True)
+
+
+def get_val_data_iterator(args, comm, channels, spatial_size=(224, 224), norm_config='default'):
+    return _create_iterator(args, comm, channels,
+                            spatial_size, norm_config, False)
+
+
+def get_data_iterators(args, comm, channels, spatial_size=(224, 224), norm_config='default'):
+    '''
+    Creates and returns CPU data iterators for both datasets of training and
+    validation.
+
+    The datasets are partitioned in distributed training
+    mode according to comm rank and number of processes.
+    '''
+    data = get_train_data_iterator(
+        args, comm, channels, spatial_size, norm_config)
+    vdata = get_val_data_iterator(
+        args, comm, channels, spatial_size, norm_config)
+    return data, vdata
@@ -34,13 +34,10 @@ from utils import (
     EpochTrainer,
     EpochValidator,
     EpochReporter,
+    create_stream_event_handler,
     save_args
 )
 
-from data import (
-    get_data_iterators,
-)
-
 
 def create_mixup_or_none(alpha, num_classes, comm):
     from utils.mixup import MixUp
@@ -122,7 +119,7 @@ def train():
 
     # Communicator and Context
     from nnabla.ext_utils import get_extension_context
-    extension_module = "cudnn"  # TODO: Hard coded!!!
+    extension_module = args.context or "cudnn"
     ctx = get_extension_context(
         extension_module, device_id=args.device_id, type_config=args.type_config)
     comm = CommunicatorWrapper(ctx)
@@ -130,10 +127,13 @@ def train():
     # To utilize TensorCore in FP16
     channels = 4 if args.type_config == 'half' else 3
 
-    from nnabla_ext.cuda import StreamEventHandler
-    stream_event_handler = StreamEventHandler(int(comm.ctx.device_id))
+    stream_event_handler = create_stream_event_handler(comm)
 
     # Create data iterater
+    if args.data_backend == 'cpu':
+        from data_cpu import get_data_iterators
+    else:
+        from data import get_data_iterators
     data, vdata = get_data_iterators(args, comm, channels, args.spatial_size)
 
     # Create mixup object
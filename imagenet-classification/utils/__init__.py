@@ -80,6 +80,28 @@ class MomentumNoWeightDecayBn(object):
         self.solver_bn.set_learning_rate(lr)
 
 
+class NullStreamEventHandler(object):
+    '''Stream event handler doing nothing, used in place of
+    `nnabla_ext.cuda.StreamEventHandler` on CPU.
+    '''
+
+    def event_synchronize(self):
+        pass
+
+    def default_stream_synchronize(self):
+        pass
+
+    def add_default_stream_event(self):
+        pass
+
+
+def create_stream_event_handler(comm):
+    if comm.ctx.backend[0].startswith('cpu'):
+        return NullStreamEventHandler()
+    from nnabla_ext.cuda import StreamEventHandler
+    return StreamEventHandler(int(comm.ctx.device_id))
+
+
 class EpochReporter(object):
     def __init__(self, name, monitor, comm, loss, error, batch_size, time=True, flush_interval=10):
         self.name = name
@@ -22,8 +22,8 @@ import numpy as np
 from utils import (
     ceil_to_multiple,
     CommunicatorWrapper,
+    create_stream_event_handler,
 )
-from data import get_val_data_iterator
 from infer import load_parameters_and_config
 from train import get_model
 
@@ -37,6 +37,7 @@ def get_args():
     A.add_arch_args(parser)
     A.add_val_dataset_args(parser)
     A.add_dali_args(parser)
+    A.add_data_backend_args(parser)
     parser.add_argument('--batch-size', '-b', default=100,
                         type=int, help='Batch size per GPU.')
     parser.add_argument("--channel-last", action='store_true',
@@ -98,11 +99,14 @@ def main():
                         spatial_size=args.spatial_size,
                         channels=channels)
 
+    if args.data_backend == 'cpu':
+        from data_cpu import get_val_data_iterator
+    else:
+        from data import get_val_data_iterator
     vdata = get_val_data_iterator(
         args, comm, channels, args.spatial_size, args.norm_config)
 
-    from nnabla_ext.cuda import StreamEventHandler
-    stream_event_handler = StreamEventHandler(int(comm.ctx.device_id))
+    stream_event_handler = create_stream_event_handler(comm)
 
     # Monitors
     import nnabla.monitor as M
@@ -15,7 +15,6 @@
 import numpy as np
 import nnabla as nn
 from scipy.special import binom
-import copy
 import itertools
 
 
@@ -25,7 +24,8 @@ class Ridge:
         self.fit_intercept = fit_intercept
 
     def fit(self, X: np.ndarray, y: np.ndarray, weights=None):
-        y = y.reshape(-1, 1)
+        if y.ndim == 1:
+            y = y.reshape(-1, 1)
         if X.shape[0] != y.shape[0]:
             raise Exception(
                 f"Number of X and y rows don't match ({X.shape[0]} != {y.shape[0]})")
@@ -56,213 +56,239 @@ class Ridge:
 
 
 class KernelSHAP:
-    def __init__(self, data, model, X, alpha, nsamples='auto'):
+    def __init__(self, data, model, X, alpha, nsamples='auto', batch_size=1024,
+                 max_rows=2 ** 20, seed=0):
         self.data = data
         self.model = model
         self.X = X
         self.alpha = alpha
         self.nsamples = nsamples
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.rng = np.random.RandomState(seed)
 
     def shap_values(self):
-
-        out = self.model(self.data)
-        out.forward()
-
         self.train_samples = self.data.d.shape[0]
         self.num_features = self.data.d.shape[1]
-        self.num_classes = out.d.shape[1]
+
+        # one graph with a fixed batch size is reused for every evaluation
+        self.x_batch = nn.Variable((self.batch_size, self.num_features))
+        self.out_batch = self.model(self.x_batch)
+        self.num_classes = self.out_batch.shape[1]
 
         self.weights = np.ones(self.train_samples)
         self.weights /= np.sum(self.weights)
-        self.nsamples_run = 0
-        groups = [np.array([i]) for i in range(self.num_features)]
-        self.fnull = np.sum((out.d.T * self.weights).T, 0)
+        out = self.evaluate(self.data.d)
+        self.fnull = np.dot(self.weights, out)
         expected_value = self.fnull
 
-        explanations = []
+        X = self.X.d
+        fx = self.evaluate(X)
+        phi = np.zeros((len(X), self.num_features, self.num_classes))
 
-        for i in range(len(self.X.d)):
-            instance = self.X[i:i + 1, :]
-            explanations.append(self.explain(instance, groups))
-        s = explanations[0].shape
+        # instances sharing the same varying features share coalition masks
+        varying = self.varying_features(X)
+        patterns, inverse = np.unique(varying, axis=0, return_inverse=True)
+        for p, pattern in enumerate(patterns):
+            inds = np.nonzero(inverse.reshape(-1) == p)[0]
+            varying_inds = np.nonzero(pattern)[0]
+            phi[inds] = self.explain(X[inds], fx[inds], varying_inds)
 
-        outs = [np.zeros((self.X.d.shape[0], s[0])) for j in range(s[1])]
-        for i in range(self.X.d.shape[0]):
-            for j in range(s[1]):
-                outs[j][i] = explanations[i][:, j]
-        if len(self.X.d) == 1:
+        outs = [phi[:, :, j] for j in range(self.num_classes)]
+        if len(X) == 1:
             outs = [sp[0] for sp in outs]
         return outs, expected_value
 
-    def explain(self, instance, groups):
-        self.nsamples_added = 0
-        varying_inds = self.varying_groups(instance.d, groups)
-        varying_feature_groups = [groups[i] for i in varying_inds]
-        M = len(varying_feature_groups)
-        varying_feature_groups = np.array(varying_feature_groups)
-        varying_feature_groups = varying_feature_groups.flatten()
-
-        model_out = self.model(instance)
-        model_out.forward()
-        fx = model_out.d[0]
-        fx = np.array(fx)
+    def evaluate(self, x):
+        '''
+        Evaluate the model on rows of x in batches of the fixed batch size.
+        '''
+        out = np.zeros((len(x), self.num_classes))
+        for start in range(0, len(x), self.batch_size):
+            end = min(start + self.batch_size, len(x))
+            self.x_batch.d[:end - start] = x[start:end]
+            self.out_batch.forward(clear_buffer=True)
+            out[start:end] = self.out_batch.d[:end - start]
+        return out
+
+    def varying_features(self, X):
+        '''
+        Whether each feature of each instance differs from any background row.
+        '''
+        mismatch = ~np.isclose(X[:, None, :], self.data.d[None, :, :],
+                               equal_nan=True)
+        return mismatch.any(axis=1)
+
+    def explain(self, X, fx, varying_inds):
+        num_instances = len(X)
+        M = len(varying_inds)
+        phi = np.zeros((num_instances, self.num_features, self.num_classes))
 
         if M == 0:
-            phi = np.zeros((self.num_features, self.num_classes))
+            return phi
 
         elif M == 1:
-            phi = np.zeros((self.num_features, self.num_classes))
-            diff = fx - self.fnull
-            for d in range(self.num_classes):
-                phi[varying_inds[0], d] = diff[d]
-
-        else:
-            if self.nsamples == "auto":
-                self.nsamples = 2 * M + 2**11
-
-            max_samples = 2 ** 30
-            if M <= 30:
-                max_samples = 2 ** M - 2
-                if self.nsamples > max_samples:
-                    self.nsamples = max_samples
-
-            self.synth_data = np.tile(self.data.d, (self.nsamples, 1))
-            self.mask_matrix = np.zeros((self.nsamples, M))
-            self.kernel_weights = np.zeros(self.nsamples)
-            self.y = np.zeros(
-                (self.nsamples * self.train_samples, self.num_classes))
-            self.ey = np.zeros((self.nsamples, self.num_classes))
-
-            num_subset_sizes = np.int(np.ceil((M - 1) / 2.0))
-            num_paired_subset_sizes = np.int(np.floor((M - 1) / 2.0))
-            weight_vector = np.array([(M - 1.0) / (i * (M - i))
-                                     for i in range(1, num_subset_sizes + 1)])
-            weight_vector[:num_paired_subset_sizes] *= 2
-            weight_vector /= np.sum(weight_vector)
-
-            num_full_subsets = 0
-            num_samples_left = self.nsamples
-            group_inds = np.arange(M, dtype='int64')
-            mask = np.zeros(M)
-            remaining_weight_vector = copy.copy(weight_vector)
-
-            for subset_size in range(1, num_subset_sizes + 1):
-                nsubsets = binom(M, subset_size)
-                if subset_size <= num_paired_subset_sizes:
-                    nsubsets *= 2
-
-                if num_samples_left * remaining_weight_vector[subset_size - 1] / nsubsets >= 1.0 - 1e-8:
-                    num_full_subsets += 1
-                    num_samples_left -= nsubsets
-
-                    if remaining_weight_vector[subset_size - 1] < 1.0:
-                        remaining_weight_vector /= (1 -
-                                                    remaining_weight_vector[subset_size - 1])
-
-                    w = weight_vector[subset_size - 1] / binom(M, subset_size)
-                    if subset_size <= num_paired_subset_sizes:
-                        w /= 2.0
-                    for inds in itertools.combinations(group_inds, subset_size):
-                        mask[:] = 0.0
-                        mask[np.array(inds, dtype='int64')] = 1.0
-                        self.addsample(varying_feature_groups,
-                                       instance.d, mask, w)
-                        if subset_size <= num_paired_subset_sizes:
-                            mask[:] = np.abs(mask - 1)
-                            self.addsample(varying_feature_groups,
-                                           instance.d, mask, w)
-                else:
-                    break
-
-            self.run()
-
-            phi = np.zeros((self.num_features, self.num_classes))
-            for d in range(self.num_classes):
-                vphi = self.solve(d, M, fx)
-                phi[varying_inds, d] = vphi
+            phi[:, varying_inds[0], :] = fx - self.fnull
+            return phi
 
-        return phi
+        mask_matrix, kernel_weights = self.coalitions(M)
+        ey = self.expectations(X, mask_matrix, varying_inds)
 
-    def varying_groups(self, x, groups):
-        varying = np.zeros(self.num_features)
-        for i in range(0, self.num_features):
-            inds = groups[i]
-            x_group = x[0, inds]
-            num_mismatches = np.sum(np.frompyfunc(
-                self.not_equal, 2, 1)(x_group, self.data.d[:, inds]))
-            varying[i] = num_mismatches > 0
-        varying_indices = np.nonzero(varying)[0]
-        return varying_indices
-
-    def not_equal(self, i, j):
-        if isinstance(i, str) or isinstance(j, str):
-            return 0 if i == j else 1
-        return 0 if np.isclose(i, j, equal_nan=True) else 1
-
-    def addsample(self, varying_feature_groups, x, m, w):
-        offset = self.nsamples_added * self.train_samples
-
-        mask = m == 1.0
-        groups = varying_feature_groups[mask]
-        if len(groups.shape) == 2:
-            for group in groups:
-                self.synth_data[offset:offset +
-                                self.train_samples, group] = x[0, group]
-        else:
-            evaluation_data = x[0, groups]
-            self.synth_data[offset:offset +
-                            self.train_samples, groups] = evaluation_data
-        self.mask_matrix[self.nsamples_added, :] = m
-        self.kernel_weights[self.nsamples_added] = w
-        self.nsamples_added += 1
-
-    def run(self):
-        num_to_run = self.nsamples_added * self.train_samples - \
-            self.nsamples_run * self.train_samples
-        data_run = self.synth_data[self.nsamples_run *
-                                   self.train_samples:self.nsamples_added*self.train_samples, :]
-
-        data_run_nn = nn.Variable(data_run.shape)
-        data_run_nn.d = data_run
-        modelout = self.model(data_run_nn)
-        modelout.forward()
-        modelout = modelout.d
-        self.y[self.nsamples_run * self.train_samples:self.nsamples_added *
-               self.train_samples, :] = np.reshape(modelout, (num_to_run, self.num_classes))
-
-        for i in range(self.nsamples_run, self.nsamples_added):
-            ey_val = np.zeros(self.num_classes)
-            for j in range(0, self.train_samples):
-                ey_val += self.y[i * self.train_samples +
-                                 j, :] * self.weights[j]
-            self.ey[i, :] = ey_val
-
-    def solve(self, dim, M, fx):
-        ey_adj = self.ey[:, dim] - self.fnull[dim]
-        nonzero_inds = np.arange(M)
-
-        if len(nonzero_inds) == 0:
-            return np.zeros(M)
-
-        ey_adj2 = ey_adj - self.mask_matrix[:, nonzero_inds[-1]] * (
-                    fx[dim] - self.fnull[dim])
-        etmp = np.transpose(np.transpose(
-            self.mask_matrix[:, nonzero_inds[:-1]]) - self.mask_matrix[:, nonzero_inds[-1]])
+        # constrained weighted least squares for all instances and classes
+        fx_adj = fx - self.fnull                                # (I, C)
+        ey_adj = ey - self.fnull                                # (I, S, C)
+        ey_adj2 = ey_adj - mask_matrix[None, :, -1, None] * fx_adj[:, None, :]
+        etmp = mask_matrix[:, :-1] - mask_matrix[:, -1:]
 
+        num_samples = len(mask_matrix)
+        y = np.transpose(ey_adj2, (1, 0, 2)).reshape(num_samples, -1)
         model = Ridge(alpha=self.alpha, fit_intercept=False)
-        model.fit(etmp, ey_adj2, self.kernel_weights)
-        w = model.w.reshape(-1)
-
-        phi = np.zeros(M)
-        phi[nonzero_inds[:-1]] = w
-        phi[nonzero_inds[-1]] = (fx[dim] - self.fnull[dim]) - sum(w)
-
-        for i in range(M):
-            if np.abs(phi[i]) < 1e-10:
-                phi[i] = 0
-
+        model.fit(etmp, y, kernel_weights)
+        w = model.w.reshape(M - 1, num_instances, self.num_classes)
+        w = np.transpose(w, (1, 0, 2))                          # (I, M-1, C)
+
+        vphi = np.concatenate(
+            [w, (fx_adj - w.sum(axis=1))[:, None, :]], axis=1)
+        vphi[np.abs(vphi) < 1e-10] = 0
+        phi[:, varying_inds, :] = vphi
         return phi
 
+    def expectations(self, X, mask_matrix, varying_inds):
+        '''
+        Expected model outputs over the background data for every
+        coalition and instance.
+
+        Returns
+        -------
+        ey: numpy.ndarray
+          Array of shape (num_instances, num_samples, num_classes)
+        '''
+        num_samples = len(mask_matrix)
+        masks = np.zeros((num_samples, self.num_features), dtype=bool)
+        masks[:, varying_inds] = mask_matrix == 1.0
+        ey = np.zeros((len(X), num_samples, self.num_classes))
+
+        rows_per_instance = num_samples * self.train_samples
+        chunk = max(1, self.max_rows // rows_per_instance)
+        for start in range(0, len(X), chunk):
+            x = X[start:start + chunk]
+            # (instances, coalitions, background, features)
+            synth_data = np.where(masks[None, :, None, :],
+                                  x[:, None, None, :],
+                                  self.data.d[None, None, :, :])
+            y = self.evaluate(synth_data.reshape(-1, self.num_features))
+            y = y.reshape(len(x), num_samples,
+                          self.train_samples, self.num_classes)
+            ey[start:start + chunk] = np.einsum('isbc,b->isc', y, self.weights)
+        return ey
+
+    def coalitions(self, M):
+        '''
+        Coalition masks and their kernel weights.
+
+        Subset sizes whose all subsets fit in the sample budget are
+        enumerated, and the remaining budget is filled by random sampling.
+        '''
+        nsamples = self.nsamples
+        if nsamples == "auto":
+            nsamples = 2 * M + 2**11
+
+        max_samples = 2 ** 30
+        if M <= 30:
+            max_samples = 2 ** M - 2
+            if nsamples > max_samples:
+                nsamples = max_samples
+
+        num_subset_sizes = int(np.ceil((M - 1) / 2.0))
+        num_paired_subset_sizes = int(np.floor((M - 1) / 2.0))
+        weight_vector = np.array([(M - 1.0) / (i * (M - i))
+                                  for i in range(1, num_subset_sizes + 1)])
+        weight_vector[:num_paired_subset_sizes] *= 2
+        weight_vector /= np.sum(weight_vector)
+
+        masks, weights = [], []
+        num_full_subsets = 0
+        num_samples_left = nsamples
+        remaining_weight_vector = weight_vector.copy()
+
+        for subset_size in range(1, num_subset_sizes + 1):
+            nsubsets = binom(M, subset_size)
+            paired = subset_size <= num_paired_subset_sizes
+            if paired:
+                nsubsets *= 2
+
+            if num_samples_left * remaining_weight_vector[subset_size - 1] / nsubsets < 1.0 - 1e-8:
+                break
+            num_full_subsets += 1
+            num_samples_left -= nsubsets
+
+            if remaining_weight_vector[subset_size - 1] < 1.0:
+                remaining_weight_vector /= (1 -
+                                            remaining_weight_vector[subset_size - 1])
+
+            w = weight_vector[subset_size - 1] / binom(M, subset_size)
+            if paired:
+                w /= 2.0
+            inds = np.array(list(itertools.combinations(range(M), subset_size)))
+            mask = np.zeros((len(inds), M))
+            np.put_along_axis(mask, inds, 1.0, axis=1)
+            if paired:
+                # interleave each subset with its complement
+                mask = np.stack([mask, 1 - mask], axis=1).reshape(-1, M)
+            masks.append(mask)
+            weights.append(np.full(len(mask), w))
+
+        num_full_samples = sum(len(m) for m in masks)
+        num_samples_left = int(nsamples - num_full_samples)
+        if num_full_subsets != num_subset_sizes and num_samples_left > 0:
+            mask, weight = self.random_coalitions(
+                M, num_samples_left, weight_vector, num_full_subsets,
+                num_paired_subset_sizes)
+            masks.append(mask)
+            weights.append(weight)
+
+        return np.concatenate(masks), np.concatenate(weights)
+
+    def random_coalitions(self, M, num_samples_left, weight_vector,
+                          num_full_subsets, num_paired_subset_sizes):
+        remaining_weight_vector = weight_vector.copy()
+        remaining_weight_vector[:num_paired_subset_sizes] /= 2
+        remaining_weight_vector = remaining_weight_vector[num_full_subsets:]
+        remaining_weight_vector /= np.sum(remaining_weight_vector)
+
+        # draw candidate subsets at once, then drop duplicates
+        num_draws = 4 * num_samples_left
+        subset_sizes = self.rng.choice(len(remaining_weight_vector), num_draws,
+                                       p=remaining_weight_vector) + num_full_subsets + 1
+        order = np.argsort(self.rng.random_sample((num_draws, M)), axis=1)
+        candidates = (np.argsort(order, axis=1) <
+                      subset_sizes[:, None]).astype(np.float64)
+
+        masks, counts, used = [], [], {}
+        for mask, subset_size in zip(candidates, subset_sizes):
+            if num_samples_left <= 0:
+                break
+            paired = subset_size <= num_paired_subset_sizes
+            key = mask.tobytes()
+            if key in used:
+                counts[used[key]] += 1.0
+                if paired and used[key] + 1 < len(counts):
+                    counts[used[key] + 1] += 1.0
+                continue
+            used[key] = len(masks)
+            masks.append(mask)
+            counts.append(1.0)
+            num_samples_left -= 1
+            if paired and num_samples_left > 0:
+                masks.append(1 - mask)
+                counts.append(1.0)
+                num_samples_left -= 1
+
+        counts = np.array(counts)
+        weight_left = np.sum(weight_vector[num_full_subsets:])
+        counts *= weight_left / np.sum(counts)
+        return np.array(masks), counts
+
     def calculate_shap(self):
         if len(self.X.d.shape) == 1:
             self.X = self.X.reshape((1, len(self.X.d)))
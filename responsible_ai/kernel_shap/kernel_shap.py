@@ -65,7 +65,8 @@ def func(args):
     train_model(model, data, labels)
 
     # calculate and visualize SHAP
-    Kernelshap = KernelSHAP(data, model, X, alpha=0)
+    Kernelshap = KernelSHAP(data, model, X, alpha=args.alpha,
+                            batch_size=args.batch_size)
     shap_values, expected_values = Kernelshap.calculate_shap()
     fig = visualize(expected_values, shap_values, sample,
                     feature_names, args.class_index, args.index)
@@ -92,6 +93,8 @@ def main():
         '-a', '--alpha', help='alpha of Ridge, default=0', required=True, default=0, type=float)
     parser.add_argument(
         '-c2', '--class_index', help='class index (int), default=0', required=True, default=0, type=int)
+    parser.add_argument(
+        '-b', '--batch_size', help='batch size of model evaluation (int), default=1024', default=1024, type=int)
     parser.add_argument(
         '-o', '--output', help='path to output image, default=shap_tabular.png', required=True, default='shap_tabular.png')
     parser.set_defaults(func=func)
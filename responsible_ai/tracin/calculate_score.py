@@ -21,14 +21,13 @@ import numpy as np
 import nnabla as nn
 import nnabla.functions as F
 
-from nnabla.utils.data_iterator import data_iterator
 from nnabla.ext_utils import get_extension_context
 
 from tqdm import tqdm
 from distutils.util import strtobool
 
-from model import resnet23_prediction, resnet56_prediction, loss_function
-from cifar10_load import Cifar10NumpySource
+from model import resnet23_prediction, resnet56_prediction
+from tracin_engine import TracInEngine, self_influence, cross_influence
 
 
 CHECKPOINTS_PATH_FORMAT = "params_{}.h5"
@@ -41,47 +40,55 @@ def load_ckpt_path():
 
 
 def load_data():
-    x = np.load(os.path.join(args.input, 'x_train.npy'))[:50]
-    y = np.load(os.path.join(args.input, 'y_train.npy'))[:50]
-    y_shuffle = np.load(os.path.join(args.input, 'y_shuffle_train.npy'))[:50]
+    x = np.load(os.path.join(args.input, 'x_train.npy'))
+    y = np.load(os.path.join(args.input, 'y_train.npy'))
+    y_shuffle = np.load(os.path.join(args.input, 'y_shuffle_train.npy'))
+    if args.num_samples is not None:
+        x, y, y_shuffle = [a[:args.num_samples] for a in (x, y, y_shuffle)]
 
-    data_source = Cifar10NumpySource(x, y, y_shuffle)
-    data_num = len(data_source.labels)
-    loader = data_iterator(data_source, 1, None, False, False)
+    return x, y, y_shuffle
 
-    return loader, data_num, x, y, y_shuffle
 
+def load_test_data():
+    x = np.load(os.path.join(args.input, 'x_val.npy'))[:args.num_test]
+    y = np.load(os.path.join(args.input, 'y_val.npy'))[:args.num_test]
 
-def calculate_ckpt_score(dataloader, data_num, image_val, label_val, pred_val, hidden, loss_val):
-    ckpt_scores = []
-    labels, shuffle = [], []
+    return x, y
+
+
+def calculate_ckpt_score(engine, images, labels, test_factors=None):
+    data_num = len(images)
+    ckpt_scores = np.zeros(data_num, dtype=np.float32)
+    ckpt_test_scores = None
+    if test_factors is not None:
+        n_test = len(test_factors[0][0])
+        ckpt_test_scores = np.zeros((data_num, n_test), dtype=np.float32)
 
     bar = tqdm(total=data_num)
-    for i in range(data_num):
-        bar.update(1)
-        inputs = dataloader.next()
-        for name, param in nn.get_parameters().items():
-            param.grad.zero()  # grad initialize
-            if 'affine' not in name:
-                param.need_grad = False
-
-        grads = []
-        images, labels, shuffle = inputs
-        image_val.d, label_val.d = images, shuffle
-
-        loss_val.forward()
-        loss_val.backward()
-
-        for name, param in nn.get_parameters().items():
-            if 'affine' in name:
-                grads.append(param.grad)
-        grad_mul = [F.sum(grad * grad) for grad in grads]
-        score = F.add_n(*grad_mul)
-        ckpt_scores.append(score.data)
-    return ckpt_scores
-
-
-def get_scores(dataloader, data_num, ckpt_paths):
+    for start, factors in engine.iterate(images, labels):
+        end = start + len(factors[0][0])
+        bar.update(end - start)
+        ckpt_scores[start:end] = self_influence(factors)
+        if test_factors is not None:
+            ckpt_test_scores[start:end] = cross_influence(
+                factors, test_factors)
+    bar.close()
+    return ckpt_scores, ckpt_test_scores
+
+
+def get_test_factors(engine, images, labels):
+    factors = None
+    for _, batch_factors in engine.iterate(images, labels):
+        if factors is None:
+            factors = [[[U], [V]] for U, V in batch_factors]
+        else:
+            for f, (U, V) in zip(factors, batch_factors):
+                f[0].append(U)
+                f[1].append(V)
+    return [(np.concatenate(U), np.concatenate(V)) for U, V in factors]
+
+
+def get_scores(images, labels, ckpt_paths, test_data=None):
     if args.model == 'resnet23':
         model_prediction = resnet23_prediction
     elif args.model == 'resnet56':
@@ -93,29 +100,40 @@ def get_scores(dataloader, data_num, ckpt_paths):
                                    act=F.relu,
                                    seed=args.seed)
 
-    test = True
-    image_val = nn.Variable((1, 3, 32, 32))
-    label_val = nn.Variable((1, 1))
-    pred_val, hidden = prediction(image_val, test)
-    loss_val = loss_function(pred_val, label_val)
+    engine = TracInEngine(prediction, args.batch_size,
+                          image_shape=images.shape[1:],
+                          method=args.method,
+                          layers=args.layers,
+                          projection_dim=args.projection_dim,
+                          seed=args.seed)
 
+    data_num = len(images)
     infl_scores = np.zeros((data_num, len(ckpt_paths)), dtype=np.float32)
+    test_scores = None
+    if test_data is not None:
+        test_scores = np.zeros((data_num, len(test_data[0])), dtype=np.float32)
     for ckpt_ind, ckpt_path in enumerate(ckpt_paths):
         epoch = os.path.splitext(os.path.basename(ckpt_path))[0].split('_')[-1]
         print(f'Epoch: {epoch}')
         nn.load_parameters(ckpt_path)
 
-        ckpt_influences = calculate_ckpt_score(
-            dataloader, data_num, image_val, label_val, pred_val, hidden, loss_val)
+        test_factors = None
+        if test_data is not None:
+            test_factors = get_test_factors(engine, *test_data)
+        ckpt_influences, ckpt_test_influences = calculate_ckpt_score(
+            engine, images, labels, test_factors)
         if args.save_every_epoch:
             np.save(os.path.join(args.output, (epoch+'_influence.npy')),
-                    np.array([float(score) for score in ckpt_influences]))
+                    ckpt_influences)
 
         infl_scores[:, ckpt_ind] = ckpt_influences
+        if test_scores is not None:
+            test_scores += ckpt_test_influences
     sum_ckpt_scores = infl_scores.sum(axis=-1)
 
     return {
-        'scores': sum_ckpt_scores
+        'scores': sum_ckpt_scores,
+        'test_scores': test_scores
     }
 
 
@@ -126,13 +144,17 @@ def main():
                                 type_config=args.type_config)
     nn.set_default_context(ctx)
 
-    dataloader, data_num, images, labels, labels_shuffle = load_data()
+    images, labels, labels_shuffle = load_data()
+    test_data = load_test_data() if args.test_influence else None
     ckpt_paths = load_ckpt_path()
 
-    results = get_scores(dataloader, data_num, ckpt_paths)
+    results = get_scores(images, labels_shuffle, ckpt_paths, test_data)
 
     np.save(os.path.join(args.output, 'influence_all_epoch.npy'),
             results['scores'])
+    if results['test_scores'] is not None:
+        np.save(os.path.join(args.output, 'influence_train_test.npy'),
+                results['test_scores'])
 
 
 if __name__ == "__main__":
@@ -143,6 +165,23 @@ if __name__ == "__main__":
     parser.add_argument('--context', '-c', default='cudnn')
     parser.add_argument('--device-id', type=str, default='0')
     parser.add_argument('--model', type=str, choices=['resnet23', 'resnet56'])
+    parser.add_argument('--batch_size', '-b', type=int, default=128,
+                        help='number of samples whose gradients are computed at once')
+    parser.add_argument('--method', type=str, default='last_layer',
+                        choices=['last_layer', 'projection'],
+                        help='last_layer: closed-form gradients of the last affine layer, '
+                        'projection: randomly projected gradients of the layers given by --layers')
+    parser.add_argument('--layers', type=str, nargs='*', default=None,
+                        help='parameter names (or their parts) of the layers used by the projection method. '
+                        'all affine and convolution layers are used by default')
+    parser.add_argument('--projection_dim', type=int, default=16,
+                        help='projection dimension of both input and output channels of convolution layers')
+    parser.add_argument('--num_samples', type=int, default=None,
+                        help='number of training samples to score. all samples by default')
+    parser.add_argument('--test_influence', type=strtobool, default=False,
+                        help='whether calculate the influence of training samples on validation samples or not')
+    parser.add_argument('--num_test', type=int, default=100,
+                        help='number of validation samples used for the train-test influence')
     parser.add_argument('--save_every_epoch', type=strtobool, default=False,
                         help='whether save influence score between every epoch or not')
     parser.add_argument("--type_config",
@@ -0,0 +1,59 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import nnabla as nn
+import nnabla.functions as F
+import nnabla.parametric_functions as PF
+
+from tracin_engine import TracInEngine, softmax_residual
+
+
+def small_prediction(image, test=False):
+    h = F.relu(PF.convolution(image, 4, (3, 3), pad=(1, 1), name='conv'))
+    h = F.relu(PF.affine(h, 8, name='hidden'))
+    pred = PF.affine(h, 10, name='fc')
+    return pred, h
+
+
+def test_last_layer_factors():
+    '''
+    Factors of `last_layer` computed with clear_buffer=True match the hidden
+    features and the residuals of a forward without clearing the buffers.
+    '''
+    nn.clear_parameters()
+    rng = np.random.RandomState(0)
+    batch_size, n = 4, 3
+    images = rng.randn(n, 3, 8, 8).astype(np.float32)
+    labels = rng.randint(0, 10, size=(n, 1))
+
+    engine = TracInEngine(small_prediction, batch_size, image_shape=(3, 8, 8),
+                          method='last_layer')
+    (hidden, residual), = engine.factors(images, labels)
+
+    image = nn.Variable((n, 3, 8, 8))
+    image.d = images
+    pred, h = small_prediction(image, True)
+    pred.forward()
+    expected_hidden = np.hstack(
+        [h.d.reshape(n, -1), np.ones((n, 1), dtype=np.float32)])
+
+    np.testing.assert_allclose(hidden, expected_hidden, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(residual, softmax_residual(pred.d, labels),
+                               rtol=1e-5, atol=1e-6)
+
+
+if __name__ == '__main__':
+    test_last_layer_factors()
+    print('OK')
@@ -0,0 +1,185 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import nnabla as nn
+import nnabla.functions as F
+
+
+def softmax_residual(pred, label):
+    '''
+    Gradient of the softmax cross entropy w.r.t. the logits of each example.
+    '''
+    pred = pred - pred.max(axis=1, keepdims=True)
+    prob = np.exp(pred)
+    prob /= prob.sum(axis=1, keepdims=True)
+    prob[np.arange(len(prob)), label.reshape(-1).astype(np.int64)] -= 1
+    return prob
+
+
+def self_influence(factors):
+    '''
+    Squared norm of per-example gradients.
+
+    Each factor (U, V) represents per-example gradients vec(U_i ⊗ V_i).
+    '''
+    return sum((U * U).sum(axis=1) * (V * V).sum(axis=1) for U, V in factors)
+
+
+def cross_influence(factors_a, factors_b):
+    '''
+    Inner products of per-example gradients of two sets of examples.
+
+    Returns an array of shape (len(a), len(b)).
+    '''
+    return sum(Ua.dot(Ub.T) * Va.dot(Vb.T)
+               for (Ua, Va), (Ub, Vb) in zip(factors_a, factors_b))
+
+
+class TracInEngine(object):
+    '''
+    Batched per-example gradients for TracIn.
+
+    The gradients are represented by factors (U, V) with the per-example
+    gradient vec(U_i ⊗ V_i), so that the influence is computed without
+    materializing the gradients.
+
+    - `last_layer`: gradients of the last affine layer (weight and bias) in
+      closed form, i.e. [hidden, 1] ⊗ (softmax(pred) - onehot(label)).
+      Only a forward pass is needed.
+    - `projection`: gradients of the weights of the affine and convolution
+      layers given by `layers`. They are computed from the layer inputs and
+      the output gradients of one batched backward pass. Affine layers are
+      exact, and convolution layers are randomly projected to
+      `projection_dim` x `projection_dim` dimensions.
+    '''
+
+    def __init__(self, prediction, batch_size, image_shape=(3, 32, 32),
+                 method='last_layer', layers=None, projection_dim=16, seed=0):
+        self.batch_size = batch_size
+        self.method = method
+        self.image = nn.Variable((batch_size, ) + tuple(image_shape))
+        self.label = nn.Variable((batch_size, 1))
+        self.pred, self.hidden = prediction(self.image, True)
+        # read after the forward with clear_buffer=True
+        self.hidden.persistent = True
+
+        if method == 'last_layer':
+            return
+        elif method != 'projection':
+            raise ValueError(f'Unknown method: {method}')
+
+        # sum of per-example losses, so that the output gradients of each
+        # example come from its own loss (BN runs with the running stats)
+        self.loss = F.sum(F.softmax_cross_entropy(self.pred, self.label))
+        # the prediction graph may stop the gradient at the hidden features
+        self.hidden.need_grad = True
+        self.targets = self._find_layers(layers)
+        if len(self.targets) == 0:
+            raise ValueError(f'No affine or convolution layer matches {layers}')
+
+        rng = np.random.RandomState(seed)
+        self.projections = []
+        for _, f in self.targets:
+            if f.info.type_name == 'Affine':
+                self.projections.append(None)
+                continue
+            if f.info.args['group'] != 1:
+                raise ValueError('Grouped convolution is not supported')
+            w = f.inputs[1]
+            out_ch = w.shape[0]
+            # Kronecker-structured Gaussian projection of the weight gradient
+            p_out = rng.randn(projection_dim, out_ch) / np.sqrt(projection_dim)
+            p_in = rng.randn(projection_dim, *w.shape[1:]) / np.sqrt(projection_dim)
+            x = nn.Variable(f.inputs[0].shape)
+            x_proj = F.convolution(x,
+                                   nn.Variable.from_numpy_array(p_in.astype(np.float32)),
+                                   **self._conv_args(f))
+            self.projections.append((p_out.astype(np.float32), x, x_proj))
+
+    @staticmethod
+    def _conv_args(f):
+        args = f.info.args
+        return dict(base_axis=args['base_axis'], pad=args['pad'],
+                    stride=args['stride'], dilation=args['dilation'])
+
+    def _find_layers(self, layers):
+        params = nn.get_parameters(grad_only=False)
+        names = [name for name in params if name.endswith('/W') and
+                 (layers is None or any(layer in name for layer in layers))]
+        targets = []
+
+        def visit(f):
+            if f.info.type_name not in ('Affine', 'Convolution'):
+                return
+            for name in names:
+                if f.inputs[1] == params[name]:
+                    targets.append((name, f))
+
+        self.loss.visit(visit)
+        return targets
+
+    def _pad(self, x):
+        n = len(x)
+        if n == self.batch_size:
+            return x
+        index = np.arange(self.batch_size) % n
+        return x[index]
+
+    def factors(self, images, labels):
+        '''
+        Per-example gradient factors of a batch (at most `batch_size`).
+
+        Returns
+        -------
+        list of (U, V) numpy.ndarray pairs, one per layer.
+        '''
+        n = len(images)
+        self.image.d = self._pad(images)
+        self.label.d = self._pad(labels).reshape(self.label.shape)
+
+        if self.method == 'last_layer':
+            self.pred.forward(clear_buffer=True)
+            hidden = self.hidden.d.reshape(self.batch_size, -1)[:n]
+            residual = softmax_residual(self.pred.d[:n], labels)
+            hidden = np.hstack([hidden, np.ones((n, 1), dtype=hidden.dtype)])
+            return [(hidden, residual)]
+
+        self.loss.forward(clear_no_need_grad=False)
+        self.loss.backward(clear_buffer=False)
+        factors = []
+        for (_, f), proj in zip(self.targets, self.projections):
+            out_grad = f.outputs[0].g.reshape(
+                self.batch_size, f.outputs[0].shape[1], -1)[:n]
+            if proj is None:
+                x = f.inputs[0].d.reshape(self.batch_size, -1)[:n]
+                factors.append((x, out_grad.reshape(n, -1)))
+                continue
+            p_out, x, x_proj = proj
+            x.d = f.inputs[0].d
+            x_proj.forward(clear_buffer=True)
+            x_p = x_proj.d.reshape(self.batch_size, p_out.shape[0], -1)[:n]
+            g_p = np.einsum('ac,ncp->nap', p_out, out_grad)
+            g = np.einsum('nap,nbp->nab', g_p, x_p).reshape(n, -1)
+            factors.append((g, np.ones((n, 1), dtype=g.dtype)))
+        return factors
+
+    def iterate(self, images, labels):
+        '''
+        Yield (start index, factors) for every batch of the data.
+        '''
+        for start in range(0, len(images), self.batch_size):
+            end = start + self.batch_size
+            yield start, self.factors(images[start:end], labels[start:end])
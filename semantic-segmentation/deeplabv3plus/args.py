@@ -101,6 +101,20 @@ def get_args(monitor_path='tmp.monitor', max_iter=10000, model_save_path=None, l
     parser.add_argument('--num-class', default=10, type=int)
     parser.add_argument('--train-samples', default=10, type=int)
     parser.add_argument('--val-samples', default=10, type=int)
+    parser.add_argument('--num-workers', default=4, type=int,
+                        help='Number of threads decoding and preprocessing images in evaluation.')
+    parser.add_argument('--image-list', type=str,
+                        help='Directory of images, or text file of image paths for batch inference.')
+    parser.add_argument('--output-dir', type=str, default='inference_results',
+                        help='Directory to save predicted labels of batch inference.')
+    parser.add_argument('--sliding-window', action='store_true',
+                        help='Predict images in tiles of image-height x image-width instead of resizing them.')
+    parser.add_argument('--tile-overlap', default=1. / 3, type=float,
+                        help='Overlap ratio of neighbouring tiles of the sliding window.')
+    parser.add_argument('--scales', default=[1.0], type=float, nargs='+',
+                        help='Image scales averaged in batch inference, e.g. 0.75 1.0 1.25.')
+    parser.add_argument('--flip', action='store_true',
+                        help='Average predictions of horizontally flipped images in batch inference.')
     parser.add_argument("--sync-weight-every-itr",
                         type=int, default=100,
                         help="Sync weights every specified iteration. NCCL uses\
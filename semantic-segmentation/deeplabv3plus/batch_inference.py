@@ -0,0 +1,254 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import imageio
+import numpy as np
+import nnabla as nn
+import nnabla.functions as F
+from nnabla.logger import logger
+
+import model as net
+import image_preprocess
+from args import get_args
+from model_inference import colorize
+
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def list_images(path):
+    '''
+    List image files of a directory, or read paths from a text file.
+    '''
+    if os.path.isdir(path):
+        return sorted(os.path.join(path, f) for f in os.listdir(path)
+                      if f.lower().endswith(IMAGE_EXTENSIONS))
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_image(path):
+    return imageio.imread(path, as_gray=False, pilmode="RGB").astype(np.float32)
+
+
+def tile_positions(length, tile, stride):
+    if length <= tile:
+        return [0]
+    positions = list(range(0, length - tile, stride))
+    return positions + [length - tile]
+
+
+def feather_weights(height, width, overlap_h, overlap_w):
+    '''
+    Blending weights of a tile which ramp up linearly in the overlap.
+    '''
+    def ramp(length, overlap):
+        if overlap <= 0:
+            return np.ones(length, dtype=np.float32)
+        i = np.arange(length, dtype=np.float32)
+        return np.minimum(np.minimum(i + 1, length - i) / (overlap + 1), 1.0)
+    return np.outer(ramp(height, overlap_h), ramp(width, overlap_w))
+
+
+class SegmentationEngine(object):
+    '''
+    Batched DeepLabv3+ inference with optional sliding-window tiling and
+    multi-scale / flip test time augmentation.
+
+    One graph of the fixed shape (batch_size, 3, tile_height, tile_width)
+    is built and all tiles of all scales, flips and images are fed
+    through it in batches. Class probabilities of the tiles are blended
+    with feathered weights and averaged over scales and flips.
+    '''
+
+    def __init__(self, args):
+        self.batch_size = args.batch_size
+        self.tile_h, self.tile_w = args.image_height, args.image_width
+        self.num_class = args.num_class
+        self.sliding_window = args.sliding_window
+        self.overlap = args.tile_overlap
+        self.scales = args.scales
+        self.flip = args.flip
+
+        self.x = nn.Variable(
+            (self.batch_size, 3, self.tile_h, self.tile_w), need_grad=False)
+        y = net.deeplabv3plus_model(
+            self.x, args.output_stride, args.num_class, test=True)
+        if y.shape[2:] != self.x.shape[2:]:
+            y = F.interpolate(y, output_size=(
+                self.tile_h, self.tile_w), mode='linear')
+        self.prob = F.softmax(y, axis=1)
+        self.forward_times = []
+
+    def _canvas(self, image, scale):
+        '''
+        Resize an image for a scale, and pad it to at least the tile size.
+        Returns the padded canvas and the size of the valid area.
+        '''
+        h, w = image.shape[:2]
+        if self.sliding_window:
+            size = (max(int(round(h * scale)), 1),
+                    max(int(round(w * scale)), 1))
+        else:
+            ratio = min(self.tile_h / h, self.tile_w / w) * scale
+            size = (max(int(h * ratio), 1), max(int(w * ratio), 1))
+        if size != (h, w):
+            image = cv2.resize(image, (size[1], size[0]),
+                               interpolation=cv2.INTER_LINEAR)
+        canvas, _ = image_preprocess.pad(
+            image, desired_size=(self.tile_h, self.tile_w))
+        canvas = image_preprocess.zero_mean_unit_range(canvas)
+        return np.transpose(canvas, (2, 0, 1)), size
+
+    def _jobs(self, canvas):
+        _, h, w = canvas.shape
+        stride_h = max(int(self.tile_h * (1 - self.overlap)), 1)
+        stride_w = max(int(self.tile_w * (1 - self.overlap)), 1)
+        for y in tile_positions(h, self.tile_h, stride_h):
+            for x in tile_positions(w, self.tile_w, stride_w):
+                for flip in ([False, True] if self.flip else [False]):
+                    yield y, x, flip
+
+    def _run(self, tiles):
+        self.x.d = tiles
+        start = time.time()
+        self.prob.forward(clear_buffer=True)
+        probs = np.array(self.prob.d)
+        self.forward_times.append(time.time() - start)
+        return probs
+
+    def predict(self, images):
+        '''
+        Predict class labels of images of any size.
+
+        Args:
+            images: list of h x w x 3 RGB arrays
+
+        Returns:
+            list of h x w label arrays
+        '''
+        tile_h, tile_w = self.tile_h, self.tile_w
+        weights = feather_weights(tile_h, tile_w,
+                                  int(tile_h * self.overlap) if self.sliding_window else 0,
+                                  int(tile_w * self.overlap) if self.sliding_window else 0)
+
+        # accumulators of each (image, scale) canvas
+        canvases, accums, jobs = [], [], []
+        for i, image in enumerate(images):
+            for scale in self.scales:
+                canvas, size = self._canvas(image, scale)
+                _, h, w = canvas.shape
+                key = len(canvases)
+                canvases.append((i, canvas, size))
+                accums.append((np.zeros((self.num_class, h, w), np.float32),
+                               np.zeros((h, w), np.float32)))
+                jobs += [(key, y, x, flip) for y, x, flip in self._jobs(canvas)]
+
+        for start in range(0, len(jobs), self.batch_size):
+            batch = jobs[start:start + self.batch_size]
+            tiles = np.zeros(self.x.shape, dtype=np.float32)
+            for b, (key, y, x, flip) in enumerate(batch):
+                tile = canvases[key][1][:, y:y + tile_h, x:x + tile_w]
+                tiles[b] = tile[:, :, ::-1] if flip else tile
+            probs = self._run(tiles)
+            for b, (key, y, x, flip) in enumerate(batch):
+                prob = probs[b][:, :, ::-1] if flip else probs[b]
+                prob_sum, weight_sum = accums[key]
+                prob_sum[:, y:y + tile_h, x:x + tile_w] += prob * weights
+                weight_sum[y:y + tile_h, x:x + tile_w] += weights
+
+        results = [np.zeros((self.num_class, ) + image.shape[:2], np.float32)
+                   for image in images]
+        for (i, _, size), (prob_sum, weight_sum) in zip(canvases, accums):
+            prob = prob_sum[:, :size[0], :size[1]] / \
+                weight_sum[None, :size[0], :size[1]]
+            h, w = images[i].shape[:2]
+            if size != (h, w):
+                prob = cv2.resize(np.ascontiguousarray(prob.transpose(1, 2, 0)), (w, h),
+                                  interpolation=cv2.INTER_LINEAR)
+                prob = prob.reshape(h, w, -1).transpose(2, 0, 1)
+            results[i] += prob
+        return [np.argmax(r, axis=0).astype(np.uint8) for r in results]
+
+
+def main():
+    args = get_args()
+
+    from nnabla.ext_utils import get_extension_context
+    logger.info("Running in %s" % args.context)
+    ctx = get_extension_context(
+        args.context, device_id=args.device_id, type_config=args.type_config)
+    nn.set_default_context(ctx)
+
+    _ = nn.load_parameters(args.model_load_path)
+    engine = SegmentationEngine(args)
+
+    paths = list_images(args.image_list)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    def save(path, label):
+        name = os.path.splitext(os.path.basename(path))[0]
+        imageio.imwrite(os.path.join(
+            args.output_dir, name + '.png'), label)
+        imageio.imwrite(os.path.join(
+            args.output_dir, name + '_color.png'), colorize(label))
+
+    latencies = []
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.num_workers) as executor:
+        groups = [paths[i:i + args.batch_size]
+                  for i in range(0, len(paths), args.batch_size)]
+        # decoding of the next group overlaps with the inference
+        pending = [executor.submit(load_image, p) for p in groups[0]] \
+            if groups else []
+        writes = []
+        for g, group in enumerate(groups):
+            images = [f.result() for f in pending]
+            if g + 1 < len(groups):
+                pending = [executor.submit(load_image, p)
+                           for p in groups[g + 1]]
+            t = time.time()
+            labels = engine.predict(images)
+            latencies += [time.time() - t] * len(images)
+            writes += [executor.submit(save, p, l)
+                       for p, l in zip(group, labels)]
+            logger.info('{} / {} images'.format(
+                min((g + 1) * args.batch_size, len(paths)), len(paths)))
+        for w in writes:
+            w.result()
+    elapsed = time.time() - start
+
+    if latencies:
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        f50, f90, f99 = np.percentile(engine.forward_times, [50, 90, 99])
+        logger.info('Throughput: {:.2f} images/s ({} images in {:.2f} s)'.format(
+            len(paths) / elapsed, len(paths), elapsed))
+        logger.info('Image latency [s]: p50 {:.3f}, p90 {:.3f}, p99 {:.3f}'.format(
+            p50, p90, p99))
+        logger.info('Forward latency per batch [s]: p50 {:.3f}, p90 {:.3f}, p99 {:.3f}'.format(
+            f50, f90, f99))
+
+
+if __name__ == '__main__':
+    '''
+    Usage : python batch_inference.py --model-load-path=/path to parameter file(.h5) --image-list=directory or txt file of images --output-dir=output directory --num-class=no. of categories --batch-size=4 [--sliding-window --tile-overlap=0.33] [--scales 0.75 1.0 1.25 --flip]
+    '''
+
+    main()
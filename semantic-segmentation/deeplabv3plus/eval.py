@@ -22,7 +22,8 @@ import nnabla.monitor as M
 import numpy as np
 
 from args import get_args
-from segmentation_data import data_iterator_segmentation
+from metrics import ConfusionMatrix
+from segmentation_data import eval_batches_segmentation
 
 
 def validate(args):
@@ -30,10 +31,6 @@ def validate(args):
    # load trained param file
     _ = nn.load_parameters(args.model_load_path)
 
-    # get data iterator
-    vdata = data_iterator_segmentation(args.val_samples, args.batch_size, args.val_dir,
-                                       args.val_label_dir, target_width=args.image_width, target_height=args.image_height)
-
     # get deeplabv3plus model
     v_model = train.get_model(args, test=True)
     v_model.pred.persistent = True  # Not clearing buffer of pred in forward
@@ -42,24 +39,29 @@ def validate(args):
     # Create monitor
     monitor = M.Monitor(args.monitor_path)
     monitor_miou = M.MonitorSeries("mean IOU", monitor, interval=1)
+    monitor_acc = M.MonitorSeries("pixel accuracy", monitor, interval=1)
 
-    l = 0.0
-    e = 0.0
-    vmiou = 0.
+    confusion = ConfusionMatrix(args.num_class)
     # Evaluation loop
-    for j in range(args.val_samples // args.batch_size):
-        images, labels, masks = vdata.next()
+    # Decoding and preprocessing of the next batches run on worker threads
+    for j, (images, labels, masks, n) in enumerate(eval_batches_segmentation(
+            args.val_samples, args.batch_size, args.val_dir, args.val_label_dir,
+            target_width=args.image_width, target_height=args.image_height,
+            num_workers=args.num_workers)):
         v_model.image.d = images
-        v_model.label.d = labels
-        v_model.mask.d = masks
         v_model.pred.forward(clear_buffer=True)
-        miou = train.compute_miou(
-            args.num_class, labels, np.argmax(v_model.pred.d, axis=1), masks)
-        vmiou += miou
-        print(j, miou)
-
-    monitor_miou.add(0, vmiou / (args.val_samples / args.batch_size))
-    return vmiou / args.val_samples
+        pred = np.argmax(v_model.pred.d[:n], axis=1)
+        confusion.update(labels[:n, 0], pred, masks[:n, 0])
+        print(j, confusion.miou())
+
+    results = confusion.summary()
+    for c, iou in enumerate(results['iou']):
+        logger.info('class {}: IOU {:.4f}'.format(c, iou))
+    logger.info('mean IOU: {:.4f}, pixel accuracy: {:.4f}'.format(
+        results['miou'], results['pixel_accuracy']))
+    monitor_miou.add(0, results['miou'])
+    monitor_acc.add(0, results['pixel_accuracy'])
+    return results['miou']
 
 
 def main():
@@ -171,3 +171,25 @@ def preprocess_image_and_label(image, label=None, target_width=513, target_heigh
         image, label = pad(image, desired_size=(crop_h, crop_w))
         image = zero_mean_unit_range(image)
         return image
+
+
+def preprocess_image_and_label_eval(image, label, target_width=513, target_height=513):
+    '''
+    Deterministic preprocessing for evaluation.
+    The image and label are resized to fit in the target size and padded,
+    and the padded area is masked out.
+
+    image - 3d array (h, w, ch)
+    label - 3d array (h, w, 1)
+
+    '''
+    image, label = cast(image, label)
+    image = resize(image, (target_height, target_width))
+    label = resize(label, (target_height, target_width))
+    if label.ndim == 2:
+        label = np.expand_dims(label, axis=2)
+    image, label = pad(image, label, desired_size=(
+        target_height, target_width))
+    image = zero_mean_unit_range(image)
+    label, mask = create_mask(label)
+    return image, label, mask
@@ -0,0 +1,100 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import numpy as np
+
+
+class ConfusionMatrix(object):
+    '''
+    Streaming confusion matrix for semantic segmentation.
+
+    Predictions are accumulated into a (num_class, num_class) matrix with
+    np.bincount, whose rows are ground truth and columns are predictions,
+    so that dataset-level metrics are computed without keeping one-hot
+    arrays. Matrices of several workers can be merged by addition.
+    '''
+
+    def __init__(self, num_class):
+        self.num_class = num_class
+        self.matrix = np.zeros((num_class, num_class), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.matrix[...] = 0
+
+    def update(self, gt, pred, mask=None):
+        '''
+        Accumulate a batch.
+
+        Args:
+            gt: ground truth labels of any shape
+            pred: predicted labels of the same number of elements as gt
+            mask: pixels to be evaluated (non-zero), or None for all pixels
+        '''
+        gt = np.asarray(gt).reshape(-1).astype(np.int64)
+        pred = np.asarray(pred).reshape(-1).astype(np.int64)
+        valid = (gt >= 0) & (gt < self.num_class)
+        if mask is not None:
+            valid &= np.asarray(mask).reshape(-1) != 0
+        index = gt[valid] * self.num_class + pred[valid]
+        counts = np.bincount(index, minlength=self.num_class ** 2)
+        with self._lock:
+            self.matrix += counts.reshape(self.num_class, self.num_class)
+
+    def merge(self, other):
+        '''
+        Add the confusion matrix of another evaluator (or an array).
+        '''
+        matrix = other.matrix if isinstance(other, ConfusionMatrix) else other
+        with self._lock:
+            self.matrix += np.asarray(matrix, dtype=np.int64)
+        return self
+
+    def all_reduce(self, comm):
+        '''
+        Sum the confusion matrices of all workers of a communicator.
+        '''
+        import nnabla as nn
+        # counts are split into two parts exactly representable in float32
+        shift = 2 ** 16
+        parts = [nn.NdArray.from_numpy_array(p.astype(np.float32))
+                 for p in (self.matrix // shift, self.matrix % shift)]
+        comm.all_reduce(parts, division=False, inplace=True)
+        high, low = [np.rint(p.data).astype(np.int64) for p in parts]
+        self.matrix = high * shift + low
+
+    def iou(self):
+        '''
+        Per-class IoU. Classes which appear neither in ground truth nor in
+        predictions are NaN.
+        '''
+        tp = np.diag(self.matrix).astype(np.float64)
+        union = self.matrix.sum(axis=0) + self.matrix.sum(axis=1) - tp
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(union > 0, tp / union, np.nan)
+
+    def miou(self):
+        iou = self.iou()
+        return float(np.nanmean(iou)) if np.any(~np.isnan(iou)) else 0.
+
+    def pixel_accuracy(self):
+        total = self.matrix.sum()
+        return float(np.trace(self.matrix) / total) if total > 0 else 0.
+
+    def summary(self):
+        return {'miou': self.miou(),
+                'pixel_accuracy': self.pixel_accuracy(),
+                'iou': self.iou()}
@@ -28,16 +28,19 @@ import matplotlib.pyplot as plt
 import time
 
 
+def colorize(label):
+    '''
+    Convert a label map into an RGB image with a palette lookup.
+    Labels out of the palette (e.g. 22) are black.
+    '''
+    clr_map = np.asarray(dataset_utils.get_color(), dtype=np.uint8)
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:len(clr_map)] = clr_map
+    return palette[np.asarray(label, dtype=np.uint8)]
+
+
 def visualize(label):
-    h, w = label.shape
-    vis = np.zeros((h, w, 3), dtype=np.int32)
-    clr_map = dataset_utils.get_color()
-    for y in range(h):
-        for x in range(w):
-            if label[y][x] == 22:
-                vis[y][x] = 0
-            else:
-                vis[y][x] = clr_map[label[y][x]]
+    vis = colorize(label)
 
     #plt.imshow(vis, interpolation='none')
     # plt.show()
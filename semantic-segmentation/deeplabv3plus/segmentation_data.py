@@ -14,12 +14,34 @@
 # limitations under the License.
 
 from nnabla.utils.data_iterator import data_iterator_simple
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import cv2
+import imageio
 import image_preprocess
 import numpy as np
 import time
 
 
+def load_image_label(image_path, label_path):
+    '''
+    Returns:
+        image: h x w x 3 array (RGB)
+        label: h x w x 1 array
+    '''
+    img = cv2.imread(image_path).astype('float32')
+    b, g, r = cv2.split(img)
+    img = cv2.merge([r, g, b])
+    if 'png' in label_path:
+        lab = imageio.imread(
+            label_path, as_gray=False, pilmode="RGB").astype('int32')
+    else:
+        lab = np.load(label_path, allow_pickle=True).astype('int32')
+    if lab.ndim == 2:
+        lab = lab[..., None]
+    return img, lab
+
+
 def data_iterator_segmentation(num_examples, batch_size, image_path_file, label_path_file, rng=None, target_width=513, target_height=513, train=True):
 
     image_paths = load_paths(image_path_file)
@@ -33,16 +55,7 @@ def data_iterator_segmentation(num_examples, batch_size, image_path_file, label_
             mask: c x h x w array
         '''
 
-        img = cv2.imread(image_paths[i]).astype('float32')
-        b, g, r = cv2.split(img)
-        img = cv2.merge([r, g, b])
-        if 'png' in label_paths[i]:
-            lab = imageio.imread(
-                label_paths[i], as_gray=False, pilmode="RGB").astype('int32')
-        else:
-            lab = np.load(label_paths[i], allow_pickle=True).astype('int32')
-        if lab.ndim == 2:
-            lab = lab[..., None]
+        img, lab = load_image_label(image_paths[i], label_paths[i])
         # Compute image preprocessing time
         #t = time.time()
         img, lab, mask = image_preprocess.preprocess_image_and_label(
@@ -59,3 +72,43 @@ def load_paths(path_file):
     lines = [line[:-1] for line in text_file]
 
     return lines
+
+
+def eval_batches_segmentation(num_examples, batch_size, image_path_file, label_path_file, target_width=513, target_height=513, num_workers=4, prefetch=2):
+    '''
+    Iterate over the evaluation data in order, without shuffling nor dropping
+    the last incomplete batch. Decoding and preprocessing run on a thread pool
+    and overlap with the computation of previous batches.
+
+    Yields:
+        images: batch_size x 3 x h x w array
+        labels: batch_size x 1 x h x w array
+        masks: batch_size x 1 x h x w array
+        n: number of valid examples in the batch. The rest is padding.
+    '''
+    image_paths = load_paths(image_path_file)[:num_examples]
+    label_paths = load_paths(label_path_file)[:num_examples]
+    num_examples = min(len(image_paths), len(label_paths))
+
+    def load_func(i):
+        img, lab = load_image_label(image_paths[i], label_paths[i])
+        img, lab, mask = image_preprocess.preprocess_image_and_label_eval(
+            img, lab, target_width, target_height)
+        return np.rollaxis(img, 2), np.rollaxis(lab, 2), np.rollaxis(mask, 2)
+
+    def load_batch(executor, start):
+        indices = range(start, min(start + batch_size, num_examples))
+        return [executor.submit(load_func, i) for i in indices]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        starts = deque(range(0, num_examples, batch_size))
+        pending = deque()
+        while starts or pending:
+            while starts and len(pending) <= prefetch:
+                pending.append(load_batch(executor, starts.popleft()))
+            samples = [future.result() for future in pending.popleft()]
+            n = len(samples)
+            # pad the last batch by repeating the last example
+            samples += [samples[-1]] * (batch_size - n)
+            images, labels, masks = [np.stack(x) for x in zip(*samples)]
+            yield images, labels, masks, n
@@ -26,6 +26,7 @@ import nnabla.utils.save as save
 from args import get_args
 from segmentation_data import data_iterator_segmentation
 import model
+from metrics import ConfusionMatrix
 
 import os
 from collections import namedtuple
@@ -58,46 +59,6 @@ def get_model(args, test=False):
     return Model(image, label, mask, pred, loss)
 
 
-def one_hot_encode(label, num_class):
-    # label is 2-d of shape (batch, pixels(513x513))
-    one_hot_vector = np.zeros(
-        (label.shape[0], label.shape[1], num_class), dtype=np.int32)
-
-    batch_id = np.arange(label.shape[0]).reshape(label.shape[0], 1)
-    pixel_id = np.tile(np.arange(label.shape[1]), (label.shape[0], 1))
-
-    one_hot_vector[batch_id, pixel_id, label.astype(np.int32)] = 1
-
-    return one_hot_vector
-
-
-def compute_miou(num_classes, gt, pred, mask):
-
-    gt = np.squeeze(np.transpose(gt, (1, 0, 2, 3)), axis=0)
-    gt = gt.reshape(gt.shape[0], gt.shape[1]*gt.shape[2])
-    gt = one_hot_encode(gt, num_classes)
-
-    pred = pred.reshape(pred.shape[0], pred.shape[1]*pred.shape[2])
-    pred = one_hot_encode(pred, num_classes)
-
-    # Now, gt: [B, P, C] ; pred: [B, P, C]
-    mask = np.squeeze(np.transpose(mask, (1, 0, 2, 3)), axis=0)
-    mask = mask.reshape(mask.shape[0], mask.shape[1]
-                        * mask.shape[2])  # mask: [B, P]
-    mask = mask[..., None]
-
-    # gt: [B, P, C], mask: [B, P, 1]
-    numer = np.sum(np.logical_and(gt, pred) * mask, axis=1)
-    denom = np.sum(np.logical_or(gt, pred) * mask, axis=1)
-    iou = numer / np.maximum(denom, 1)
-
-    cat_mask = np.max(gt, axis=1)
-    iou_per_image = np.sum(iou * cat_mask, axis=1) / np.sum(cat_mask, axis=1)
-    miou = np.mean(iou_per_image)
-
-    return miou.mean()
-
-
 def train():
     """
     Main script.
@@ -213,7 +174,7 @@ def train():
             save_checkpoint(args.model_save_path, i, solver)
         # Validation
         if i % (args.val_interval // n_devices) == 0 and i != 0:
-            vmiou_local = 0.
+            confusion = ConfusionMatrix(num_classes)
             val_iter_local = n_val_samples // args.batch_size
             vl_local = nn.NdArray()
             vl_local.zero()
@@ -232,26 +193,22 @@ def train():
                 ve_local += v_e.data
                 # Mean IOU computation
                 if compute_acc:
-                    vmiou_local += compute_miou(num_classes, labels,
-                                                np.argmax(v_model.pred.d, axis=1), masks)
+                    confusion.update(
+                        labels, np.argmax(v_model.pred.d, axis=1), masks)
 
             vl_local /= val_iter_local
             ve_local /= val_iter_local
-            if compute_acc:
-                vmiou_local /= val_iter_local
-                vmiou_ndarray = nn.NdArray.from_numpy_array(
-                    np.array(vmiou_local))
             if distributed:
                 comm.all_reduce(vl_local, division=True, inplace=True)
                 comm.all_reduce(ve_local, division=True, inplace=True)
                 if compute_acc:
-                    comm.all_reduce(vmiou_ndarray, division=True, inplace=True)
+                    confusion.all_reduce(comm)
 
             if device_id == 0:
                 monitor_vloss.add(i * n_devices, vl_local.data.copy())
                 monitor_verr.add(i * n_devices, ve_local.data.copy())
                 if compute_acc:
-                    monitor_miou.add(i * n_devices, vmiou_local)
+                    monitor_miou.add(i * n_devices, confusion.miou())
                 monitor_vtime.add(i * n_devices)
 
         # Training
@@ -18,6 +18,7 @@ import numpy as np
 from nnabla.ext_utils import get_extension_context
 
 import os
+import sys
 from functools import partial
 from tqdm import tqdm
 
@@ -26,6 +27,13 @@ from skimage import measure
 
 from network import sdf_net
 
+# Set path to neu
+common_utils_path = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'utils'))
+sys.path.append(common_utils_path)
+
+from neu.sdf_extraction import FixedBatchEvaluator, extract_sparse_sdf
+
 
 def create_mesh_from_volume(volume, spacing, gradient_direction="ascent"):
     spacing = [np.max(spacing)] * 3
@@ -67,6 +75,40 @@ def compute_pts_vol(model, mins, maxs, step, sub_batch_size, bias=None, V=None):
     return pts, vol
 
 
+def create_mesh_from_sparse_volume(svol, spacing, gradient_direction="ascent"):
+    spacing = [np.max(spacing)] * 3
+    verts, faces, normals = svol.marching_cubes(spacing, gradient_direction)
+    mesh = trimesh.Trimesh(verts, faces, normals)
+    return mesh
+
+
+def compute_sparse_vol(model, mins, maxs, step, sub_batch_size, bias=None, V=None):
+    """
+    Coarse-to-fine version of `compute_pts_vol`, which evaluates the SDF only
+    near the zero level set through a graph of a fixed batch size.
+    Returns a sparse volume of the same grid as `compute_pts_vol`.
+    """
+    x = np.arange(mins[0], maxs[0], step).astype(np.float32)
+    y = np.arange(mins[1], maxs[1], step).astype(np.float32)
+    z = np.arange(mins[2], maxs[2], step).astype(np.float32)
+    # (y, x, z) order as the volume of meshgrid
+    grid_shape = (len(y), len(x), len(z))
+    print(f"Grid shape for (x, y, z) = {grid_shape}")
+
+    evaluator = FixedBatchEvaluator(model, sub_batch_size)
+    origin = np.asarray([x[0], y[0], z[0]], dtype=np.float32)
+
+    def sdf(index):
+        p = origin + index[:, [1, 0, 2]].astype(np.float32) * step
+        p = (p - bias) @ V.T if V is not None else p
+        return evaluator(p.astype(np.float32))
+
+    svol = extract_sparse_sdf(sdf, grid_shape, step)
+    print(f"Evaluated {evaluator.num_evaluations} points "
+          f"({evaluator.num_evaluations / np.prod(grid_shape) * 100:.2f}% of the grid)")
+    return svol
+
+
 def create_largest_mesh(mesh):
     meshes = mesh.split(only_watertight=False)
     areas = np.array([m.area for m in meshes], dtype=np.float)
@@ -128,12 +170,20 @@ def main(args):
     print(f"grid_step = {grid_step}")
     mins = scale * mins_large + bias
     maxs = scale * maxs_large + bias
-    pts, vol = compute_pts_vol(partial(sdf_net, conf=conf),
-                               mins, maxs, grid_step,
-                               conf.sub_batch_size,
-                               bias, V)
-    mesh = create_mesh_from_volume(
-        vol, [grid_step] * 3, conf.gradient_direction)
+    if args.dense:
+        pts, vol = compute_pts_vol(partial(sdf_net, conf=conf),
+                                   mins, maxs, grid_step,
+                                   conf.sub_batch_size,
+                                   bias, V)
+        mesh = create_mesh_from_volume(
+            vol, [grid_step] * 3, conf.gradient_direction)
+    else:
+        svol = compute_sparse_vol(partial(sdf_net, conf=conf),
+                                  mins, maxs, grid_step,
+                                  conf.sub_batch_size,
+                                  bias, V)
+        mesh = create_mesh_from_sparse_volume(
+            svol, [grid_step] * 3, conf.gradient_direction)
     mesh = create_largest_mesh(mesh)
 
     # Save
@@ -155,6 +205,8 @@ if __name__ == '__main__':
     parser.add_argument('--model-load-path', type=str, required=True)
     parser.add_argument('--config', type=str,
                         default="conf/default.yaml", required=True)
+    parser.add_argument('--dense', action='store_true',
+                        help='Evaluate the SDF on every point of the dense grid for the fine mesh.')
 
     args = parser.parse_args()
     with open(args.config, "r") as f:
@@ -247,7 +247,7 @@ def norm(x, axis, eps=1e-24):
     return F.sum(x ** 2 + eps, axis, keepdims=True) ** 0.5
 
 
-def idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf):
+def idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf, stats=None):
     # Setting
     B, R, _ = raydir.shape
     L = conf.layers
@@ -262,7 +262,10 @@ def idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf):
                   ray_march_points=conf.ray_march_points,
                   n_chunks=conf.n_chunks,
                   max_post_itr=conf.max_post_itr,
-                  post_method=conf.post_method, eps=conf.eps)
+                  post_method=conf.post_method, eps=conf.eps,
+                  compact=getattr(conf, "compact_ray_trace", False),
+                  capacity=getattr(conf, "ray_trace_capacity", 65536),
+                  stats=stats)
 
     x_hit = x_hit.apply(need_grad=False)
     mask_hit = mask_hit.apply(need_grad=False, persistent=True)
@@ -315,7 +318,7 @@ def idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf):
     return loss, loss_color, loss_mask, loss_eikonal, mask_hit
 
 
-def render(camloc, raydir, conf):
+def render(camloc, raydir, conf, stats=None):
     # Setting
     B, R, _ = raydir.shape
     L = conf.layers
@@ -331,7 +334,10 @@ def render(camloc, raydir, conf):
                   ray_march_points=conf.ray_march_points,
                   n_chunks=conf.n_chunks,
                   max_post_itr=conf.max_post_itr,
-                  post_method=conf.post_method, eps=conf.eps)
+                  post_method=conf.post_method, eps=conf.eps,
+                  compact=getattr(conf, "compact_ray_trace", False),
+                  capacity=getattr(conf, "ray_trace_capacity", 65536),
+                  stats=stats)
     x_hit = x_hit.apply(need_grad=True)
     mask_hit = mask_hit.apply(need_grad=False)
 
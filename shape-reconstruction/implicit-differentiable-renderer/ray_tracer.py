@@ -20,11 +20,20 @@ from nnabla.ext_utils import get_extension_context
 from nnabla.function import PythonFunction
 
 import cv2
+import os
+import sys
 import time
 from functools import partial
 
 from helper import Camera, look_at, DistantLight, lambert
 
+# Set path to neu
+common_utils_path = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', 'utils'))
+sys.path.append(common_utils_path)
+
+from neu.sdf_extraction import FixedBatchEvaluator
+
 
 def bisection(x0, x1, implicit_function, max_post_itr):
 
@@ -353,16 +362,228 @@ class RayTrace(PythonFunction):
                 inputs[1].grad.fill(1)
 
 
+class CompactRayTrace(RayTrace):
+    """
+    RayTrace which evaluates the SDF only on the active rays.
+
+    The SDF network is built once as a graph of the fixed batch size
+    `capacity`, and every SDF evaluation of sphere tracing, ray marching,
+    and the post method is fed through it in chunks. At each sphere tracing
+    iteration, the rays already converged are removed from the active set,
+    ray marching runs only on the rays the sphere tracing did not hit, and
+    the post method only on the rays the ray marching hit. The results are
+    the same as RayTrace.
+
+    The number of active rays of each sphere tracing iteration and the
+    number of SDF evaluations of the last forward are written in `stats`.
+    """
+
+    def __init__(self, ctx, sdf_network, test=False, t_near=0, t_far=10,
+                 sphere_trace_itr=50, ray_march_points=100, n_chunks=10,
+                 max_post_itr=10, post_method="secant", eps=5e-5,
+                 capacity=65536, stats=None):
+
+        super(CompactRayTrace, self).__init__(
+            ctx, sdf_network, test, t_near=t_near, t_far=t_far,
+            sphere_trace_itr=sphere_trace_itr,
+            ray_march_points=ray_march_points, n_chunks=n_chunks,
+            max_post_itr=max_post_itr, post_method=post_method, eps=eps)
+
+        self.evaluator = FixedBatchEvaluator(sdf_network, capacity)
+        self.stats = stats if stats is not None else {}
+        if post_method == "secant":
+            self.post_method = partial(
+                secant, implicit_function=self.implicit_function, max_post_itr=max_post_itr)
+        elif post_method == "bisection":
+            self.post_method = partial(
+                bisection, implicit_function=self.implicit_function, max_post_itr=max_post_itr)
+
+    @property
+    def name(self):
+        return "CompactRayTrace"
+
+    def sdf_values(self, x):
+        # x: (N, 3) --> (N, 1)
+        return self.evaluator(x.astype(np.float32)).reshape((-1, 1))
+
+    def implicit_function(self, x):
+        # NdArray version for the post methods
+        return nn.NdArray.from_numpy_array(self.sdf_values(x.data))
+
+    def _forward_impl(self, inputs, outputs):
+        # Same inputs and outputs as RayTrace, but computed in numpy
+        test = self.test
+        N = self.ray_march_points
+        num_evaluations = self.evaluator.num_evaluations
+
+        camloc = inputs[0].d
+        raydir = inputs[1].d
+        B, R, _ = raydir.shape
+        camloc = np.broadcast_to(camloc[:, np.newaxis, :], (B, R, 3))
+        camloc = camloc.reshape((B * R, 3))
+        raydir = raydir.reshape((B * R, 3))
+
+        # Unit sphere intersection
+        t_start, t_finish, mask_us = self.unit_sphere_intersection(
+            nn.NdArray.from_numpy_array(camloc),
+            nn.NdArray.from_numpy_array(raydir))
+        t_start, t_finish, mask_us = t_start.data, t_finish.data, mask_us.data
+
+        # Bidirectional sphere tracing
+        x_hit_st0, t_f, t_b, mask_st = \
+            self.compact_bidirectional_sphere_trace(camloc, raydir,
+                                                    t_start, t_finish)
+
+        # Ray marching on the rays not hit by the sphere tracing
+        x_hit = np.where(mask_st, x_hit_st0, 0)
+        mask_hit = np.copy(mask_st)
+        idx = np.where(~mask_st[:, 0])[0]
+        x_hit_rm0, x_hit_rm1, mask_rm = self.compact_ray_march(
+            camloc[idx], raydir[idx], t_f[idx], t_b[idx], N)
+
+        # Post method on the rays hit by the ray marching
+        idx = idx[mask_rm[:, 0]]
+        x_hit_rm0, x_hit_rm1 = x_hit_rm0[mask_rm[:, 0]], x_hit_rm1[mask_rm[:, 0]]
+        if len(idx) > 0:
+            x_hit_rm, _ = self.post_method(
+                nn.NdArray.from_numpy_array(x_hit_rm0),
+                nn.NdArray.from_numpy_array(x_hit_rm1))
+            x_hit[idx] = x_hit_rm.data
+            mask_hit[idx] = True
+        self.stats["ray_march_rays"] = len(mask_rm)
+        self.stats["post_method_rays"] = len(idx)
+
+        mask_hit = mask_hit.astype(np.float32)
+        if test:
+            outputs[0].d = x_hit.reshape((B, R, 3))
+            outputs[1].d = mask_hit.reshape((B, R, 1))
+            self.stats["sdf_evaluations"] = \
+                self.evaluator.num_evaluations - num_evaluations
+            return
+
+        # Mask pin/pout
+        mask_obj = inputs[2].d.reshape((B * R, 1))
+        mask_pin = mask_us * mask_hit * mask_obj
+        mask_pout = mask_us * (1 - mask_hit * mask_obj)
+
+        # Dists, where t_argmin is needed only for P_out
+        t_argmin = np.zeros((B * R, 1), dtype=np.float32)
+        idx = np.where(mask_pout[:, 0] > 0)[0]
+        t_argmin[idx] = self.compact_ray_march(
+            camloc[idx], raydir[idx], t_start[idx], t_finish[idx], N, True)
+        dists = np.linalg.norm(camloc - x_hit, axis=1, keepdims=True)
+        dists = mask_pin * dists + mask_pout * t_argmin
+        self.stats["sdf_evaluations"] = \
+            self.evaluator.num_evaluations - num_evaluations
+
+        # Outputs
+        outputs[0].d = x_hit.reshape((B, R, 3))
+        outputs[1].d = mask_hit.reshape((B, R, 1))
+        outputs[2].d = dists.reshape((B, R, 1))
+        outputs[3].d = mask_pin.reshape((B, R, 1))
+        outputs[4].d = mask_pout.reshape((B, R, 1))
+
+    def compact_sphere_trace(self, camloc, raydir, t, direction):
+        # Sphere tracing of one direction over the active rays only.
+        # A converged ray does not move any more, thus it is removed from
+        # the active set instead of being evaluated again.
+        BR = len(t)
+        t = np.copy(t)
+        s = self.sdf_values(camloc + t * raydir)
+        mask_hit_eps = np.zeros((BR, 1), dtype=bool)
+        mask_revert = np.zeros((BR, 1), dtype=bool)
+        s_prev = np.zeros((BR, 1), dtype=np.float32)
+        active = np.arange(BR)
+        active_rays = []
+
+        for i in range(self.sphere_trace_itr - 1):
+            converged = np.abs(s[active, 0]) <= self.eps
+            mask_hit_eps[active[converged]] = True
+            mask_revert[active[converged]] = False
+            active = active[~converged]
+            active_rays.append(len(active))
+            if len(active) == 0:
+                break
+
+            s_a = s[active]
+            t_a = t[active] + direction * s_a
+            s_a_next = self.sdf_values(camloc[active] + t_a * raydir[active])
+            revert = (s_a > 0) & (s_a_next < 0)
+            t[active] = t_a - direction * revert * s_a
+            s[active] = np.where(revert, s_a, s_a_next)
+            s_prev[active] = s_a
+            mask_revert[active] = revert
+
+        return t, mask_hit_eps, mask_revert, s_prev, active_rays
+
+    def compact_bidirectional_sphere_trace(self, camloc, raydir, t_start, t_finish):
+        t_f, mask_hit_eps_f, mask_revert_f, s_f_prev, active_f = \
+            self.compact_sphere_trace(camloc, raydir, t_start, 1)
+        t_b, _, _, _, active_b = \
+            self.compact_sphere_trace(camloc, raydir, t_finish, -1)
+        self.stats["active_rays_forward"] = active_f
+        self.stats["active_rays_backward"] = active_b
+
+        # Fine grained start/finish points
+        t_f1 = t_f + mask_revert_f * s_f_prev
+        x_hit_st0 = camloc + t_f * raydir
+        mask_hit_f1b = mask_revert_f & (t_f1 < t_b)
+        t_b = np.where(mask_hit_f1b, t_f1, t_b)
+
+        # Reverse the opposite case
+        mask_fb = t_f < t_b
+        t_f = np.where(mask_fb, t_f, t_start)
+        t_b = np.where(mask_fb, t_b, t_finish)
+
+        return x_hit_st0, t_f, t_b, mask_hit_eps_f
+
+    def compact_ray_march(self, camloc, raydir, t0, t1, N, t_argmin=False):
+        # Points computation
+        BR = len(t0)
+        step = (t1 - t0) / (N - 1)
+        ts = t0[:, np.newaxis, :] + step[:, np.newaxis, :] * \
+            np.arange(N).reshape((1, N, 1))
+        points = camloc[:, np.newaxis, :] + ts * raydir[:, np.newaxis, :]
+
+        # SDF computation
+        sdf_points = self.sdf_values(
+            points.reshape((BR * N, 3))).reshape((BR, N))
+
+        # t_argmin computation
+        if t_argmin:
+            idx_min = np.argmin(sdf_points, axis=1)
+            return ts[np.arange(BR), idx_min]
+
+        # Intersection check, the first sign change along the ray
+        mask_hit = (sdf_points[:, :-1] >= 0) & (sdf_points[:, 1:] <= 0)
+        idx_hit = np.argmax(mask_hit, axis=1)
+        x_hit_rm0 = points[np.arange(BR), idx_hit]
+        x_hit_rm1 = x_hit_rm0 + step * raydir
+        mask_hit = np.any(mask_hit, axis=1, keepdims=True)
+
+        return x_hit_rm0, x_hit_rm1, mask_hit
+
+
 def ray_trace(sdf_network, camloc, raydir, mask_obj=None, test=False, t_near=0, t_far=4,
               sphere_trace_itr=50, ray_march_points=100, n_chunks=10,
               max_post_itr=10, post_method="secant", eps=5e-5,
+              compact=False, capacity=65536, stats=None,
               ctx=None):
-    func = RayTrace(ctx, sdf_network, test, t_near=t_near, t_far=t_far,
-                    sphere_trace_itr=sphere_trace_itr, ray_march_points=ray_march_points,
-                    n_chunks=n_chunks,
-                    max_post_itr=max_post_itr,
-                    post_method=post_method,
-                    eps=eps)
+    if compact:
+        func = CompactRayTrace(ctx, sdf_network, test, t_near=t_near, t_far=t_far,
+                               sphere_trace_itr=sphere_trace_itr,
+                               ray_march_points=ray_march_points,
+                               n_chunks=n_chunks,
+                               max_post_itr=max_post_itr,
+                               post_method=post_method,
+                               eps=eps, capacity=capacity, stats=stats)
+    else:
+        func = RayTrace(ctx, sdf_network, test, t_near=t_near, t_far=t_far,
+                        sphere_trace_itr=sphere_trace_itr, ray_march_points=ray_march_points,
+                        n_chunks=n_chunks,
+                        max_post_itr=max_post_itr,
+                        post_method=post_method,
+                        eps=eps)
     mask_obj = mask_obj if mask_obj is not None else nn.Variable()  # dummy
     return func(camloc, raydir, mask_obj)
 
@@ -420,6 +641,7 @@ def main(args):
     max_post_itr = args.max_post_itr
     post_method = args.post_method
     eps = args.eps
+    stats = {}
     st = time.time()
     x_hit, mask_hit, dists, _, _ = ray_trace(sdf_net0, camloc, raydir, test=True,
                                              t_near=t_near, t_far=t_far,
@@ -427,7 +649,10 @@ def main(args):
                                              ray_march_points=ray_march_points,
                                              n_chunks=n_chunks,
                                              max_post_itr=max_post_itr,
-                                             post_method=post_method, eps=eps)
+                                             post_method=post_method, eps=eps,
+                                             compact=args.compact,
+                                             capacity=args.capacity,
+                                             stats=stats)
 
     x_hit.need_grad = False
     dists.need_grad = False
@@ -452,6 +677,12 @@ def main(args):
                 image.d.transpose(1, 2, 0))
     print(
         f"Bidirectional sphere trace/ray march (W={W}, H={H}): {time.time() - st} [s]")
+    if args.compact:
+        print(f"Active rays (forward): {stats['active_rays_forward']}")
+        print(f"Active rays (backward): {stats['active_rays_backward']}")
+        print(f"Ray march rays: {stats['ray_march_rays']}, "
+              f"post method rays: {stats['post_method_rays']}, "
+              f"SDF evaluations: {stats['sdf_evaluations']} (dense: {R * (2 * sphere_trace_itr + ray_march_points + 2 * max_post_itr)})")
 
 
 if __name__ == '__main__':
@@ -473,5 +704,9 @@ if __name__ == '__main__':
     parser.add_argument('--initial-sphere-radius', type=float, default=0.75)
     parser.add_argument('--post-method', type=str, default="bisection")
     parser.add_argument('--fov', type=float, default=90)
+    parser.add_argument('--compact', action='store_true',
+                        help='Evaluate the SDF only on the active rays through a fixed-capacity graph.')
+    parser.add_argument('--capacity', type=int, default=65536,
+                        help='Batch size of the SDF graph for --compact.')
     args = parser.parse_args()
     main(args)
@@ -55,6 +55,8 @@ def main(args):
     monitor = Monitor(monitor_path)
     monitor_loss = MonitorSeries("Training loss", monitor, interval=interval)
     monitor_mhit = MonitorSeries("Hit count", monitor, interval=1)
+    monitor_evals = MonitorSeries("SDF evaluations of ray trace", monitor,
+                                  interval=interval)
     monitor_color_loss = MonitorSeries(
         "Training color loss", monitor, interval=interval)
     monitor_mask_loss = MonitorSeries(
@@ -67,8 +69,9 @@ def main(args):
 
     # Solver
     solver = S.Adam(conf.learning_rate)
+    trace_stats = {}
     loss, color_loss, mask_loss, eikonal_loss, mask_hit = \
-        idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf)
+        idr_loss(camloc, raydir, alpha, color_gt, mask_obj, conf, trace_stats)
     solver.set_parameters(nn.get_parameters())
 
     # Training loop
@@ -106,6 +109,8 @@ def main(args):
             # Monitor
             t = i * di.size + j
             monitor_mhit.add(t, np.sum(mask_hit.d))
+            if "sdf_evaluations" in trace_stats:
+                monitor_evals.add(t, trace_stats["sdf_evaluations"])
             monitor_loss.add(t, loss.d)
             monitor_color_loss.add(t, color_loss.d)
             monitor_mask_loss.add(t, mask_loss.d)
@@ -73,6 +73,8 @@ def get_args(mode="train"):
     parser.add_argument("--grid-size", type=int, default=256,
                         help='Grid size for computing the volume, SDF is computed for the grid-size^3'
                         'The grid is first normalized in [-1, 1], then the volume factor is multiplied.')
+    parser.add_argument('--dense', action="store_true",
+                        help='Evaluate the SDF on every point of the grid instead of the coarse-to-fine evaluation near the surface.')
     parser.add_argument('--mesh-colors', type=float, nargs='+',
                         help='Mesh colors')
     parser.add_argument('--with-normals', action="store_true",
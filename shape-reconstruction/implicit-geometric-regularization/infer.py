@@ -40,9 +40,15 @@ def main(args):
     model = MLP(args.dims, args.ldims, test=True)
 
     # Compute points and values
-    pts, vol = utils.compute_pts_vol(model, args.grid_size, args.volume_factor,
-                                     args.sub_batch_size)
-    mesh = utils.create_mesh_from_volume(vol, args.gradient_direction)
+    if args.dense:
+        pts, vol = utils.compute_pts_vol(model, args.grid_size, args.volume_factor,
+                                         args.sub_batch_size)
+        mesh = utils.create_mesh_from_volume(vol, args.gradient_direction)
+    else:
+        svol = utils.compute_sparse_vol(model, args.grid_size, args.volume_factor,
+                                        args.sub_batch_size)
+        mesh = utils.create_mesh_from_sparse_volume(
+            svol, args.gradient_direction)
 
     # Save as mesh
     dirname, pname = args.model_load_path.split("/")
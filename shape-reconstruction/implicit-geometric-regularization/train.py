@@ -73,8 +73,8 @@ def evaluate(model, pts_true, grid_size, volume_factor, monitor_distances,
              i, save_interval_epoch=1):
     if i % save_interval_epoch != 0:
         return
-    pts, vol = utils.compute_pts_vol(model, grid_size, volume_factor)
-    mesh = utils.create_mesh_from_volume(vol)
+    svol = utils.compute_sparse_vol(model, grid_size, volume_factor)
+    mesh = utils.create_mesh_from_sparse_volume(svol)
     pcd = mesh.sample_points_poisson_disk(len(pts_true), seed=412)
     pts_pred = np.asarray(pcd.points)
     pts_pred = utils.normalize(pts_pred)
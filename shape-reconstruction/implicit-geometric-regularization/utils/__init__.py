@@ -33,6 +33,7 @@ common_utils_path = os.path.abspath(
 sys.path.append(common_utils_path)
 
 from neu.save_args import save_args
+from neu.sdf_extraction import FixedBatchEvaluator, extract_sparse_sdf
 
 
 def normalize(pts):
@@ -80,6 +81,34 @@ def create_mesh_from_volume(volume, gradient_direction="ascent"):
     return mesh
 
 
+def create_mesh_from_sparse_volume(svol, gradient_direction="ascent"):
+    verts, faces, normals = svol.marching_cubes(spacing=(1.0, -1.0, 1.0),
+                                                gradient_direction=gradient_direction)
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(verts)
+    mesh.triangles = o3d.utility.Vector3iVector(faces)
+    mesh.triangle_normals = o3d.utility.Vector3dVector(normals)
+    return mesh
+
+
+def compute_sparse_vol(model, grid_size, volume_factor, sub_batch_size=512):
+    """
+    Coarse-to-fine version of `compute_pts_vol`, which evaluates the SDF only
+    near the zero level set through a graph of a fixed batch size.
+    Returns a sparse volume of the same grid as `compute_pts_vol`.
+    """
+    step = 2.0 * volume_factor / (grid_size - 1)
+    evaluator = FixedBatchEvaluator(model, sub_batch_size)
+
+    def sdf(index):
+        # (y, x, z) order as the volume of meshgrid
+        p = -volume_factor + index[:, [1, 0, 2]].astype(np.float32) * step
+        return evaluator(p.astype(np.float32))
+
+    svol = extract_sparse_sdf(sdf, (grid_size, ) * 3, step)
+    return svol
+
+
 def compute_pts_vol(model, grid_size, volume_factor, sub_batch_size=512):
     x = np.linspace(-volume_factor, volume_factor,
                     grid_size).astype(np.float32)
@@ -19,6 +19,10 @@ import numpy as np
 import scipy.stats as sp
 import time
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import queue
 import nnabla as nn
 import nnabla.functions as F
 import nnabla.parametric_functions as PF
@@ -57,12 +61,38 @@ parser.add_argument('--dataset', type=str,
                     help='select dataset from "SceneFlow" or "Kitti"', default="Kitti")
 parser.add_argument('--nnp', type=str, default='psmnet_kitti.nnp')
 parser.add_argument('--save-nnp', type=bool, default=False)
+parser.add_argument('--cost-volume', type=str, default='concat',
+                    choices=['concat', 'gather'],
+                    help='construction of the cost volume, "gather" builds the same volume with fewer functions')
+parser.add_argument('--tile-height', type=int, default=0,
+                    help='height of the tiles of the full image (0 to run on the cropped image at once)')
+parser.add_argument('--tile-width', type=int, default=0,
+                    help='width of the tiles of the full image (0 to run on the cropped image at once)')
+parser.add_argument('--tile-overlap', type=int, default=32,
+                    help='overlap of the neighboring tiles, in addition to maxdisp columns in width')
+parser.add_argument('--left-dir', type=str, default=None,
+                    help='directory of the left frames of a stereo sequence')
+parser.add_argument('--right-dir', type=str, default=None,
+                    help='directory of the right frames of a stereo sequence, with the same file names as --left-dir')
+parser.add_argument('--left-video', type=str, default=None,
+                    help='left video of a stereo sequence')
+parser.add_argument('--right-video', type=str, default=None,
+                    help='right video of a stereo sequence')
+parser.add_argument('--batch-size', '-b', type=int, default=4,
+                    help='number of stereo pairs in a forward in the sequence mode')
+parser.add_argument('--output-dir', type=str, default='disparity',
+                    help='directory to save the disparity maps in the sequence mode')
+parser.add_argument('--output-format', type=str, default='png',
+                    choices=['png', 'npy'],
+                    help='"png" saves the disparity * 256 as 16-bit PNG (KITTI format), "npy" saves the float disparity')
+parser.add_argument('-c', '--context', type=str, default='cudnn',
+                    help="extension module ('cpu', 'cudnn')")
 args = parser.parse_args()
 
 
 def preprocess_kitti(image_left, image_right):
     w, h = image_left.shape[1], image_left.shape[0]
-    image_l = image_left[h - args.im_heigh_kt:h, w-args.im_width_kt:w, :]
+    image_l = image_left[h - args.im_height_kt:h, w-args.im_width_kt:w, :]
     image_r = image_right[h - args.im_height_kt:h, w-args.im_width_kt:w, :]
     image_l, image_r = preprocess_common(image_l, image_r)
     return image_l, image_r
@@ -91,12 +121,230 @@ def preprocess_common(image_left, image_right):
     return image_left, image_right
 
 
+class TiledDisparity(object):
+    """
+    Disparity of a stereo pair of any size by tiles, with one graph of
+    `tile_height` x `tile_width` reused for all the tiles.
+    A tile is valid from `maxdisp` columns onward, where the right image
+    in the tile covers the whole disparity range, except for the tiles at
+    the left edge of the image. The valid regions of the neighboring tiles
+    overlap by `overlap` pixels and are blended with feathered weights.
+    """
+
+    def __init__(self, tile_height, tile_width, overlap, maxdisp, cost_volume):
+        if tile_height <= overlap or tile_width <= maxdisp + overlap:
+            raise ValueError('Tile size ({}, {}) must be larger than the overlap and maxdisp'.format(
+                tile_height, tile_width))
+        self.tile_height, self.tile_width = tile_height, tile_width
+        self.overlap, self.maxdisp = overlap, maxdisp
+        self.var_left = nn.Variable((1, 3, tile_height, tile_width))
+        self.var_right = nn.Variable((1, 3, tile_height, tile_width))
+        self.pred = psm_net(self.var_left, self.var_right, maxdisp, False,
+                            cost_volume=cost_volume)
+
+    @staticmethod
+    def _ramp(length, start, end, ramp):
+        i = np.arange(length, dtype=np.float32)
+        w = np.minimum(i - start + 0.5, end - i - 0.5) / max(ramp, 1)
+        return np.clip(w, 0, 1)
+
+    @staticmethod
+    def _starts(length, tile, step):
+        starts = list(range(0, max(length - tile, 0) + 1, step))
+        if starts[-1] + tile < length:
+            starts.append(length - tile)
+        return starts
+
+    def __call__(self, img_left, img_right):
+        """
+        img_left, img_right: preprocessed images of shape (3, H, W)
+        return: disparity of shape (H, W)
+        """
+        _, h, w = img_left.shape
+        th, tw = self.tile_height, self.tile_width
+        pad = ((0, 0), (0, max(th - h, 0)), (0, max(tw - w, 0)))
+        img_left = np.pad(img_left, pad, mode='edge')
+        img_right = np.pad(img_right, pad, mode='edge')
+        H, W = img_left.shape[1:]
+
+        disp = np.zeros((H, W), np.float32)
+        weight = np.zeros((H, W), np.float32)
+        weight_h = self._ramp(th, 0, th, self.overlap)
+        for y in self._starts(H, th, th - self.overlap):
+            for x in self._starts(W, tw, tw - self.maxdisp - self.overlap):
+                self.var_left.d = img_left[:, y:y + th, x:x + tw]
+                self.var_right.d = img_right[:, y:y + th, x:x + tw]
+                self.pred.forward(clear_buffer=True)
+                valid = 0 if x == 0 else self.maxdisp
+                weight_w = self._ramp(tw, valid, tw, self.overlap)
+                tile_weight = np.outer(weight_h, weight_w)
+                disp[y:y + th, x:x + tw] += self.pred.d[0, 0] * tile_weight
+                weight[y:y + th, x:x + tw] += tile_weight
+        disp /= weight
+        return disp[:h, :w]
+
+
+def read_stereo_sequence():
+    """
+    Yields the name and the left and right RGB images of each stereo pair
+    of the frame directories or the videos.
+    """
+    if args.left_dir is not None:
+        names = sorted(os.listdir(args.left_dir))
+        missing = [n for n in names
+                   if not os.path.isfile(os.path.join(args.right_dir, n))]
+        if missing:
+            raise ValueError('{} frames of {} are missing in {}, e.g. {}'.format(
+                len(missing), args.left_dir, args.right_dir, missing[0]))
+        for name in names:
+            yield (os.path.splitext(name)[0],
+                   imread(os.path.join(args.left_dir, name), num_channels=3),
+                   imread(os.path.join(args.right_dir, name), num_channels=3))
+        return
+    cap_left = cv2.VideoCapture(args.left_video)
+    cap_right = cv2.VideoCapture(args.right_video)
+    index = 0
+    while True:
+        ret_left, frame_left = cap_left.read()
+        ret_right, frame_right = cap_right.read()
+        if not (ret_left and ret_right):
+            break
+        yield ('{:06d}'.format(index), frame_left[..., ::-1],
+               frame_right[..., ::-1])
+        index += 1
+    cap_left.release()
+    cap_right.release()
+
+
+def prefetch_batches(pairs, preprocess, shape, prefetch=2):
+    """
+    Decodes and preprocesses the stereo pairs into batches of `shape` on a
+    background thread, while the previous batches are processed.
+    Yields the names of the pairs and the left and right batches, where the
+    last batch is padded.
+    """
+    batches = queue.Queue(maxsize=prefetch)
+
+    def worker():
+        try:
+            names = []
+            for name, image_left, image_right in pairs:
+                if not names:
+                    left = np.zeros(shape, np.float32)
+                    right = np.zeros(shape, np.float32)
+                left[len(names)], right[len(names)] = preprocess(
+                    image_left, image_right)
+                names.append(name)
+                if len(names) == shape[0]:
+                    batches.put((names, left, right))
+                    names = []
+            if names:
+                batches.put((names, left, right))
+            batches.put(None)
+        except Exception as e:
+            batches.put(e)
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    while True:
+        batch = batches.get()
+        if batch is None:
+            break
+        if isinstance(batch, Exception):
+            raise batch
+        yield batch
+    thread.join()
+
+
+def save_disparity(path, disp):
+    if path.endswith('.npy'):
+        np.save(path, disp)
+    else:
+        # KITTI format: disparity * 256 in 16 bits
+        if not cv2.imwrite(path, np.clip(disp * 256.0 + 0.5, 0,
+                                         65535).astype(np.uint16)):
+            raise IOError('Failed to write {}'.format(path))
+
+
+def sequence_inference():
+    """
+    Disparity of each stereo pair of a sequence, with `batch_size` pairs in
+    a forward of one graph. The disparity maps are saved while the next
+    batches are processed.
+    """
+    if args.dataset == 'Kitti':
+        shape = (args.batch_size, 3, args.im_height_kt, args.im_width_kt)
+        preprocess = preprocess_kitti
+    elif args.dataset == 'SceneFlow':
+        shape = (args.batch_size, 3, args.im_height_sf, args.im_width_sf)
+        preprocess = preprocess_sceneflow
+    var_left = nn.Variable(shape)
+    var_right = nn.Variable(shape)
+    pred = psm_net(var_left, var_right, args.maxdisp, False,
+                   cost_volume=args.cost_volume)
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+
+    num_pairs = 0
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        saving = deque()
+        for names, left, right in prefetch_batches(read_stereo_sequence(),
+                                                   preprocess, shape):
+            var_left.d, var_right.d = left, right
+            pred.forward(clear_buffer=True)
+            for k, name in enumerate(names):
+                path = os.path.join(args.output_dir,
+                                    name + '.' + args.output_format)
+                saving.append(executor.submit(
+                    save_disparity, path, pred.d[k, 0].copy()))
+            num_pairs += len(names)
+            # Raise the errors of the saves, keeping a batch pending
+            while len(saving) > args.batch_size:
+                saving.popleft().result()
+        for f in saving:
+            f.result()
+    elapsed = time.time() - start
+    print("Processed {} pairs in {:.3f} [s] ({:.2f} pairs/sec)".format(
+        num_pairs, elapsed, num_pairs / max(elapsed, 1e-8)))
+
+
 def main():
-    ctx = get_extension_context('cudnn', device_id=args.gpus)
+    ctx = get_extension_context(args.context, device_id=args.gpus)
     nn.set_default_context(ctx)
+
+    if (args.left_dir is None) != (args.right_dir is None):
+        parser.error('--left-dir and --right-dir must be given together')
+    if (args.left_video is None) != (args.right_video is None):
+        parser.error('--left-video and --right-video must be given together')
+    if args.left_dir is not None or args.left_video is not None:
+        if args.loadmodel is not None:
+            nn.load_parameters(args.loadmodel)
+        sequence_inference()
+        return
+
     image_left = imread(args.left_image)
     image_right = imread(args.right_image)
 
+    if args.loadmodel is not None:
+        # Loading CNN pretrained parameters.
+        nn.load_parameters(args.loadmodel)
+
+    if args.tile_height > 0 and args.tile_width > 0:
+        # Full resolution by tiles
+        img_left, img_right = preprocess_common(image_left, image_right)
+        tiled_disparity = TiledDisparity(args.tile_height, args.tile_width,
+                                         args.tile_overlap, args.maxdisp,
+                                         args.cost_volume)
+        start = time.time()
+        pred = tiled_disparity(img_left, img_right)
+        print("Elapsed time: {:.3f} [s]".format(time.time() - start))
+        pred = 2*(pred - np.min(pred))/np.ptp(pred)-1
+        imsave('stereo_depth.png', (pred + 1) * 0.5)
+        print("Done")
+        return
+
     if args.dataset == 'Kitti':
         var_left = nn.Variable((1, 3, args.im_height_kt, args.im_width_kt))
         var_right = nn.Variable((1, 3, args.im_height_kt, args.im_width_kt))
@@ -107,11 +355,11 @@ def main():
         img_left, img_right = preprocess_sceneflow(image_left, image_right)
 
     var_left.d, var_right.d = img_left, img_right
-    if args.loadmodel is not None:
-        # Loading CNN pretrained parameters.
-        nn.load_parameters(args.loadmodel)
-    pred_test = psm_net(var_left, var_right, args.maxdisp, False)
+    pred_test = psm_net(var_left, var_right, args.maxdisp, False,
+                        cost_volume=args.cost_volume)
+    start = time.time()
     pred_test.forward(clear_buffer=True)
+    print("Elapsed time: {:.3f} [s]".format(time.time() - start))
     pred = pred_test.d
     pred = np.squeeze(pred, axis=1)
     pred = pred[0]
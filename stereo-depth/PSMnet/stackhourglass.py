@@ -207,7 +207,41 @@ def classif3(x, batch_stat):
     return cl3
 
 
-def build_cost_volume(limg, rimg, maxdisp):
+def build_cost_volume_gather(limg, rimg, maxdisp):
+    # The same cost volume as build_cost_volume by a gather of the padded
+    # feature maps, instead of maxdisp/4 padded slices and their stacks
+    batch, channels, height, width = limg.shape
+    disp = int(maxdisp/4)
+    # Padd disp pixels on the left edge
+    # The shape of padded becomes [2C, W + D, B, H]
+    padded = F.concatenate(F.pad(limg, (disp, 0)),
+                           F.pad(rimg, (disp, 0)), axis=1)
+    padded = F.transpose(padded, (1, 3, 0, 2))
+
+    # (channel, width) index of each (channel, disparity, width)
+    d = np.arange(disp).reshape(disp, 1)
+    x = np.arange(width).reshape(1, width)
+    # left[d, x] = limg[x] if x >= d, otherwise zero (padded pixel 0)
+    left_index = np.where(x >= d, x + disp, 0)
+    # right[d, x] = rimg[x - d], which is a padded pixel if x < d
+    right_index = np.broadcast_to(x - d + disp, (disp, width))
+    width_index = np.concatenate([np.broadcast_to(left_index, (channels, disp, width)),
+                                  np.broadcast_to(right_index, (channels, disp, width))])
+    channel_index = np.broadcast_to(
+        np.arange(2 * channels).reshape(-1, 1, 1), width_index.shape)
+    indices = nn.Variable.from_numpy_array(
+        np.stack([channel_index, width_index]))
+
+    cost_volume = F.gather_nd(padded, indices)  # [2C, D, W, B, H]
+    return F.transpose(cost_volume, (3, 0, 1, 4, 2))  # [B, 2C, D, H, W]
+
+
+def build_cost_volume(limg, rimg, maxdisp, mode='concat'):
+    if mode == 'gather':
+        return build_cost_volume_gather(limg, rimg, maxdisp)
+    elif mode != 'concat':
+        raise ValueError(
+            'Cost volume mode must be concat or gather, not {}'.format(mode))
     left_stack = []
     right_stack = []
     for i in range(int(maxdisp/4)):
@@ -233,7 +267,7 @@ def build_cost_volume(limg, rimg, maxdisp):
     return cost_volume
 
 
-def psm_net(left, right, maxdisp, training):
+def psm_net(left, right, maxdisp, training, cost_volume='concat'):
     print(training)
     if training:
         batch_stat = True
@@ -245,7 +279,7 @@ def psm_net(left, right, maxdisp, training):
     targetimg_fea = feature_extraction(right, batch_stat, training)
 
     # matching
-    cost = build_cost_volume(refimg_fea, targetimg_fea, maxdisp)
+    cost = build_cost_volume(refimg_fea, targetimg_fea, maxdisp, cost_volume)
 
     cost0 = dres0(cost, batch_stat)
     cost0 = dres1(cost0, batch_stat) + cost0
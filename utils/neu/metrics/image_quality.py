@@ -0,0 +1,246 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Batched PSNR, SSIM and MS-SSIM of images of shape (N, H, W, C) in numpy.
+
+SSIM uses the 11x11 Gaussian window with the standard deviation of 1.5 and
+the valid region of the filtered images as the MATLAB implementation of
+Zhou Wang (ssim_index.m, msssim.zip). The Gaussian window is separable, so
+the images are filtered by two 1D filters along the height and the width of
+all the images in the batch at once.
+'''
+
+from __future__ import absolute_import
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def _map_batch(fn, num_threads, *imgs):
+    '''
+    Apply `fn` to the images, split into `num_threads` chunks along the
+    batch axis and computed in threads if `num_threads > 1`.
+    '''
+    if num_threads <= 1 or len(imgs[0]) <= 1:
+        return fn(*imgs)
+    chunks = [np.array_split(img, num_threads) for img in imgs]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = list(executor.map(
+            lambda args: fn(*args),
+            [c for c in zip(*chunks) if len(c[0]) > 0]))
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(r) for r in zip(*results))
+    return np.concatenate(results)
+
+
+def _check_images(img1, img2):
+    if img1.shape != img2.shape:
+        raise ValueError('Input images must have the same shape ({} vs. {}).'.format(
+            img1.shape, img2.shape))
+    if img1.ndim != 4:
+        raise ValueError(
+            'Input images must have four dimensions (N, H, W, C), not {}'.format(img1.ndim))
+
+
+def bgr2y(imgs, channel_order='bgr'):
+    '''
+    Y channel of YCbCr (ITU-R BT.601) as `rgb2ycbcr` of MATLAB.
+
+    Args:
+        imgs (np.ndarray): Images of shape (..., 3), uint8 in [0, 255] or
+            float in [0, 1].
+        channel_order (str): 'bgr' or 'rgb'.
+
+    Returns:
+        Y channel of shape (..., 1) in the same range and dtype as `imgs`.
+    '''
+    weights = np.array([24.966, 128.553, 65.481])
+    if channel_order == 'rgb':
+        weights = weights[::-1]
+    elif channel_order != 'bgr':
+        raise ValueError(
+            'channel_order must be bgr or rgb, not {}'.format(channel_order))
+    in_img_type = imgs.dtype
+    scale = 1. if in_img_type == np.uint8 else 255.
+    y = np.dot(imgs.astype(np.float64) * scale, weights) / 255.0 + 16.0
+    if in_img_type == np.uint8:
+        y = y.round()
+    else:
+        y /= 255.
+    return y.astype(in_img_type)[..., np.newaxis]
+
+
+def rgb2y(imgs):
+    return bgr2y(imgs, channel_order='rgb')
+
+
+def psnr(img1, img2, max_val=255.):
+    '''
+    PSNR of each image pair.
+
+    Args:
+        img1, img2 (np.ndarray): Images of shape (N, H, W, C).
+        max_val (float): The dynamic range of the images.
+
+    Returns:
+        np.ndarray of shape (N, ). `inf` for the identical images.
+    '''
+    _check_images(img1, img2)
+    diff = img1.astype(np.float64) - img2.astype(np.float64)
+    mse = np.mean(diff ** 2, axis=(1, 2, 3))
+    with np.errstate(divide='ignore'):
+        return 20 * np.log10(max_val / np.sqrt(mse))
+
+
+def gaussian_kernel(size=11, sigma=1.5):
+    '''
+    1D Gaussian kernel, whose outer product is `fspecial('gaussian')` of
+    MATLAB.
+    '''
+    x = np.arange(size, dtype=np.float64) - (size - 1) / 2.
+    g = np.exp(-x ** 2 / (2.0 * sigma ** 2))
+    return g / g.sum()
+
+
+def _filter_valid(imgs, kernel):
+    '''
+    Valid region of the images filtered by the separable 2D kernel
+    `outer(kernel, kernel)` along the axes 1 and 2.
+    '''
+    size = len(kernel)
+    height = imgs.shape[1] - size + 1
+    width = imgs.shape[2] - size + 1
+    out = kernel[0] * imgs[:, :height]
+    for k in range(1, size):
+        out += kernel[k] * imgs[:, k:k + height]
+    imgs = out
+    out = kernel[0] * imgs[:, :, :width]
+    for k in range(1, size):
+        out += kernel[k] * imgs[:, :, k:k + width]
+    return out
+
+
+def _ssim_and_cs(img1, img2, max_val, filter_size, filter_sigma, k1, k2):
+    img1 = img1.astype(np.float64)
+    img2 = img2.astype(np.float64)
+    _, height, width, _ = img1.shape
+
+    # Filter size can't be larger than height or width of images.
+    size = min(filter_size, height, width)
+    # Scale down sigma if a smaller filter size is used.
+    sigma = size * filter_sigma / filter_size if filter_size else 0
+
+    if filter_size:
+        kernel = gaussian_kernel(size, sigma)
+        mu1 = _filter_valid(img1, kernel)
+        mu2 = _filter_valid(img2, kernel)
+        sigma11 = _filter_valid(img1 * img1, kernel)
+        sigma22 = _filter_valid(img2 * img2, kernel)
+        sigma12 = _filter_valid(img1 * img2, kernel)
+    else:
+        # Empty blur kernel so no need to convolve.
+        mu1, mu2 = img1, img2
+        sigma11 = img1 * img1
+        sigma22 = img2 * img2
+        sigma12 = img1 * img2
+
+    mu11 = mu1 * mu1
+    mu22 = mu2 * mu2
+    mu12 = mu1 * mu2
+    sigma11 -= mu11
+    sigma22 -= mu22
+    sigma12 -= mu12
+
+    c1 = (k1 * max_val) ** 2
+    c2 = (k2 * max_val) ** 2
+    v1 = 2.0 * sigma12 + c2
+    v2 = sigma11 + sigma22 + c2
+    ssim = np.mean((2.0 * mu12 + c1) * v1 / ((mu11 + mu22 + c1) * v2),
+                   axis=(1, 2, 3))
+    cs = np.mean(v1 / v2, axis=(1, 2, 3))
+    return ssim, cs
+
+
+def ssim(img1, img2, max_val=255., filter_size=11, filter_sigma=1.5,
+         k1=0.01, k2=0.03, num_threads=1):
+    '''
+    SSIM of each image pair, averaged over the channels.
+
+    Args:
+        img1, img2 (np.ndarray): Images of shape (N, H, W, C).
+        max_val (float): The dynamic range of the images.
+        filter_size (int): Size of the Gaussian window (reduced for small
+            images).
+        filter_sigma (float): Standard deviation of the Gaussian window.
+        k1, k2 (float): Constants for the stability.
+        num_threads (int): Number of threads to compute the batch.
+
+    Returns:
+        np.ndarray of shape (N, ).
+    '''
+    _check_images(img1, img2)
+
+    def fn(x1, x2):
+        return _ssim_and_cs(x1, x2, max_val, filter_size, filter_sigma,
+                            k1, k2)[0]
+    return _map_batch(fn, num_threads, img1, img2)
+
+
+def _downsample(imgs):
+    # Average of 2x2 pixels, dropping the last row and column of odd sizes
+    _, height, width, _ = imgs.shape
+    imgs = imgs[:, :height // 2 * 2, :width // 2 * 2]
+    return (imgs[:, 0::2, 0::2] + imgs[:, 1::2, 0::2] +
+            imgs[:, 0::2, 1::2] + imgs[:, 1::2, 1::2]) * 0.25
+
+
+def ms_ssim(img1, img2, max_val=255., filter_size=11, filter_sigma=1.5,
+            k1=0.01, k2=0.03, weights=None, num_threads=1):
+    '''
+    MS-SSIM of each image pair, by "Multi-scale structural similarity for
+    image quality assessment" (Wang et al., 2003).
+
+    Args:
+        img1, img2 (np.ndarray): Images of shape (N, H, W, C).
+        weights (list of float): Weights of each level. The five weights of
+            the paper if None.
+        Others are the same as `ssim`.
+
+    Returns:
+        np.ndarray of shape (N, ).
+    '''
+    _check_images(img1, img2)
+    # Note: default weights don't sum to 1.0 but do match the paper / matlab code.
+    weights = np.array(weights if weights else [
+                       0.0448, 0.2856, 0.3001, 0.2363, 0.1333])
+
+    def fn(x1, x2):
+        x1 = x1.astype(np.float64)
+        x2 = x2.astype(np.float64)
+        mssim = []
+        mcs = []
+        for level in range(weights.size):
+            ssim, cs = _ssim_and_cs(x1, x2, max_val, filter_size,
+                                    filter_sigma, k1, k2)
+            mssim.append(ssim)
+            mcs.append(cs)
+            x1, x2 = _downsample(x1), _downsample(x2)
+        # Clip to zero. Otherwise we get NaNs.
+        mssim = np.clip(np.asarray(mssim), 0.0, np.inf)
+        mcs = np.clip(np.asarray(mcs), 0.0, np.inf)
+        return np.prod(mcs[:-1, :] ** weights[:-1, np.newaxis], axis=0) * \
+            (mssim[-1, :] ** weights[-1])
+    return _map_batch(fn, num_threads, img1, img2)
@@ -0,0 +1,216 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Runtime benchmark of the networks exported as NNP files (e.g. by
+`neu.save_nnp` or `--save-nnp` of the examples), loaded by
+`nnabla.utils.nnp_graph`. The latency percentiles, the throughput and the
+peak memory at each batch size are saved as a JSON report, and two reports
+can be compared to find performance regressions.
+'''
+
+import json
+import resource
+import sys
+import time
+
+import numpy as np
+import nnabla as nn
+import nnabla.functions as F
+
+
+def peak_rss_mb():
+    '''
+    Peak resident set size of this process in MB, since the process started.
+    '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux.
+    return rss / 2.0 ** 20 if sys.platform == 'darwin' else rss / 2.0 ** 10
+
+
+def latency_stats(times):
+    '''
+    Statistics of the latencies in seconds, in milliseconds.
+    '''
+    ms = np.asarray(times) * 1000
+    return {'mean': float(ms.mean()), 'min': float(ms.min()),
+            'max': float(ms.max()), 'p50': float(np.percentile(ms, 50)),
+            'p90': float(np.percentile(ms, 90)),
+            'p99': float(np.percentile(ms, 99))}
+
+
+def _benchmark_batch(nnp_file, network_name, batch_size, warmup, iterations,
+                     ext_name, device_id, seed):
+    from nnabla.utils.nnp_graph import NnpLoader
+    from nnabla.ext_utils import get_extension_context, import_extension_module
+    nn.set_default_context(get_extension_context(ext_name, device_id=device_id))
+    ext = import_extension_module(ext_name)
+
+    def synchronize():
+        if hasattr(ext, 'synchronize'):
+            ext.synchronize(device_id=device_id)
+
+    nnp = NnpLoader(nnp_file)
+    if network_name is None:
+        network_name = nnp.get_network_names()[0]
+    rng = np.random.RandomState(seed)
+    with nn.auto_forward(False):
+        net = nnp.get_network(network_name, batch_size=batch_size)
+        outputs = list(net.outputs.values())
+        y = outputs[0] if len(outputs) == 1 else F.sink(*outputs)
+    for x in net.inputs.values():
+        x.d = rng.randn(*x.shape)
+
+    for _ in range(warmup):
+        y.forward(clear_buffer=True)
+    synchronize()
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        y.forward(clear_buffer=True)
+        synchronize()
+        times.append(time.perf_counter() - start)
+
+    latency = latency_stats(times)
+    return network_name, {
+        'batch_size': batch_size,
+        'latency_ms': latency,
+        'throughput': batch_size * 1000 / latency['mean'],
+        'peak_rss_mb': peak_rss_mb()}
+
+
+def benchmark(nnp_file, network_name=None, batch_sizes=(1, ), warmup=5,
+              iterations=50, ext_name='cpu', device_id='0', seed=0):
+    '''
+    Latency, throughput and peak RSS of a network of an NNP file at each
+    batch size. The inputs are random normal values.
+
+    Each batch size is measured in a new process, so that `peak_rss_mb` is
+    the peak of loading the NNP file and running the network at the batch
+    size only, regardless of the other batch sizes and their order.
+
+    Args:
+        nnp_file (str): Path to the NNP file.
+        network_name (str): Name of the network. The first network of the
+            file if None.
+        batch_sizes (list of int): Batch sizes to build the network with.
+        warmup (int): Number of forwards before the measurement.
+        iterations (int): Number of the timed forwards.
+        ext_name (str), device_id (str): Context of the forwards.
+
+    Returns:
+        dict of the report.
+    '''
+    import multiprocessing
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for batch_size in batch_sizes:
+        with ctx.Pool(1) as pool:
+            network_name, result = pool.apply(
+                _benchmark_batch, (nnp_file, network_name, batch_size, warmup,
+                                   iterations, ext_name, device_id, seed))
+        results.append(result)
+    return {'nnp': nnp_file, 'network': network_name,
+            'context': ext_name, 'nnabla_version': nn.__version__,
+            'warmup': warmup, 'iterations': iterations, 'results': results}
+
+
+def compare(base, new, metric='p50', tolerance=0.05):
+    '''
+    Compare the latencies of two reports at their common batch sizes.
+
+    Args:
+        base, new (dict): Reports returned by `benchmark`.
+        metric (str): Latency statistic to compare, e.g. 'p50' or 'p99'.
+        tolerance (float): Relative slowdown regarded as a regression.
+
+    Returns:
+        list of dict of each batch size with the latencies, the ratio
+        new / base and whether it is a regression.
+    '''
+    base_results = {r['batch_size']: r for r in base['results']}
+    rows = []
+    for r in new['results']:
+        b = base_results.get(r['batch_size'])
+        if b is None:
+            continue
+        ratio = r['latency_ms'][metric] / b['latency_ms'][metric]
+        rows.append({'batch_size': r['batch_size'],
+                     'base_ms': b['latency_ms'][metric],
+                     'new_ms': r['latency_ms'][metric],
+                     'ratio': ratio,
+                     'base_rss_mb': b['peak_rss_mb'],
+                     'new_rss_mb': r['peak_rss_mb'],
+                     'regression': ratio > 1 + tolerance})
+    return rows
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the networks of NNP files.')
+    parser.add_argument('nnp', nargs='?', default=None,
+                        help='NNP file to benchmark.')
+    parser.add_argument('--network', default=None,
+                        help='Network name. The first network if not given.')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1])
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--context', '-c', default='cpu')
+    parser.add_argument('--device-id', '-d', default='0')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Path to save the JSON report.')
+    parser.add_argument('--compare', nargs=2, default=None,
+                        metavar=('BASE', 'NEW'),
+                        help='Compare two JSON reports instead of running a benchmark.')
+    parser.add_argument('--metric', default='p50',
+                        help='Latency statistic to compare.')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Relative slowdown regarded as a regression.')
+    args = parser.parse_args()
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path) as f:
+                reports.append(json.load(f))
+        rows = compare(reports[0], reports[1], args.metric, args.tolerance)
+        print(f'{"batch":>6s} {"base ms":>10s} {"new ms":>10s} {"ratio":>7s} '
+              f'{"base MB":>9s} {"new MB":>9s}')
+        for row in rows:
+            print(f'{row["batch_size"]:6d} {row["base_ms"]:10.3f} '
+                  f'{row["new_ms"]:10.3f} {row["ratio"]:7.3f} '
+                  f'{row["base_rss_mb"]:9.1f} {row["new_rss_mb"]:9.1f}'
+                  f'{"  REGRESSION" if row["regression"] else ""}')
+        if any(row['regression'] for row in rows):
+            sys.exit(1)
+        return
+
+    if args.nnp is None:
+        parser.error('nnp is required unless --compare is given')
+    report = benchmark(args.nnp, args.network, args.batch_sizes, args.warmup,
+                       args.iterations, args.context, args.device_id)
+    for r in report['results']:
+        latency = r['latency_ms']
+        print(f'batch {r["batch_size"]:4d}: p50 {latency["p50"]:.3f} ms, '
+              f'p90 {latency["p90"]:.3f} ms, p99 {latency["p99"]:.3f} ms, '
+              f'{r["throughput"]:.1f} samples/sec, '
+              f'peak RSS {r["peak_rss_mb"]:.1f} MB')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+A group of parameters packed into one flat buffer, so that exponential
+moving average (EMA), copies and checkpointing of many parameters run as a
+few vectorized functions instead of functions per parameter.
+'''
+
+from collections import OrderedDict
+
+import numpy as np
+import nnabla as nn
+import nnabla.functions as F
+
+
+class ParameterGroup(object):
+    '''
+    Parameters packed into a flat buffer Variable on the device.
+
+    `flat` is the graph concatenating the current values of the parameters,
+    and `buffer` is a Variable of the same size holding the packed values.
+    `pack()` copies the parameters into the buffer and `unpack()` copies the
+    buffer back into the parameters. The buffer can be updated as a whole,
+    e.g. by `ema_update()`, and the parameters are materialized by
+    `unpack()` only when they are used.
+
+    Args:
+        params (dict): Parameters (name to Variable), e.g. returned by
+            `nn.get_parameters(grad_only=False)`. The order of the dict is
+            the order in the buffer.
+    '''
+
+    def __init__(self, params):
+        self.params = OrderedDict(params)
+        self.shapes = [v.shape for v in self.params.values()]
+        sizes = [int(np.prod(s)) for s in self.shapes]
+        self.offsets = np.cumsum([0] + sizes)
+
+        with nn.auto_forward(False):
+            self.buffer = nn.Variable((int(self.offsets[-1]), ),
+                                      need_grad=False)
+            self.flat = F.concatenate(*[F.reshape(v, (-1, ), inplace=False)
+                                        for v in self.params.values()], axis=0)
+            self._pack = F.assign(self.buffer, self.flat)
+            unpack = []
+            for v, start, stop in zip(self.params.values(),
+                                      self.offsets[:-1], self.offsets[1:]):
+                value = F.slice(self.buffer, (int(start), ), (int(stop), ))
+                unpack.append(F.assign(v, F.reshape(value, v.shape)))
+            self._unpack = F.sink(*unpack)
+        self._copy = {}
+
+    def __len__(self):
+        return len(self.params)
+
+    @property
+    def size(self):
+        return int(self.offsets[-1])
+
+    def _check_compatible(self, other):
+        if self.shapes != other.shapes:
+            raise ValueError(
+                'Parameter groups of different shapes: {} and {} parameters'.format(
+                    len(self), len(other)))
+
+    def pack(self):
+        self._pack.forward(clear_buffer=True)
+
+    def unpack(self):
+        self._unpack.forward(clear_buffer=True)
+
+    def copy_from(self, other):
+        '''
+        Copy the parameters of `other` into the buffer and the parameters of
+        this group.
+        '''
+        self._check_compatible(other)
+        if id(other) not in self._copy:
+            with nn.auto_forward(False):
+                self._copy[id(other)] = F.assign(self.buffer, other.flat)
+        self._copy[id(other)].forward(clear_buffer=True)
+        self.unpack()
+
+    def ema_update(self, other, decay):
+        '''
+        Returns the graph updating the buffer by the EMA of the parameters of
+        `other` as `buffer = decay * buffer + (1 - decay) * other`.
+        Call `unpack()` to get the updated values in the parameters.
+
+        Only this group is updated in its buffer. The parameters of `other`
+        are concatenated by `other.flat` on every forward of the graph, i.e.
+        a reshape per parameter and a copy of all of them each step.
+        '''
+        self._check_compatible(other)
+        with nn.auto_forward(False):
+            updated = decay * self.buffer + (1.0 - decay) * other.flat
+            return F.assign(self.buffer, updated)
+
+    def save(self, path):
+        '''
+        Save the buffer values as the parameters, in the same format as
+        `nn.save_parameters`.
+        '''
+        self.unpack()
+        nn.save_parameters(path, self.params)
+
+
+def benchmark(num_params=300, size=65536, decay=0.999, iterations=100,
+              ext_name='cpu', device_id='0'):
+    '''
+    Compare the time per EMA update of one `F.assign` per parameter with
+    the update of the flat buffer of a `ParameterGroup`.
+    '''
+    import time
+    from nnabla.ext_utils import get_extension_context, import_extension_module
+    nn.set_default_context(get_extension_context(ext_name, device_id=device_id))
+    ext = import_extension_module(ext_name)
+
+    def synchronize():
+        if hasattr(ext, 'synchronize'):
+            ext.synchronize(device_id=device_id)
+
+    rng = np.random.RandomState(0)
+    params = OrderedDict((f'p{i}', nn.Variable.from_numpy_array(
+        rng.randn(size).astype(np.float32))) for i in range(num_params))
+    ema_params = OrderedDict((f'p{i}', nn.Variable.from_numpy_array(
+        rng.randn(size).astype(np.float32))) for i in range(num_params))
+
+    with nn.auto_forward(False):
+        per_param = F.sink(*[F.assign(ema_params[k], decay * ema_params[k] +
+                                      (1.0 - decay) * params[k]) for k in params])
+    group = ParameterGroup(params)
+    ema_group = ParameterGroup(ema_params)
+    ema_group.copy_from(group)
+    fused = ema_group.ema_update(group, decay)
+
+    times = {}
+    for name, updater in [('per-parameter', per_param), ('flat buffer', fused)]:
+        updater.forward(clear_buffer=True)
+        synchronize()
+        start = time.time()
+        for _ in range(iterations):
+            updater.forward(clear_buffer=True)
+        synchronize()
+        times[name] = (time.time() - start) / iterations
+    return times
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the EMA update of a ParameterGroup.')
+    parser.add_argument('--num-params', type=int, default=300)
+    parser.add_argument('--size', type=int, default=65536,
+                        help='Number of elements per parameter.')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--context', '-c', default='cpu')
+    parser.add_argument('--device-id', '-d', default='0')
+    args = parser.parse_args()
+    times = benchmark(args.num_params, args.size, iterations=args.iterations,
+                      ext_name=args.context, device_id=args.device_id)
+    for name, t in times.items():
+        print(f'{name:14s}: {t * 1000:.3f} ms / update')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''
+Coarse-to-fine (narrow-band) extraction of the zero level set of a signed
+distance function on a regular grid.
+
+The SDF is evaluated on a coarse grid first, and only the cells near the
+zero level set are subdivided and evaluated at the next finer level, so that
+the number of evaluations grows with the surface area instead of the volume.
+The result is a sparse volume of blocks around the surface, which is
+converted to a mesh by marching cubes block by block.
+'''
+
+import numpy as np
+import nnabla as nn
+from nnabla.logger import logger
+
+
+_CORNERS = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)],
+                    dtype=np.int64)
+
+
+class FixedBatchEvaluator(object):
+    '''
+    Evaluates a function of points through one graph of a fixed batch size.
+
+    Args:
+        fn (callable): Function building the graph of values from points
+            of shape (batch_size, dim).
+        batch_size (int): Number of points evaluated at once.
+        dim (int): Dimension of points.
+    '''
+
+    def __init__(self, fn, batch_size, dim=3):
+        self.batch_size = batch_size
+        with nn.auto_forward(False):
+            self.x = nn.Variable((batch_size, dim))
+            self.y = fn(self.x)
+        self.num_evaluations = 0
+
+    def __call__(self, points):
+        values = np.empty(len(points), dtype=np.float32)
+        for b in range(0, len(points), self.batch_size):
+            p = points[b:b + self.batch_size]
+            n = len(p)
+            if n < self.batch_size:
+                p = np.concatenate(
+                    [p, np.zeros((self.batch_size - n, p.shape[1]), dtype=p.dtype)])
+            self.x.d = p
+            self.y.forward(clear_buffer=True)
+            values[b:b + n] = self.y.d.reshape(-1)[:n]
+        self.num_evaluations += len(points)
+        return values
+
+
+def _upsample(lattice):
+    '''
+    Double the resolution of a lattice of node values by trilinear
+    interpolation, i.e. (m + 1)^3 nodes to (2m + 1)^3 nodes.
+    '''
+    for axis in range(3):
+        lattice = np.moveaxis(lattice, axis, 0)
+        out = np.empty((2 * lattice.shape[0] - 1, ) +
+                       lattice.shape[1:], dtype=lattice.dtype)
+        out[0::2] = lattice
+        out[1::2] = 0.5 * (lattice[:-1] + lattice[1:])
+        lattice = np.moveaxis(out, 0, axis)
+    return lattice
+
+
+class SparseVolume(object):
+    '''
+    Values of an SDF on blocks of a grid of `shape` nodes near the surface.
+
+    `blocks` maps the block index (of `block_size` cells per axis) to the
+    node values of the block, of shape up to (block_size + 1)^3 (smaller at
+    the end of the grid). Nodes which are not evaluated hold values
+    interpolated from the coarser levels, whose signs are consistent with
+    the evaluated nodes.
+    '''
+
+    def __init__(self, shape, block_size):
+        self.shape = tuple(shape)
+        self.block_size = block_size
+        self.blocks = {}
+
+    def to_dense(self, fill_value=np.nan):
+        vol = np.full(self.shape, fill_value, dtype=np.float32)
+        for index, values in self.blocks.items():
+            o = [i * self.block_size for i in index]
+            vol[o[0]:o[0] + values.shape[0],
+                o[1]:o[1] + values.shape[1],
+                o[2]:o[2] + values.shape[2]] = values
+        return vol
+
+    def marching_cubes(self, spacing=(1.0, 1.0, 1.0), gradient_direction='descent'):
+        '''
+        Marching cubes on every block, whose vertices on the block borders
+        are merged.
+
+        Returns:
+            (verts, faces, normals) in the same coordinates as
+            `skimage.measure.marching_cubes_lewiner` on the dense volume.
+        '''
+        from skimage import measure
+        spacing = np.asarray(spacing, dtype=np.float64)
+        verts, faces, normals = [], [], []
+        num_verts = 0
+        for index, values in sorted(self.blocks.items()):
+            if min(values.shape) < 2 or not (values.min() < 0 < values.max()):
+                continue
+            v, f, n, _ = measure.marching_cubes_lewiner(
+                values, 0.0, spacing=tuple(spacing), gradient_direction=gradient_direction)
+            offset = np.asarray(index) * self.block_size * spacing
+            verts.append(v + offset)
+            faces.append(f + num_verts)
+            normals.append(n)
+            num_verts += len(v)
+        if num_verts == 0:
+            return (np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64),
+                    np.zeros((0, 3)))
+        verts = np.concatenate(verts)
+        faces = np.concatenate(faces)
+        normals = np.concatenate(normals)
+
+        # merge vertices on the borders of blocks
+        keys = np.round(verts / np.abs(spacing) * 1e4).astype(np.int64)
+        _, first, inverse = np.unique(
+            keys, axis=0, return_index=True, return_inverse=True)
+        return verts[first], inverse.reshape(-1)[faces], normals[first]
+
+
+def extract_sparse_sdf(sdf, shape, step, coarse_size=32, band=1.5, block_size=32):
+    '''
+    Coarse-to-fine evaluation of an SDF on a grid.
+
+    Args:
+        sdf (callable): Function returning SDF values of shape (N, ) from
+            integer grid indices of shape (N, 3). Indices can exceed
+            `shape` by up to the coarse cell size.
+        shape (tuple of int): Number of grid nodes per axis.
+        step (float): Distance between neighboring grid nodes, used for
+            the narrow band.
+        coarse_size (int): Approximate number of cells per axis of the
+            coarsest level.
+        band (float): A cell is refined if the absolute SDF value at one of
+            its corners is less than `band` times the cell diagonal.
+        block_size (int): Number of cells per axis of a block of the sparse
+            volume. Rounded up to a multiple of the coarse cell size.
+
+    Returns:
+        SparseVolume
+    '''
+    shape = np.asarray(shape, dtype=np.int64)
+    num_levels = max(
+        int(np.ceil(np.log2(max(shape.max() - 1, 1) / coarse_size))), 0)
+    stride = 2 ** num_levels
+    block_size = int(np.ceil(block_size / stride)) * stride
+    num_cells = -(-(shape - 1) // stride)
+
+    known_keys = np.zeros(0, dtype=np.int64)
+    known_values = np.zeros(0, dtype=np.float32)
+    # the key of a node is its linear index in the padded grid
+    dims = num_cells * stride + 1
+
+    def to_keys(nodes):
+        return (nodes[:, 0] * dims[1] + nodes[:, 1]) * dims[2] + nodes[:, 2]
+
+    def lookup(keys):
+        pos = np.searchsorted(known_keys, keys)
+        pos = np.minimum(pos, len(known_keys) - 1)
+        found = known_keys[pos] == keys
+        return pos, found
+
+    cells = np.stack(np.meshgrid(*[np.arange(n) for n in num_cells],
+                                 indexing='ij'), axis=-1).reshape(-1, 3)
+    level_strides = []
+    while True:
+        # evaluate the corners of the cells
+        corners = (cells[:, None, :] + _CORNERS[None]) * stride
+        corner_keys = to_keys(corners.reshape(-1, 3))
+        new_keys, new_index = np.unique(corner_keys, return_index=True)
+        if len(known_keys) > 0:
+            _, found = lookup(new_keys)
+            new_keys, new_index = new_keys[~found], new_index[~found]
+        new_values = sdf(corners.reshape(-1, 3)[new_index])
+        keys = np.concatenate([known_keys, new_keys])
+        order = np.argsort(keys, kind='stable')
+        known_keys = keys[order]
+        known_values = np.concatenate([known_values, new_values])[order]
+        level_strides.append(stride)
+
+        # refine cells near the zero level set
+        pos, _ = lookup(corner_keys)
+        values = known_values[pos].reshape(-1, 8)
+        diagonal = np.sqrt(3) * stride * step
+        near = (np.abs(values).min(axis=1) < band * diagonal) | \
+            ((values.min(axis=1) < 0) & (values.max(axis=1) > 0))
+        cells = cells[near]
+        logger.info(
+            f'SDF extraction: stride {stride}, {near.sum()} / {len(near)} cells near the surface')
+        if stride == 1 or len(cells) == 0:
+            break
+        cells = (cells[:, None, :] * 2 + _CORNERS[None]).reshape(-1, 3)
+        stride //= 2
+
+    # fill blocks containing surface cells from the coarsest level down to
+    # the finest one, where nodes not evaluated are interpolated
+    volume = SparseVolume(shape, block_size)
+    if stride != 1:
+        return volume
+    block_indices = np.unique(cells // block_size, axis=0)
+    for index in block_indices:
+        origin = index * block_size
+        lattice = None
+        for s in level_strides:
+            m = block_size // s
+            grid = np.stack(np.meshgrid(*[np.arange(m + 1)] * 3, indexing='ij'),
+                            axis=-1).reshape(-1, 3)
+            nodes = origin + grid * s
+            lattice = np.zeros((m + 1, ) * 3, dtype=np.float32) \
+                if lattice is None else _upsample(lattice)
+            inside = np.all(nodes < dims, axis=1)
+            pos, found = lookup(to_keys(np.minimum(nodes, dims - 1)))
+            found &= inside
+            lattice[tuple(grid[found].T)] = known_values[pos[found]]
+        end = np.minimum(origin + block_size + 1, shape) - origin
+        volume.blocks[tuple(index)] = lattice[:end[0], :end[1], :end[2]].copy()
+    logger.info(
+        f'SDF extraction: {len(known_keys)} evaluations, {len(volume.blocks)} blocks')
+    return volume
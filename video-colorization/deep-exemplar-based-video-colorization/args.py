@@ -72,6 +72,11 @@ def get_config():
         type=str,
         default="video.avi",
         help="Video output in *.avi for example, video.avi")
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="number of threads to decode and save the frames during inference")
     parser.add_argument(
         "--checkpoint",
         type=str,
@@ -86,6 +91,7 @@ def get_config():
     conf.data.output_path = args.output_path
     conf.data.output_video = args.output_video
     conf.data.frame_propagation = args.frame_propagation
+    conf.data.num_workers = args.num_workers
     conf.nnabla_context.context = args.context
     conf.nnabla_context.device_id: args.device_id
     conf.checkpoint.path: args.checkpoint
@@ -15,6 +15,8 @@
 import os
 import time
 import cv2
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import nnabla as nn
@@ -64,25 +66,11 @@ def interpolate(image, scale):
     return image
 
 
-def interpolate_nn(image, frame, scale):
-    '''
-    Linear Interpolation on Variable image and frame
-    Args:
-        image  : image (Variable) 
-        frame  : frame (Variable) 
-    Returns
-        linear interpolated image and frame 
-    '''
-    image = F.interpolate(image, scale)
-    frame = F.interpolate(frame, scale)
-    return image, frame
-
-
-def get_rgb_frame(ia_lab_large, i_current_ab_predict_nn, conf):
+def get_rgb_frame(ia_lab_large, i_current_ab_predict, conf):
 
     curr_bs_l = ia_lab_large[:, 0:1, :, :]
     curr_predict = interpolate(
-        i_current_ab_predict_nn.data.data,
+        i_current_ab_predict,
         scale=2) * 1.25
     if conf.wls_filter_on:
         guide_image = preprocess.uncenter_l(curr_bs_l, conf) * 255 / 100
@@ -106,87 +94,182 @@ def get_rgb_frame(ia_lab_large, i_current_ab_predict_nn, conf):
     return ia_predict_rgb
 
 
-def colorize_video(conf, ref):
+def load_weights(conf):
+    nn.load_parameters(f'{conf.checkpoint.path}/{conf.checkpoint.vgg19}')
+    nn.load_parameters(
+        f'{conf.checkpoint.path}/{conf.checkpoint.non_local}')
+    nn.load_parameters(
+        f'{conf.checkpoint.path}/{conf.checkpoint.colornet}')
+
+
+def list_frames(input_path):
+    filenames = [f for f in os.listdir(input_path)
+                 if os.path.isfile(os.path.join(input_path, f))]
+    # sort the frames in order as in video
+    filenames.sort(key=lambda f: int("".join(filter(str.isdigit, f) or -1)))
+    return filenames
+
+
+def load_frame(path, image_size):
+    return transform(np.array(Image.open(path)), image_size)
+
+
+class ColorizationEngine(object):
+    '''
+    Colorize frames with the graphs built once for the given image size.
+
+    The VGG features of each reference are computed once by `add_reference`
+    and kept on the device together with the last prediction of the
+    reference, which is updated in the frame graph by `F.assign`.
+    The frame graph is shared by all the references by binding the arrays
+    of a reference to its input Variables before the forward.
+    Args:
+        conf: conf object
+    '''
+
+    def __init__(self, conf):
+        self.conf = conf
+        height, width = conf.data.image_size
+        with nn.auto_forward(False):
+            # Reference graph
+            self.ib_lab_large = nn.Variable((1, 3, height, width))
+            ib_lab = F.interpolate(self.ib_lab_large, scale=(0.5, 0.5))
+            i_reference_rgb = preprocess.lab2rgb(
+                F.concatenate(
+                    preprocess.uncenter_l(ib_lab[:, 0:1, :, :], conf),
+                    ib_lab[:, 1:3, :, :],
+                    axis=1))
+            features_b = vgg_net(i_reference_rgb, pre_process=True, fix=True)
+            self.reference_outputs = [ib_lab] + features_b
+            for v in self.reference_outputs:
+                v.persistent = True
+
+            # Frame graph
+            self.ia_lab_large = nn.Variable((1, 3, height, width))
+            ia_lab = F.interpolate(self.ia_lab_large, scale=(0.5, 0.5))
+            ia_l = ia_lab[:, 0:1, :, :]
+            self.ib_lab = nn.Variable(ib_lab.shape)
+            self.features_b = [nn.Variable(f.shape) for f in features_b]
+            self.i_last_lab_predict = nn.Variable(ia_lab.shape)
+            self.i_current_ab_predict, _i_current_nonlocal_lab, _features_gray = frame_colorization(
+                ia_lab, self.ib_lab, self.i_last_lab_predict,
+                self.features_b, feature_noise=0, temperature=1e-10)
+            self.i_current_ab_predict.persistent = True
+            # keep the temporal state on the device
+            update_last = F.assign(self.i_last_lab_predict, F.concatenate(
+                ia_l, self.i_current_ab_predict, axis=1))
+            self.frame_output = F.sink(update_last, self.i_current_ab_predict)
+        self.references = []
+
+    def add_reference(self, ib_lab_large):
+        '''
+        Compute the features of a reference image and initialize its
+        temporal state.
+        Args:
+            ib_lab_large: transformed reference image (numpy)
+        Returns:
+            index of the reference
+        '''
+        self.ib_lab_large.d = ib_lab_large
+        nn.forward_all(self.reference_outputs, clear_buffer=True)
+        ib_lab, *features_b = [F.identity(v.data)
+                               for v in self.reference_outputs]
+        if self.conf.data.frame_propagation:
+            i_last_lab_predict = F.identity(ib_lab)
+        else:
+            i_last_lab_predict = nn.NdArray(self.i_last_lab_predict.shape)
+            i_last_lab_predict.zero()
+        self.references.append((ib_lab, features_b, i_last_lab_predict))
+        return len(self.references) - 1
+
+    def colorize(self, ia_lab_large, ref_index):
+        '''
+        Colorize a frame with a reference and update the temporal state of
+        the reference.
+        Args:
+            ia_lab_large: transformed frame (numpy)
+            ref_index: index returned by `add_reference`
+        Returns:
+            predicted ab channels (numpy)
+        '''
+        ib_lab, features_b, i_last_lab_predict = self.references[ref_index]
+        self.ib_lab.data = ib_lab
+        for v, f in zip(self.features_b, features_b):
+            v.data = f
+        self.i_last_lab_predict.data = i_last_lab_predict
+        self.ia_lab_large.d = ia_lab_large
+        self.frame_output.forward(clear_buffer=True)
+        return self.i_current_ab_predict.d.copy()
+
+
+def save_rgb_frame(ia_lab_large, i_current_ab_predict, conf, output_path, index):
+    rgb_frame = get_rgb_frame(ia_lab_large, i_current_ab_predict, conf)
+    preprocess.save_frames(rgb_frame, output_path, index)
+
+
+def colorize_video(conf, refs):
     '''
-    Colorize the input frames and save the output as colorized frames and video
+    Colorize the input frames with each reference image in one pass over the
+    frames, and save the outputs as colorized frames and videos
     Args:
         conf: conf object
-        ref: refrence image
+        refs: refrence images
     '''
-    def load_weights():
-        nn.load_parameters(f'{conf.checkpoint.path}/{conf.checkpoint.vgg19}')
-        nn.load_parameters(
-            f'{conf.checkpoint.path}/{conf.checkpoint.non_local}')
-        nn.load_parameters(
-            f'{conf.checkpoint.path}/{conf.checkpoint.colornet}')
-
-    reference_file = os.path.join(conf.data.ref_path, ref)
-    output_path = os.path.join(
-        conf.data.output_path, 'out_' + ref.split(".")[0])
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-    filenames = [f for f in os.listdir(conf.data.input_path)
-                 if os.path.isfile(os.path.join(conf.data.input_path, f))]
+    filenames = list_frames(conf.data.input_path)
     print(f"processing the folder: {conf.data.input_path}")
-    # sort the frames in order as in video
-    filenames.sort(key=lambda f: int("".join(filter(str.isdigit, f) or -1)))
-    # read reference name from reference input else first frame assuming it's
-    # colorized
-    ref_name = conf.data.input_path + \
-        filenames[0] if conf.data.frame_propagation else reference_file
-    i_last_lab_predict = None
+
     # Load the Weights
     nn.clear_parameters()
-    load_weights()
-    print(f"reference = {ref_name}")
-    # Preprocess reference image
-    frame_ref = np.array(Image.open(ref_name))
-    ib_lab_large = nn.Variable.from_numpy_array(
-        transform(frame_ref, conf.data.image_size))
-    for iter_num, frame_name in enumerate(filenames):
-        print("input =", frame_name)
-        frame = Image.open(os.path.join(conf.data.input_path, frame_name))
-        ia_lab_large = nn.Variable.from_numpy_array(
-            transform(np.array(frame), conf.data.image_size))
-        ia_lab, ib_lab = interpolate_nn(
-            ia_lab_large, ib_lab_large, scale=(0.5, 0.5))
-        ia_l = ia_lab[:, 0:1, :, :]
-        if i_last_lab_predict is None:
-            if conf.data.frame_propagation:
-                i_last_lab_predict = ib_lab
-            else:
-                i_last_lab_predict = nn.Variable(ia_lab.shape)
-        i_reference_l = ib_lab[:, 0:1, :, :]
-        i_reference_ab = ib_lab[:, 1:3, :, :]
-        i_reference_rgb = preprocess.lab2rgb(
-            F.concatenate(
-                preprocess.uncenter_l(i_reference_l, conf),
-                i_reference_ab,
-                axis=1))
-        if type(i_last_lab_predict).__module__ == "numpy":
-            i_last_lab_predict_nn = nn.Variable.from_numpy_array(
-                i_last_lab_predict)
-        else:
-            i_last_lab_predict_nn = i_last_lab_predict
-        t_start = time.time()
-        features_b_nn = vgg_net(i_reference_rgb, pre_process=True, fix=True)
-        i_current_ab_predict, _i_current_nonlocal_lab, _features_gray = frame_colorization(
-            ia_lab, ib_lab, i_last_lab_predict_nn,
-            features_b_nn, feature_noise=0, temperature=1e-10)
-        # forward the network
-        nn.forward_all([i_current_ab_predict])
-        i_last_lab_predict = np.concatenate(
-            (ia_l.data.data, i_current_ab_predict.data.data), axis=1)
-        print(f"Runtime: {time.time() - t_start:.2g} second")
-        rgb_frame = get_rgb_frame(ia_lab_large.d, i_current_ab_predict, conf)
-        preprocess.save_frames(rgb_frame, output_path, iter_num)
-        iter_num = iter_num + 1
-    # save the video
-    preprocess.frames2vid(
-        frame_folder=output_path,
-        frame_shape=conf.data.image_size,
-        output_dir=output_path,
-        filename=conf.data.output_video)
+    load_weights(conf)
+    engine = ColorizationEngine(conf)
+
+    output_paths = []
+    for ref in refs:
+        # read reference name from reference input else first frame assuming
+        # it's colorized
+        ref_name = os.path.join(conf.data.input_path, filenames[0]) \
+            if conf.data.frame_propagation else os.path.join(conf.data.ref_path, ref)
+        print(f"reference = {ref_name}")
+        engine.add_reference(load_frame(ref_name, conf.data.image_size))
+        output_path = os.path.join(
+            conf.data.output_path, 'out_' + ref.split(".")[0])
+        if not os.path.exists(output_path):
+            os.makedirs(output_path)
+        output_paths.append(output_path)
+
+    # Decode the next frame and save the outputs while computing
+    num_workers = max(conf.data.num_workers, 1)
+    with ThreadPoolExecutor(max_workers=num_workers + 1) as executor:
+        frame_paths = [os.path.join(conf.data.input_path, f)
+                       for f in filenames]
+        next_frame = executor.submit(
+            load_frame, frame_paths[0], conf.data.image_size)
+        saving = deque()
+        for iter_num, frame_name in enumerate(filenames):
+            print("input =", frame_name)
+            ia_lab_large = next_frame.result()
+            if iter_num + 1 < len(frame_paths):
+                next_frame = executor.submit(
+                    load_frame, frame_paths[iter_num + 1], conf.data.image_size)
+            t_start = time.time()
+            for ref_index, output_path in enumerate(output_paths):
+                i_current_ab_predict = engine.colorize(ia_lab_large, ref_index)
+                saving.append(executor.submit(
+                    save_rgb_frame, ia_lab_large, i_current_ab_predict,
+                    conf, output_path, iter_num))
+            print(f"Runtime: {time.time() - t_start:.2g} second")
+            while len(saving) > num_workers * len(output_paths):
+                saving.popleft().result()
+        for f in saving:
+            f.result()
+
+    # save the videos
+    for output_path in output_paths:
+        preprocess.frames2vid(
+            frame_folder=output_path,
+            frame_shape=conf.data.image_size,
+            output_dir=output_path,
+            filename=conf.data.output_video)
 
 
 def main():
@@ -196,9 +279,8 @@ def main():
     nn.set_default_context(ctx)
     refs = sorted(os.listdir(conf.data.ref_path))
     # sort the reference images in order
-    # Inference the input frames taking each reference image
-    for ref in refs:
-        colorize_video(conf, ref)
+    # Inference the input frames taking all the reference images
+    colorize_video(conf, refs)
 
 
 if __name__ == "__main__":
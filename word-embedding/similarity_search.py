@@ -0,0 +1,509 @@
+# Copyright 2021 Sony Group Corporation.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+#!/usr/bin/env python
+
+import numpy as np
+import time
+
+
+def normalize_embeddings(w):
+    """
+    Normalize embeddings to unit length
+
+    Args:
+        w: embedding matrix of shape (n_word, n_dim)
+
+    Returns:
+        contiguous float32 matrix whose rows have unit L2 norm.
+        Rows with zero norm are kept as zero vectors.
+
+    """
+    w = np.ascontiguousarray(w, dtype=np.float32)
+    norm = np.sqrt((w * w).sum(axis=1, keepdims=True))
+    norm[norm == 0] = 1.0
+    return np.ascontiguousarray(w / norm)
+
+
+def topk(scores, k):
+    """
+    Top-k of each row by argpartition
+
+    Args:
+        scores: score matrix of shape (n_query, n)
+        k: number of results
+
+    Returns:
+        (scores, indices) of shape (n_query, k) sorted in descending order
+
+    """
+    k = min(k, scores.shape[1])
+    ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, ids, axis=1)
+    order = np.argsort(-top, axis=1)
+    return (np.take_along_axis(top, order, axis=1),
+            np.take_along_axis(ids, order, axis=1))
+
+
+def kmeans(x, n_clusters, n_iter=20, rng=None):
+    """
+    Lloyd's k-means
+
+    Args:
+        x: data of shape (n, dim)
+        n_clusters: number of clusters
+        n_iter: number of iterations
+        rng: np.random.RandomState
+
+    Returns:
+        (centroids, assignment)
+
+    """
+    rng = rng if rng is not None else np.random.RandomState()
+    n_clusters = min(n_clusters, len(x))
+    c = x[rng.choice(len(x), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest(x, c)
+        count = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(c)
+        np.add.at(sums, assign, x)
+        empty = count == 0
+        c[~empty] = sums[~empty] / count[~empty, None]
+        # re-seed empty clusters with random points
+        c[empty] = x[rng.choice(len(x), int(empty.sum()))]
+    return c, _nearest(x, c)
+
+
+def _nearest(x, c, batch_size=65536):
+    assign = np.empty(len(x), dtype=np.int32)
+    cc = (c * c).sum(axis=1)
+    for i in range(0, len(x), batch_size):
+        xb = x[i:i + batch_size]
+        assign[i:i + batch_size] = np.argmin(cc - 2 * xb.dot(c.T), axis=1)
+    return assign
+
+
+class ExactIndex(object):
+    """
+    Brute-force cosine similarity index
+
+    """
+
+    kind = 'exact'
+
+    def __init__(self, embeddings):
+        """
+        Initialization
+
+        Args:
+            embeddings: embedding matrix of shape (n_word, n_dim)
+
+        """
+        self.w = normalize_embeddings(embeddings)
+
+    def search(self, queries, k=5, batch_size=1024):
+        """
+        Search the most similar words of query vectors
+
+        Args:
+            queries: query vectors of shape (n_query, n_dim)
+            k: number of results
+            batch_size: number of queries processed at once
+
+        Returns:
+            (scores, ids) of shape (n_query, k)
+
+        """
+        q = normalize_embeddings(np.atleast_2d(queries))
+        scores, ids = [], []
+        for i in range(0, len(q), batch_size):
+            s, j = topk(q[i:i + batch_size].dot(self.w.T), k)
+            scores.append(s)
+            ids.append(j)
+        return np.vstack(scores), np.vstack(ids)
+
+    def search_ids(self, word_ids, k=5, exclude_self=True, batch_size=1024):
+        """
+        Search the most similar words of words in the vocabulary
+
+        Args:
+            word_ids: query word ids
+            k: number of results
+            exclude_self: whether the query word itself is removed from results
+            batch_size: number of queries processed at once
+
+        Returns:
+            (scores, ids) of shape (n_query, k)
+
+        """
+        word_ids = np.atleast_1d(word_ids)
+        scores, ids = self.search(self.w[word_ids], k + int(exclude_self),
+                                  batch_size)
+        if exclude_self:
+            scores, ids = _exclude(scores, ids, word_ids, k)
+        return scores, ids
+
+    def state_dict(self):
+        return dict(w=self.w)
+
+    @classmethod
+    def from_state_dict(cls, state):
+        index = cls.__new__(cls)
+        index.w = np.ascontiguousarray(state['w'], dtype=np.float32)
+        return index
+
+    def save(self, path):
+        save_index(self, path)
+
+
+class IVFPQIndex(object):
+    """
+    Approximate index by inverted file and product quantization (IVF-PQ)
+
+    Normalized embeddings are assigned to `n_list` coarse clusters and
+    their residuals are encoded with `n_subspace` uint8 sub-quantizers.
+    A query only visits `n_probe` clusters and scores the codes by table
+    lookup, optionally re-ranking the best candidates with exact vectors.
+
+    """
+
+    kind = 'ivfpq'
+
+    def __init__(self, n_list=64, n_subspace=10, n_bits=8, n_probe=8,
+                 n_rerank=0, n_iter=20, seed=0):
+        """
+        Initialization
+
+        Args:
+            n_list: number of coarse clusters
+            n_subspace: number of sub-quantizers. Must divide n_dim.
+            n_bits: bits per sub-quantizer code (at most 8)
+            n_probe: number of clusters visited per query
+            n_rerank: number of candidates re-ranked with exact vectors.
+                Exact vectors are not stored when it is 0.
+            n_iter: number of k-means iterations in training
+            seed: random seed
+
+        """
+        if n_bits > 8:
+            raise ValueError('n_bits must be at most 8, got %d' % n_bits)
+        self.n_list = n_list
+        self.n_subspace = n_subspace
+        self.n_bits = n_bits
+        self.n_probe = n_probe
+        self.n_rerank = n_rerank
+        self.n_iter = n_iter
+        self.seed = seed
+
+    def train(self, embeddings):
+        """
+        Build the index from embeddings
+
+        Args:
+            embeddings: embedding matrix of shape (n_word, n_dim)
+
+        Returns:
+            self
+
+        """
+        w = normalize_embeddings(embeddings)
+        n_word, n_dim = w.shape
+        if n_dim % self.n_subspace != 0:
+            raise ValueError('n_subspace (%d) must divide the embedding dimension (%d)'
+                             % (self.n_subspace, n_dim))
+        rng = np.random.RandomState(self.seed)
+
+        # coarse quantizer
+        self.centroids, assign = kmeans(w, self.n_list, self.n_iter, rng)
+        self.n_list = len(self.centroids)
+        residual = w - self.centroids[assign]
+
+        # product quantizer of residuals
+        d_sub = n_dim // self.n_subspace
+        n_code = 2 ** self.n_bits
+        self.codebooks = np.zeros(
+            (self.n_subspace, min(n_code, n_word), d_sub), dtype=np.float32)
+        codes = np.empty((n_word, self.n_subspace), dtype=np.uint8)
+        for m in range(self.n_subspace):
+            sub = np.ascontiguousarray(residual[:, m * d_sub:(m + 1) * d_sub])
+            self.codebooks[m], codes[:, m] = kmeans(
+                sub, n_code, self.n_iter, rng)
+
+        # inverted lists stored as one array sorted by cluster
+        order = np.argsort(assign, kind='stable')
+        self.list_ids = order.astype(np.int32)
+        self.list_codes = np.ascontiguousarray(codes[order])
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=self.n_list))]).astype(np.int64)
+        self.w = w if self.n_rerank > 0 else None
+        return self
+
+    def _candidates(self, lists):
+        ranges = [np.arange(self.list_offsets[c], self.list_offsets[c + 1])
+                  for c in lists]
+        return np.concatenate(ranges)
+
+    def search(self, queries, k=5, batch_size=1024):
+        """
+        Search the most similar words of query vectors
+
+        Args:
+            queries: query vectors of shape (n_query, n_dim)
+            k: number of results
+            batch_size: number of queries processed at once
+
+        Returns:
+            (scores, ids) of shape (n_query, k). Missing results are
+            filled with score -inf and id -1.
+
+        """
+        q = normalize_embeddings(np.atleast_2d(queries))
+        n_query, n_dim = q.shape
+        d_sub = n_dim // self.n_subspace
+        n_probe = min(self.n_probe, self.n_list)
+        scores = np.full((n_query, k), -np.inf, dtype=np.float32)
+        ids = np.full((n_query, k), -1, dtype=np.int64)
+        sub_index = np.arange(self.n_subspace)
+
+        for i in range(0, n_query, batch_size):
+            qb = q[i:i + batch_size]
+            # coarse scores and lookup tables are computed for the whole batch
+            coarse = qb.dot(self.centroids.T)
+            _, probes = topk(coarse, n_probe)
+            tables = np.einsum('qmd,mkd->qmk',
+                               qb.reshape(len(qb), self.n_subspace, d_sub),
+                               self.codebooks)
+            for j in range(len(qb)):
+                pos = self._candidates(probes[j])
+                if len(pos) == 0:
+                    continue
+                cand_codes = self.list_codes[pos]
+                s = tables[j][sub_index, cand_codes].sum(axis=1)
+                cluster = np.searchsorted(
+                    self.list_offsets, pos, side='right') - 1
+                s += coarse[j, cluster]
+                cand = self.list_ids[pos]
+                if self.w is not None:
+                    n = min(max(self.n_rerank, k), len(cand))
+                    _, best = topk(s[None], n)
+                    cand = cand[best[0]]
+                    s = self.w[cand].dot(qb[j])
+                ts, tj = topk(s[None], k)
+                scores[i + j, :ts.shape[1]] = ts[0]
+                ids[i + j, :tj.shape[1]] = cand[tj[0]]
+        return scores, ids
+
+    def search_ids(self, word_ids, k=5, exclude_self=True, batch_size=1024):
+        """
+        Search the most similar words of words in the vocabulary
+
+        The query vectors are reconstructed from the index unless exact
+        vectors are stored for re-ranking.
+
+        Args:
+            word_ids: query word ids
+            k: number of results
+            exclude_self: whether the query word itself is removed from results
+            batch_size: number of queries processed at once
+
+        Returns:
+            (scores, ids) of shape (n_query, k)
+
+        """
+        word_ids = np.atleast_1d(word_ids)
+        scores, ids = self.search(self.reconstruct(word_ids),
+                                  k + int(exclude_self), batch_size)
+        if exclude_self:
+            scores, ids = _exclude(scores, ids, word_ids, k)
+        return scores, ids
+
+    def reconstruct(self, word_ids):
+        """
+        Get (approximate) normalized vectors of words
+
+        Args:
+            word_ids: word ids
+
+        Returns:
+            vectors of shape (len(word_ids), n_dim)
+
+        """
+        if self.w is not None:
+            return self.w[word_ids]
+        pos = np.empty(len(self.list_ids), dtype=np.int64)
+        pos[self.list_ids] = np.arange(len(self.list_ids))
+        pos = pos[word_ids]
+        cluster = np.searchsorted(self.list_offsets, pos, side='right') - 1
+        codes = self.list_codes[pos]
+        sub = self.codebooks[np.arange(self.n_subspace), codes]
+        return self.centroids[cluster] + sub.reshape(len(pos), -1)
+
+    def state_dict(self):
+        state = dict(centroids=self.centroids, codebooks=self.codebooks,
+                     list_ids=self.list_ids, list_codes=self.list_codes,
+                     list_offsets=self.list_offsets,
+                     config=np.array([self.n_list, self.n_subspace, self.n_bits,
+                                      self.n_probe, self.n_rerank]))
+        if self.w is not None:
+            state['w'] = self.w
+        return state
+
+    @classmethod
+    def from_state_dict(cls, state):
+        n_list, n_subspace, n_bits, n_probe, n_rerank = [
+            int(v) for v in state['config']]
+        index = cls(n_list, n_subspace, n_bits, n_probe, n_rerank)
+        index.centroids = state['centroids']
+        index.codebooks = state['codebooks']
+        index.list_ids = state['list_ids']
+        index.list_codes = state['list_codes']
+        index.list_offsets = state['list_offsets']
+        index.w = state['w'] if 'w' in state else None
+        return index
+
+    def save(self, path):
+        save_index(self, path)
+
+
+def _exclude(scores, ids, word_ids, k):
+    """
+    Remove query words from results, keeping k results per query
+
+    """
+    keep = ids != word_ids[:, None]
+    # drop the last column for rows where the query word was not found
+    keep[keep.all(axis=1), -1] = False
+    n_query = len(ids)
+    return (scores[keep].reshape(n_query, -1)[:, :k],
+            ids[keep].reshape(n_query, -1)[:, :k])
+
+
+INDEX_CLASSES = {c.kind: c for c in [ExactIndex, IVFPQIndex]}
+
+
+def save_index(index, path):
+    """
+    Save an index to a .npz file
+
+    Args:
+        index: ExactIndex or IVFPQIndex
+        path: output file path
+
+    """
+    np.savez(path, kind=np.array(index.kind), **index.state_dict())
+
+
+def load_index(path):
+    """
+    Load an index saved by `save_index`
+
+    Args:
+        path: .npz file path
+
+    Returns:
+        ExactIndex or IVFPQIndex
+
+    """
+    with np.load(path) as f:
+        state = {key: f[key] for key in f.files}
+    kind = str(state.pop('kind'))
+    if kind not in INDEX_CLASSES:
+        raise ValueError('Unknown index type: %s' % kind)
+    return INDEX_CLASSES[kind].from_state_dict(state)
+
+
+def load_embeddings(model_file, param_name='e1/embed/W'):
+    """
+    Load the trained embedding matrix
+
+    Args:
+        model_file: parameter file saved by word_embedding.py
+        param_name: name of the embedding parameter
+
+    Returns:
+        embedding matrix as numpy array
+
+    """
+    import nnabla as nn
+    nn.load_parameters(model_file)
+    return nn.get_parameters(grad_only=False)[param_name].d.copy()
+
+
+def get_args():
+    """
+    Get command line arguments.
+    Arguments set the default values of command line arguments.
+    """
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model-file", "-m", type=str,
+                        default="tmp.result.w2v/model.h5",
+                        help='Parameter file saved by word_embedding.py')
+    parser.add_argument("--index", "-i", type=str, default='exact',
+                        choices=['exact', 'ivfpq'], help='Index type.')
+    parser.add_argument("--load-index", type=str, default=None,
+                        help='Load a saved index instead of building it.')
+    parser.add_argument("--save-index", type=str, default=None,
+                        help='Save the built index to this .npz file.')
+    parser.add_argument("--n-list", type=int, default=64)
+    parser.add_argument("--n-subspace", type=int, default=10)
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument("--n-rerank", type=int, default=0)
+    parser.add_argument("--top-k", "-k", type=int, default=5)
+    parser.add_argument("--query", "-q", type=str, nargs='*', default=[],
+                        help='Query words.')
+    parser.add_argument("--benchmark", type=int, default=0,
+                        help='Number of random queries used to measure queries/sec.')
+    parser.add_argument("--batch-size", "-b", type=int, default=1024)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if args.load_index:
+        index = load_index(args.load_index)
+    else:
+        w = load_embeddings(args.model_file)
+        if args.index == 'exact':
+            index = ExactIndex(w)
+        else:
+            index = IVFPQIndex(n_list=args.n_list, n_subspace=args.n_subspace,
+                               n_probe=args.n_probe, n_rerank=args.n_rerank).train(w)
+    if args.save_index:
+        save_index(index, args.save_index)
+
+    if args.query:
+        from word_embedding import load_ptbset, output_similar_words
+        data_file = "https://raw.githubusercontent.com/tomsercu/lstm/master/data/ptb.train.txt"
+        itow, wtoi, _ = load_ptbset(data_file)
+        word_ids = np.array([wtoi[w] for w in args.query])
+        scores, ids = index.search_ids(word_ids, args.top_k,
+                                       batch_size=args.batch_size)
+        for k, s, i in zip(word_ids, scores, ids):
+            output_similar_words(itow, k, i, s)
+
+    if args.benchmark > 0:
+        n_word = len(index.w) if getattr(index, 'w', None) is not None \
+            else len(index.list_ids)
+        word_ids = np.random.randint(0, n_word, size=args.benchmark)
+        start = time.time()
+        index.search_ids(word_ids, args.top_k, batch_size=args.batch_size)
+        elapsed = time.time() - start
+        print('%d queries in %.3f sec: %.1f queries/sec' %
+              (args.benchmark, elapsed, args.benchmark / elapsed))
+
+
+if __name__ == '__main__':
+    main()
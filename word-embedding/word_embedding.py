@@ -29,6 +29,8 @@ import nnabla.monitor as M
 
 from nnabla.utils.data_source_loader import download
 
+from similarity_search import ExactIndex
+
 
 def load_ptbset(ptbfile):
     """
@@ -60,61 +62,65 @@ class CategoricalSampler(object):
     Categoricl Sampler
     - the sampler for getting negative samples
 
+    Negative samples are drawn from the powered unigram distribution
+    with Walker's alias method, so that one sample costs O(1)
+    regardless of the vocabulary size.
+
     """
 
-    def calc_random_method_selection_rate(self, k, histogram, gamma):
+    def __init__(self, dataset, gamma=0.75, rng=None):
         """
-        Calculate 2 random type selection rate
-           In this example, the sampler combines 2 random method
-             - sample from dataset
-             - sample from uniform random of n_category
-        This operation intends to simulate the distribution of
-        powered histogram.
-
-        This function calculate the rate of 2 random method
-        minimizing the difference between real distribution and combined distribution
+        Initialization
 
         Args:
-            k: number of category
-            histogram : histogram
+            dataset: word corpus replaced id
             gamma : power of histogram in negative sampling
+            rng: np.random.RandomState used for sampling
 
-        Returns:
-            rate of randomizing method
         """
 
-        p = histogram
-        p /= np.sum(p)
+        dataset = np.asarray(dataset, dtype=np.int32)
+        self.rng = rng if rng is not None else np.random.RandomState()
+
+        # create histogram
+        histogram = np.bincount(dataset).astype(np.float64)
+        self.n_category = len(histogram)
 
         q = np.power(histogram, gamma)
         q /= np.sum(q)
+        self.prob, self.alias = self.build_alias_table(q)
 
-        c = 1.0 / k
-
-        alpha = np.sum((p - q) * (p - q)) / np.sum((p - c) * (p - c))
-
-        rate = (1 - alpha) / ((1 - alpha) + c)
-        return rate
-
-    def __init__(self, dataset, gamma=0.75):
+    @staticmethod
+    def build_alias_table(q):
         """
-        Initialization
+        Build the alias table of a categorical distribution (Vose's method)
 
         Args:
-            dataset: word corpus replaced id 
+            q: probabilities of each category
 
-        """
+        Returns:
+            acceptance probabilities and alias indices
 
-        n_category = np.max(dataset)
-        self.n_category = n_category
-        self.dataset = np.array(dataset)
+        """
 
-        # create histogram
-        histogram = [0] * (n_category + 1)
-        for wid in dataset:
-            histogram[wid] += 1
-        self.rate = self.calc_random_method_selection_rate(
-            n_category, histogram, gamma)
+        n = len(q)
+        prob = np.asarray(q, dtype=np.float64) * n
+        alias = np.arange(n, dtype=np.int32)
+
+        small = list(np.where(prob < 1.0)[0])
+        large = list(np.where(prob >= 1.0)[0])
+        while small and large:
+            s = small.pop()
+            g = large[-1]
+            alias[s] = g
+            prob[g] -= 1.0 - prob[s]
+            if prob[g] < 1.0:
+                small.append(large.pop())
+
+        # remaining entries are 1 up to rounding error
+        prob[large] = 1.0
+        prob[small] = 1.0
+        return prob, alias
 
     def sample(self, shape):
         """
@@ -127,48 +133,55 @@ class CategoricalSampler(object):
             values
 
         """
-        if np.random.rand() < self.rate:
-            indices = np.random.randint(
-                low=0, high=len(self.dataset), size=shape)
-            return self.dataset[indices]
-        else:
-            return np.random.randint(low=0, high=self.n_category, size=shape)
+        k = self.rng.randint(low=0, high=self.n_category, size=shape)
+        accept = self.rng.random_sample(size=shape) < self.prob[k]
+        return np.where(accept, k, self.alias[k]).astype(np.int32)
+
 
+def context_offsets(half_window):
+    """
+    Relative positions of context words around a center word
+
+    Args:
+        half_window: half window size
+
+    Returns:
+        offsets of the context words, e.g. [-2, -1, 1, 2] for half_window=3
+
+    """
+    return np.hstack([np.arange(-half_window + 1, 0),
+                      np.arange(1, half_window)]).astype(np.int64)
 
-def create_minibatch(dataset, ids, sampler, half_window=3, n_negative=5):
+
+def create_minibatch(dataset, ids, sampler, half_window=3, n_negative=5,
+                     offsets=None):
     """
     Create minibatch
 
     Args:
+        dataset: corpus as an int32 array
         ids: indices
         sampler: sampler functions
         half_window: half window size
         n_negative: number of negative samples
+        offsets: precomputed context offsets (see `context_offsets`)
 
     Returns:
         list of x(word) y(context) t(positive, negative)
 
     """
 
-    # loop
-    xp, yp = [], []
-    for i in ids:
-
-        # positive-context
-        wc = np.array(dataset[i - half_window + 1:i] +
-                      dataset[i + 1:i + half_window])
-        xp.append(wc)
-
-        # positive-word
-        wt = np.array(dataset[i]).repeat((half_window - 1) * 2)
-        yp.append(wt)
+    dataset = np.asarray(dataset, dtype=np.int32)
+    ids = np.asarray(ids)
+    if offsets is None:
+        offsets = context_offsets(half_window)
 
     # positive-context
-    xp = np.hstack(xp)
+    # gather all the windows at once through the offset matrix
+    xp = dataset[ids[:, None] + offsets[None, :]].ravel()
 
     # positive-word
-    yp = np.hstack(yp)
-    # yp = np.array(dataset)[ids].repeat((half_window - 1) * 2) # is possible but slower than above line
+    yp = dataset[ids].repeat(len(offsets))
 
     # positive-label
     tp = np.ones(len(xp), dtype=np.int32)
@@ -189,8 +202,29 @@ def create_minibatch(dataset, ids, sampler, half_window=3, n_negative=5):
     return [x, y, t]
 
 
+def subsample_keep_prob(dataset, threshold):
+    """
+    Probability of keeping each word in frequent-word subsampling
+
+    Args:
+        dataset: corpus as an int32 array
+        threshold: subsampling threshold (e.g. 1e-5)
+
+    Returns:
+        keep probability for each word id
+
+    """
+    freq = np.bincount(dataset).astype(np.float64)
+    freq /= np.sum(freq)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keep = np.sqrt(threshold / freq) + threshold / freq
+    keep[freq == 0] = 0.0
+    return np.minimum(keep, 1.0)
+
+
 class DataIteratorForEmbeddingLearning():
-    def __init__(self, batchsize, half_window, n_negative, dataset):
+    def __init__(self, batchsize, half_window, n_negative, dataset,
+                 subsample_threshold=0.0, prefetch=0, seed=None):
         """
         Initialization
 
@@ -199,34 +233,57 @@ class DataIteratorForEmbeddingLearning():
             half_window: half window length
             n_negative: number of negative samples
             dataset: corpus replaced with word ids
+            subsample_threshold: threshold of frequent-word subsampling.
+                Subsampling is disabled when it is 0.
+            prefetch: number of minibatches created ahead of time by
+                a background thread. No thread is used when it is 0.
+            seed: random seed
 
         """
 
         self.batchsize = batchsize
         self.half_window = half_window
         self.n_negative = n_negative
-        self.dataset = dataset
+        self.corpus = np.asarray(dataset, dtype=np.int32)
+        self.dataset = self.corpus
         self.counter = 0
-        self.datasize = len(dataset)
-        self.sampler = CategoricalSampler(dataset)
-        self.indices = np.random.permutation(
-            self.datasize - 2 * self.half_window) + self.half_window
-        self.n_batch = self.datasize // batchsize - 1
-
-    def next(self, ):
+        self.rng = np.random.RandomState(seed)
+        self.sampler = CategoricalSampler(self.corpus, rng=self.rng)
+        self.offsets = context_offsets(half_window)
+
+        self.keep_prob = None
+        n_expected = len(self.corpus)
+        if subsample_threshold > 0:
+            self.keep_prob = subsample_keep_prob(
+                self.corpus, subsample_threshold)
+            n_expected = int(np.sum(self.keep_prob[self.corpus]))
+
+        self._reset()
+        self.n_batch = max(n_expected // batchsize - 1, 1)
+
+        self._queue = None
+        self._thread = None
+        if prefetch > 0:
+            self._start_prefetch(prefetch)
+
+    def _reset(self):
         """
-        Creating minibatch
-
-        Returns:
-            list of x(word_id) y(context) t(positive, negative)
+        Shuffle the center words (and subsample the corpus) for a new epoch
 
         """
+        if self.keep_prob is not None:
+            keep = self.rng.random_sample(
+                len(self.corpus)) < self.keep_prob[self.corpus]
+            self.dataset = self.corpus[keep]
+        self.datasize = len(self.dataset)
+        self.indices = self.rng.permutation(
+            self.datasize - 2 * self.half_window) + self.half_window
+        self.counter = 0
 
+    def _next(self):
         # To ensure indices do not exceed datasize, if position reaches to end
-        if self.datasize <= self.counter + self.batchsize:
-            self.counter = 0
-            self.indices = np.random.permutation(
-                self.datasize - 2 * self.half_window) + self.half_window
+        if len(self.indices) < self.counter + self.batchsize:
+            self._reset()
 
         # Context indices
         # terminations are already cared
@@ -236,33 +293,82 @@ class DataIteratorForEmbeddingLearning():
         self.counter += self.batchsize
 
         # Create minibatch
-        return create_minibatch(self.dataset, ids, self.sampler, self.half_window, self.n_negative)
+        return create_minibatch(self.dataset, ids, self.sampler,
+                                self.half_window, self.n_negative,
+                                self.offsets)
+
+    def _start_prefetch(self, prefetch):
+        import queue
+        import threading
+
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+
+        def worker():
+            while not self._stop.is_set():
+                try:
+                    batch = self._next()
+                except Exception as e:
+                    # Raised again by next() in the main thread
+                    batch = e
+                while not self._stop.is_set():
+                    try:
+                        self._queue.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if isinstance(batch, Exception):
+                    break
+
+        self._thread = threading.Thread(target=worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def next(self, ):
+        """
+        Creating minibatch
+
+        Returns:
+            list of x(word_id) y(context) t(positive, negative)
+
+        """
+        if self._queue is not None:
+            batch = self._queue.get()
+            if isinstance(batch, Exception):
+                raise batch
+            return batch
+        return self._next()
+
+    def close(self):
+        """
+        Stop the prefetch thread if running
+
+        """
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._queue = None
 
 
-def output_similar_words(itow, k, similarity):
+def output_similar_words(itow, k, ids, scores):
     """
     Function for outputting similar words
 
     Args:
         itow : dictionary of index to word
         k : query word id
-        similarity: calculated similarity
+        ids: ids of similar words in descending order of similarity
+        scores: similarity of each word in ids
 
     """
-    n_result = 5  # number of search result to show
     print('query_word: id=%d, %s' % (k, itow[k]))
-    count = 0
 
     # Enumerate similar words
-    for i in (-similarity).argsort():
-        if np.isnan(similarity[i]):
+    for i, s in zip(ids, scores):
+        if i < 0:
             continue
-        if i == k:
-            continue
-        print('id=%d, %s: %f' % (i, itow[i], similarity[i]))
-        count += 1
-        if count == n_result:
-            break
+        print('id=%d, %s: %f' % (i, itow[i], s))
 
 
 def get_args():
@@ -285,6 +391,10 @@ def get_args():
     parser.add_argument("--batchsize", "-b", type=int, default=100)
     parser.add_argument("--half-window-length", "-wl", type=int, default=3)
     parser.add_argument("--n-negative-sample", "-ns", type=int, default=5)
+    parser.add_argument("--subsample-threshold", "-st", type=float, default=0.0,
+                        help='Threshold of frequent-word subsampling (e.g. 1e-5). Disabled if 0.')
+    parser.add_argument("--prefetch", "-pf", type=int, default=4,
+                        help='Number of minibatches prepared by a background thread. Disabled if 0.')
 
     parser.add_argument("--learning-rate", "-l", type=float, default=1e-3)
     parser.add_argument("--max-epoch", "-i", type=int, default=20)
@@ -322,7 +432,9 @@ def main():
         batchsize=batchsize,
         half_window=half_window,
         n_negative=n_negative,
-        dataset=dataset)
+        dataset=dataset,
+        subsample_threshold=args.subsample_threshold,
+        prefetch=args.prefetch)
 
     # Create model
     # - Real batch size including context samples and negative samples
@@ -346,10 +458,6 @@ def main():
     loss = F.sigmoid_cross_entropy(hl, tl)
     loss = F.mean(loss)
 
-    # Model for test of searching similar words
-    xr = nn.Variable((1,), need_grad=False)
-    hr = PF.embed(xr, n_word, n_dim, name="e1")  # feature vector for test
-
     # Create solver
     solver = S.Adam(args.learning_rate)
     solver.set_parameters(nn.get_parameters())
@@ -383,26 +491,20 @@ def main():
             monitor_loss.add(itr, loss.d)
             monitor_time.add(itr)
 
+    di.close()
+
     # Save model
     nn.save_parameters(model_file)
 
     # Evaluate by similarity
-    max_check_words = args.max_check_words
-    for i in range(max_check_words):
-
-        # prediction
-        xr.d = i
-        hr.forward(clear_buffer=True)
-        h = hr.d
-
-        # similarity calculation
-        w = nn.get_parameters()['e1/embed/W'].d
-        s = np.sqrt((w * w).sum(1))
-        w /= s.reshape((s.shape[0], 1))
-        similarity = w.dot(h[0]) / s[i]
+    n_result = 5  # number of search result to show
+    index = ExactIndex(nn.get_parameters()['e1/embed/W'].d)
+    query_ids = np.arange(args.max_check_words)
+    scores, ids = index.search_ids(query_ids, n_result)
+    for k, s, i in zip(query_ids, scores, ids):
 
         # for understanding
-        output_similar_words(itow, i, similarity)
+        output_similar_words(itow, k, i, s)
 
 
 if __name__ == '__main__':